@@ -4,7 +4,9 @@ import random
 import logging
 import os
 import uuid
-from datetime import datetime
+from session_store import session_namespace, get_session_store, session_lock
+from records import MessageRecord, ROLE_USER, ROLE_BOT
+from conversation import ConversationHistory
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # For session management
@@ -20,34 +22,32 @@ CORS(app,
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-# Store conversation history
-conversation_history = {}
+# Store conversation history in the shared session store; a history read from it has to
+# be assigned back after it is changed. Idle sessions are expired by the store in the
+# background, so requests never scan the stored conversations.
+conversation_history = session_namespace("app_conversation")
+
+# Each history keeps the last 10 messages to prevent memory issues
+HISTORY_TURNS = 10
 
 # Simple rules-based response logic for mental health chatbot
 def generate_response(message, session_id):
     message = message.lower()
 
     # Get or create conversation history for this session
-    if session_id not in conversation_history:
-        conversation_history[session_id] = []
-
-    # Add user message to history
-    conversation_history[session_id].append({
-        'role': 'user',
-        'content': message,
-        'timestamp': datetime.now().isoformat()
-    })
+    history = conversation_history.get(session_id)
+    if history is None:
+        history = ConversationHistory(HISTORY_TURNS)
 
-    # Limit history to last 10 messages to prevent memory issues
-    if len(conversation_history[session_id]) > 10:
-        conversation_history[session_id] = conversation_history[session_id][-10:]
+    # Add user message to history; the oldest message is dropped once it is full
+    history.append(MessageRecord.now(ROLE_USER, message))
 
     # Check for patterns in the message
     greetings = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
     feelings = ['sad', 'depressed', 'unhappy', 'stress', 'anxiety', 'lonely', 'tired', 'angry', 'worried', 'overwhelmed']
 
     # Check if this is a follow-up question
-    is_followup = len(conversation_history[session_id]) > 2
+    is_followup = len(history) > 2
 
     # Generate appropriate response based on context
     response = ""
@@ -59,7 +59,7 @@ def generate_response(message, session_id):
             "Hey! What's on your mind?"
         ])
     elif any(feel in message for feel in feelings):
-        if is_followup and any(feel in conversation_history[session_id][-3]['content'] for feel in feelings):
+        if is_followup and any(feel in history[-3].content for feel in feelings):
             # If user mentioned feelings before, provide a deeper response
             response = random.choice([
                 "You've mentioned feeling this way before. Has anything changed since we last talked?",
@@ -82,11 +82,8 @@ def generate_response(message, session_id):
                 "If you feel overwhelmed, consider reaching out to a mental health professional.")
 
     # Add bot response to history
-    conversation_history[session_id].append({
-        'role': 'bot',
-        'content': response,
-        'timestamp': datetime.now().isoformat()
-    })
+    history.append(MessageRecord.now(ROLE_BOT, response))
+    conversation_history[session_id] = history
 
     return response
 
@@ -111,8 +108,11 @@ def chat():
         else:
             logging.info(f"Using existing session ID: {session_id}")
 
-        # Generate response based on message and conversation history
-        reply = generate_response(user_message, session_id)
+        # Generate response based on message and conversation history. Requests of the
+        # same session run one at a time, so none of them overwrites the state another
+        # one has just saved
+        with session_lock(session_id):
+            reply = generate_response(user_message, session_id)
         logging.info(f"Generated reply: {reply}")
 
         # Create response with session cookie
@@ -139,6 +139,11 @@ def chat():
 
         return error_response, 400
 
+# Report how much memory session state uses and how many sessions were evicted
+@app.route('/stats/sessions', methods=['GET'])
+def session_stats():
+    return jsonify(get_session_store().stats())
+
 # Add OPTIONS method handler for CORS preflight requests
 @app.route('/chat', methods=['OPTIONS'])
 def handle_options():
@@ -149,24 +154,6 @@ def handle_options():
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
-# Clean up old conversations periodically
-@app.before_request
-def cleanup_old_sessions():
-    # This is a simple cleanup that runs before each request
-    # In a production app, you'd want to do this in a background task
-    current_time = datetime.now()
-    sessions_to_remove = []
-
-    for session_id, history in conversation_history.items():
-        if history:
-            last_message_time = datetime.fromisoformat(history[-1]['timestamp'])
-            # Remove sessions older than 24 hours
-            if (current_time - last_message_time).total_seconds() > 86400:
-                sessions_to_remove.append(session_id)
-
-    for session_id in sessions_to_remove:
-        del conversation_history[session_id]
-
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
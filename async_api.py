@@ -0,0 +1,519 @@
+"""
+Asyncio version of the Llama chat backend.
+
+Serves the same /chat API as llama_api.py with aiohttp. While a message waits for the
+Llama API it holds no thread, only a coroutine, so one process can keep thousands of
+conversations in flight; with the Flask backends every waiting message pins one of a few
+worker threads.
+
+The reply pipeline is llama_api's, split around the API call: the detectors, response
+handlers and session store updates are CPU-bound or blocking, so they run on a bounded
+thread pool, and only the HTTP call to the Llama API is awaited on the event loop.
+Outbound API calls are limited by a semaphore, so a burst of messages queues here instead
+of flooding the API.
+
+Configured with environment variables, in addition to llama_api's and the session store's:
+
+- PORT: Port to listen on (default 5000)
+- LLM_MAX_CONCURRENCY: Maximum number of Llama API calls in flight (default 256)
+- ASYNC_EXECUTOR_WORKERS: Threads running the CPU-bound part of each message (default 4)
+- CHAT_DEADLINE_SECONDS: Time a /chat reply is due in, as for the Flask backends (see deadline.py)
+- LLM_BATCH_MAX_SIZE, LLM_BATCH_WINDOW_MS: Batching of concurrent Llama API calls (see inference_batcher.py)
+
+Usage:
+    python async_api.py
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+
+from circuit_breaker import CircuitOpenError, circuit_breaker_stats, get_circuit_breaker, is_failure_status
+from completion_cache import get_completion_cache
+from deadline import chat_deadline
+from inference_batcher import AsyncInferenceBatcher, create_async_inference_batcher
+from llama_api import (
+    LLAMA_PROVIDER, PendingReply, StreamedReply, prepare_llama_response, finish_llama_response, finish_streamed_reply,
+    cache_llama_response, sse_event
+)
+from llm_client import DEFAULT_POOL_MAXSIZE, backend_timeouts
+from session_store import get_session_store
+
+DEFAULT_MAX_CONCURRENCY = 256
+DEFAULT_EXECUTOR_WORKERS = 4
+
+class AsyncLLMClient:
+    """
+    aiohttp client for the LLM APIs, with per-backend timeouts and circuit breakers, and a
+    concurrency limit.
+
+    Args:
+        max_concurrency (int): Maximum number of requests in flight; more wait their turn
+        pool_size (int): Maximum number of connections kept open to the APIs
+        timeouts (dict): Backend name -> (connect timeout, read timeout) in seconds
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, pool_size=DEFAULT_MAX_CONCURRENCY, timeouts=None):
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.timeouts = {
+            backend: aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+            for backend, (connect_timeout, read_timeout) in (timeouts or backend_timeouts()).items()
+        }
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.waiting = 0
+
+    async def start(self):
+        # The session has to be created on the running event loop. The API responses'
+        # cookies are never stored, so nothing carries over between users' requests.
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            cookie_jar=aiohttp.DummyCookieJar()
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    @contextlib.asynccontextmanager
+    async def _slot(self):
+        # A place under the concurrency limit for one request
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def post(self, backend, url, headers=None, json=None):
+        """
+        POST to an LLM API once a slot under the concurrency limit is free.
+
+        Args:
+            backend (str): Backend name, a key of `timeouts`
+            url (str): API endpoint
+            headers (dict): Request headers
+            json: JSON body
+
+        Returns:
+            tuple: (status code, response body), or (None, None) if the API could not be
+                reached or timed out, or its circuit breaker is open
+        """
+        # Rejected before queueing for a slot, so the fallback reply isn't held up either
+        breaker = get_circuit_breaker(backend)
+        if not breaker.allow():
+            return None, None
+
+        try:
+            async with self._slot():
+                async with self._session.post(url, headers=headers, json=json, timeout=self.timeouts[backend]) as response:
+                    body = await response.text()
+        except asyncio.CancelledError:
+            # Cancelled; that says nothing about the API
+            breaker.cancel()
+            raise
+        except Exception as e:
+            # Like the sync client's callers, any error (an unreadable body too) fails the call
+            self.errors += 1
+            breaker.record(False)
+            logging.error(f"Error calling API: {e!r}")
+            return None, None
+        breaker.record(not is_failure_status(response.status))
+        return response.status, body
+
+    @contextlib.asynccontextmanager
+    async def stream(self, backend, url, headers=None, json=None):
+        """
+        POST to an LLM API, for reading the response body as it arrives.
+
+        Holds its slot under the concurrency limit until the response is done with.
+
+        Args:
+            backend (str): Backend name, a key of `timeouts`
+            url (str): API endpoint
+            headers (dict): Request headers
+            json: JSON body
+
+        Yields:
+            aiohttp.ClientResponse: The API's response, body not read yet
+
+        Raises:
+            CircuitOpenError: If the backend's circuit breaker is open; no request is sent
+            aiohttp.ClientError, asyncio.TimeoutError: If the API can't be reached or times out
+        """
+        breaker = get_circuit_breaker(backend)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit for {backend} is open")
+
+        # The call's outcome is known once the response has started
+        recorded = False
+        try:
+            async with self._slot():
+                async with self._session.post(url, headers=headers, json=json, timeout=self.timeouts[backend]) as response:
+                    breaker.record(not is_failure_status(response.status))
+                    recorded = True
+                    yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors += 1
+            if not recorded:
+                breaker.record(False)
+            raise
+        except asyncio.CancelledError:
+            if not recorded:
+                breaker.cancel()
+            raise
+        except Exception:
+            if not recorded:
+                breaker.record(False)
+            raise
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+        }
+
+class AsyncSessionLocks:
+    """
+    Per-session asyncio locks, so a session's messages are handled one at a time without
+    blocking the event loop. A session's lock is dropped once nobody holds or waits for it.
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    def lock(self, session_id):
+        return _AsyncSessionLock(self, session_id)
+
+    def __len__(self):
+        return len(self._locks)
+
+class _AsyncSessionLock:
+    def __init__(self, locks, session_id):
+        self._locks = locks._locks
+        self._session_id = session_id
+
+    async def __aenter__(self):
+        entry = self._locks.get(self._session_id)
+        if entry is None:
+            entry = self._locks[self._session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self._entry = entry
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._release_entry()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self._entry[0].release()
+        self._release_entry()
+
+    def _release_entry(self):
+        self._entry[1] -= 1
+        if self._entry[1] == 0:
+            del self._locks[self._session_id]
+
+llm_client_key = web.AppKey("llm_client", AsyncLLMClient)
+executor_key = web.AppKey("executor", ThreadPoolExecutor)
+session_locks_key = web.AppKey("session_locks", AsyncSessionLocks)
+# Llama API calls in flight, kept referenced while they run on after a missed deadline
+llm_calls_key = web.AppKey("llm_calls", set)
+# None if batching is disabled
+batcher_key = web.AppKey("inference_batcher", AsyncInferenceBatcher)
+
+async def call_llama_api_async(app, payload):
+    """
+    Async counterpart of llama_api.call_llama_api; caches a successful answer.
+
+    Args:
+        app (web.Application): The application, holding the client and executor
+        payload (dict): Request for the inference API
+
+    Returns:
+        tuple: (status code, response body), or (None, None) if the API could not be reached
+    """
+    if app[batcher_key] is not None:
+        status_code, body = await app[batcher_key].submit(payload)
+    else:
+        status_code, body = await post_llama_api_async(app, payload)
+    await asyncio.get_running_loop().run_in_executor(app[executor_key], cache_llama_response, payload, status_code, body)
+    return status_code, body
+
+async def post_llama_api_async(app, payload):
+    # Send one request to the Llama API; the answer is in the HuggingFace format
+    provider = LLAMA_PROVIDER
+    status_code, body = await app[llm_client_key].post(
+        provider.backend, provider.url, headers=provider.headers(), json=provider.request(payload)
+    )
+    return provider.read_answer(payload, status_code, body)
+
+async def get_llama_response_async(app, user_message, session_id, deadline=None):
+    """
+    Async counterpart of llama_api.get_llama_response.
+
+    Args:
+        app (web.Application): The application, holding the client and executor
+        user_message (str): The user's message
+        session_id (str): Session identifier
+        deadline (Deadline): The request's deadline; once it passes, the reply is the
+            fallback and the API call runs on in the background to fill the cache
+
+    Returns:
+        str: The reply
+    """
+    loop = asyncio.get_running_loop()
+    executor = app[executor_key]
+    history, reply = await loop.run_in_executor(executor, prepare_llama_response, user_message, session_id)
+    if isinstance(reply, PendingReply):
+        call = asyncio.ensure_future(call_llama_api_async(app, reply.payload))
+        app[llm_calls_key].add(call)
+        call.add_done_callback(app[llm_calls_key].discard)
+        if deadline is None:
+            status_code, body = await call
+        else:
+            try:
+                status_code, body = await asyncio.wait_for(asyncio.shield(call), deadline.remaining())
+            except asyncio.TimeoutError:
+                logging.warning(f"Llama API did not answer within the {deadline.seconds}s deadline, using the fallback")
+                status_code, body = None, None
+        # Turning the answer into a reply can need the rule-based fallback, so it runs on
+        # the executor too, together with saving the history
+        return await loop.run_in_executor(
+            executor, lambda: finish_llama_response(history, session_id, reply.finish(status_code, body))
+        )
+    return await loop.run_in_executor(executor, finish_llama_response, history, session_id, reply)
+
+async def read_llama_stream(app, stream):
+    """
+    Async counterpart of llama_api.read_llama_stream.
+
+    Args:
+        app (web.Application): The application, holding the client
+        stream (StreamedReply): The reply being streamed
+
+    Yields:
+        str: The generated text, chunk by chunk
+    """
+    try:
+        provider = LLAMA_PROVIDER
+        async with app[llm_client_key].stream(provider.backend, provider.url, headers=provider.headers(), json=provider.request(stream.payload)) as response:
+            if response.status != 200:
+                stream.fail(response.status, await response.text())
+                return
+            async for line in response.content:
+                text = stream.feed(provider.stream_line(line.decode("utf-8").rstrip("\r\n")))
+                if text:
+                    yield text
+    except CircuitOpenError:
+        # The API has been failing, so the handler's fallback replies right away
+        return
+    except Exception as e:
+        logging.error(f"Error calling API: {e!r}")
+
+async def stream_llama_response_async(app, user_message, session_id):
+    """
+    Async counterpart of llama_api.stream_llama_response.
+
+    Args:
+        app (web.Application): The application, holding the client and executor
+        user_message (str): The user's message
+        session_id (str): Session identifier
+
+    Yields:
+        tuple: ("chunk", text) events, then ("done", reply)
+    """
+    loop = asyncio.get_running_loop()
+    executor = app[executor_key]
+    history, reply = await loop.run_in_executor(executor, prepare_llama_response, user_message, session_id)
+    if not isinstance(reply, PendingReply):
+        await loop.run_in_executor(executor, finish_llama_response, history, session_id, reply)
+        yield "chunk", reply
+        yield "done", reply
+        return
+
+    stream = StreamedReply(reply)
+    try:
+        async for text in read_llama_stream(app, stream):
+            yield "chunk", text
+    finally:
+        rest, reply = await loop.run_in_executor(executor, finish_streamed_reply, history, session_id, stream)
+    if rest:
+        yield "chunk", rest
+    yield "done", reply
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization",
+    "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
+    "Access-Control-Allow-Credentials": "true",
+}
+
+async def chat(request):
+    # The reply has to be ready within the deadline, counting from when the request arrived
+    deadline = chat_deadline()
+    try:
+        data = await request.json()
+        user_message = data.get('message', '').strip()
+
+        if not user_message:
+            return web.json_response({'reply': "Please provide a message."}, status=400, headers=CORS_HEADERS)
+
+        # Get or create session ID
+        session_id = request.cookies.get('session_id')
+        if not session_id:
+            session_id = str(uuid.uuid4())
+
+        # Requests of the same session run one at a time, so none of them overwrites the
+        # state another one has just saved
+        async with request.app[session_locks_key].lock(session_id):
+            reply = await get_llama_response_async(request.app, user_message, session_id, deadline)
+
+        response = web.json_response({'reply': reply}, headers=CORS_HEADERS)
+        response.set_cookie('session_id', session_id, max_age=86400)  # 24 hour expiry
+        return response
+    except Exception as e:
+        logging.error(f"Error processing request: {e}", exc_info=True)
+        return web.json_response(
+            {'reply': f"Sorry, I couldn't process your request. Error: {str(e)}"}, status=400, headers=CORS_HEADERS
+        )
+
+async def chat_stream(request):
+    try:
+        data = await request.json()
+        user_message = data.get('message', '').strip()
+
+        if not user_message:
+            return web.json_response({'reply': "Please provide a message."}, status=400, headers=CORS_HEADERS)
+
+        # Get or create session ID
+        session_id = request.cookies.get('session_id')
+        if not session_id:
+            session_id = str(uuid.uuid4())
+    except Exception as e:
+        logging.error(f"Error processing request: {e}", exc_info=True)
+        return web.json_response(
+            {'reply': f"Sorry, I couldn't process your request. Error: {str(e)}"}, status=400, headers=CORS_HEADERS
+        )
+
+    response = web.StreamResponse(headers={
+        **CORS_HEADERS,
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    response.set_cookie('session_id', session_id, max_age=86400)  # 24 hour expiry
+    await response.prepare(request)
+
+    # Closing the events explicitly records the reply before the session lock is released,
+    # also when the client goes away part way through
+    async with request.app[session_locks_key].lock(session_id):
+        async with contextlib.aclosing(stream_llama_response_async(request.app, user_message, session_id)) as events:
+            try:
+                async for event, data in events:
+                    await response.write(sse_event(event, {'text': data} if event == 'chunk' else {'reply': data}).encode())
+            except ConnectionResetError:
+                logging.info(f"Client went away while streaming to session {session_id}")
+                return response
+            except Exception as e:
+                # The status line has already been sent, so the error becomes an event
+                logging.error(f"Error streaming reply: {e}", exc_info=True)
+                await response.write(sse_event('error', {'reply': f"Sorry, I couldn't process your request. Error: {str(e)}"}).encode())
+    await response.write_eof()
+    return response
+
+async def handle_options(request):
+    return web.Response(headers=CORS_HEADERS)
+
+async def session_stats(request):
+    stats = await asyncio.get_running_loop().run_in_executor(request.app[executor_key], get_session_store().stats)
+    return web.json_response(stats)
+
+async def cache_stats(request):
+    cache = get_completion_cache()
+    if cache is None:
+        return web.json_response({'enabled': False})
+    stats = await asyncio.get_running_loop().run_in_executor(request.app[executor_key], cache.stats)
+    return web.json_response(stats)
+
+async def circuit_stats(request):
+    return web.json_response(circuit_breaker_stats())
+
+async def llm_stats(request):
+    stats = request.app[llm_client_key].stats()
+    if request.app[batcher_key] is not None:
+        stats['batching'] = request.app[batcher_key].stats()
+    return web.json_response(stats)
+
+async def start_background(app):
+    await app[llm_client_key].start()
+
+async def stop_background(app):
+    calls = list(app[llm_calls_key])
+    for call in calls:
+        call.cancel()
+    await asyncio.gather(*calls, return_exceptions=True)
+    if app[batcher_key] is not None:
+        await app[batcher_key].close()
+    await app[llm_client_key].close()
+    app[executor_key].shutdown(wait=True)
+
+def create_app(max_concurrency=None, executor_workers=None):
+    """
+    Create the aiohttp application.
+
+    Args:
+        max_concurrency (int): Maximum Llama API calls in flight (default LLM_MAX_CONCURRENCY)
+        executor_workers (int): Threads for the CPU-bound work (default ASYNC_EXECUTOR_WORKERS)
+
+    Returns:
+        web.Application: The application
+    """
+    if max_concurrency is None:
+        max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+    if executor_workers is None:
+        executor_workers = int(os.getenv("ASYNC_EXECUTOR_WORKERS", DEFAULT_EXECUTOR_WORKERS))
+
+    app = web.Application()
+    app[llm_client_key] = AsyncLLMClient(max_concurrency=max_concurrency, pool_size=max(max_concurrency, DEFAULT_POOL_MAXSIZE))
+    app[executor_key] = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="chat-pipeline")
+    app[session_locks_key] = AsyncSessionLocks()
+    app[llm_calls_key] = set()
+    if LLAMA_PROVIDER.supports_batching:
+        app[batcher_key] = create_async_inference_batcher(lambda payload: post_llama_api_async(app, payload))
+    else:
+        app[batcher_key] = None
+    app.on_startup.append(start_background)
+    app.on_cleanup.append(stop_background)
+    app.router.add_post('/chat', chat)
+    app.router.add_route('OPTIONS', '/chat', handle_options)
+    app.router.add_post('/chat/stream', chat_stream)
+    app.router.add_route('OPTIONS', '/chat/stream', handle_options)
+    app.router.add_get('/stats/sessions', session_stats)
+    app.router.add_get('/stats/cache', cache_stats)
+    app.router.add_get('/stats/llm', llm_stats)
+    app.router.add_get('/stats/circuits', circuit_stats)
+    return app
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)  # Set up logging
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("PORT", "5000")))  # Run the app
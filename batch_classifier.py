@@ -0,0 +1,183 @@
+"""
+Batch classification of many messages at once, for re-scoring exported transcripts offline.
+
+`classify_batch` labels every message with the same categories the per-message detectors
+report, without touching any per-user history. Each distinct message is scanned once by
+the shared detection engine; the matched entry ids of the whole batch are then turned into
+labels with NumPy, using lookup arrays that map every table entry to its label column.
+"""
+
+import numpy as np
+from detection_engine import detect, normalize, table_entries
+from mental_health_analysis import MENTAL_HEALTH_INDICATORS, SEVERITY_RANK
+from mood_encouragement import NEGATIVE_MOOD_PATTERNS, match_negative_mood_frames
+from deep_listening import THOUGHT_CATEGORIES
+from wellness_routines import ROUTINE_TYPE_KEYWORDS
+# Imported so the positive mood and therapist request tables are registered
+import positive_responses
+import therapist_contacts
+
+# Severity scores used in the mental health columns; 0 means the concern was not detected
+SEVERITY_SCORES = {severity: rank + 1 for severity, rank in SEVERITY_RANK.items()}
+
+def build_columns():
+    """
+    Build the column layout of the batch matrix.
+
+    Returns:
+        list: (column name, group, label) for every column, in matrix order
+    """
+    columns = []
+    for concern in MENTAL_HEALTH_INDICATORS:
+        columns.append((f"mental_health:{concern}", "mental_health", concern))
+    for mood_type in NEGATIVE_MOOD_PATTERNS:
+        columns.append((f"negative_mood:{mood_type}", "negative_mood", mood_type))
+    columns.append(("positive_mood", "positive_mood", None))
+    for category in list(THOUGHT_CATEGORIES) + ["default"]:
+        columns.append((f"deep_thought:{category}", "deep_thought", category))
+    for type_name in ROUTINE_TYPE_KEYWORDS:
+        columns.append((f"routine_type:{type_name}", "routine_type", type_name))
+    columns.append(("therapist_request", "therapist_request", None))
+    return columns
+
+# Column layout: the mental health columns hold a severity score (1 low, 2 medium,
+# 3 high), every other column is 0 or 1
+BATCH_LAYOUT = build_columns()
+BATCH_COLUMNS = [name for name, _, _ in BATCH_LAYOUT]
+
+def column_index(group, label=None):
+    """
+    Find the matrix column for a label.
+
+    Args:
+        group (str): Column group, e.g. "negative_mood"
+        label (str, optional): Label within the group, e.g. "sadness"
+
+    Returns:
+        int: Column index
+    """
+    for index, (_, column_group, column_label) in enumerate(BATCH_LAYOUT):
+        if column_group == group and column_label == label:
+            return index
+    raise KeyError(f"No column for {group}:{label}")
+
+def build_entry_lookup(table, column_of_value, score_of_value=None):
+    """
+    Build the lookup arrays that map a table's entry ids to label columns.
+
+    Args:
+        table (str): Name of a registered detection table
+        column_of_value (function): Maps an entry value to its column index
+        score_of_value (function, optional): Maps an entry value to the score it contributes
+
+    Returns:
+        dict: First entry id of the table, and the column and score of every entry
+    """
+    entries = table_entries(table)
+    return {
+        "first_id": entries[0][0] if entries else 0,
+        "columns": np.array([column_of_value(value) for _, value in entries], dtype=np.intp),
+        "scores": np.array([score_of_value(value) if score_of_value else 1 for _, value in entries], dtype=np.int8)
+    }
+
+# Lookup arrays, built on first use so every module has registered its tables
+_entry_lookups = None
+
+def get_entry_lookups():
+    global _entry_lookups
+
+    if _entry_lookups is None:
+        _entry_lookups = {
+            "mental_health": build_entry_lookup(
+                "mental_health",
+                lambda value: column_index("mental_health", value[0]),
+                lambda value: SEVERITY_SCORES[value[2]]
+            ),
+            "negative_mood": build_entry_lookup("negative_mood", lambda value: column_index("negative_mood", value[0])),
+            "thought_categories": build_entry_lookup("thought_categories", lambda value: column_index("deep_thought", value)),
+            "routine_type": build_entry_lookup("routine_type", lambda value: column_index("routine_type", value))
+        }
+
+    return _entry_lookups
+
+def classify_batch(messages):
+    """
+    Label a batch of messages with every detector category.
+
+    Gives the same labels as the per-message functions (`analyze_text`,
+    `detect_negative_mood`, `detect_positive_mood`, `detect_deep_thought`,
+    `detect_wellness_routine_request` and `detect_therapist_request`), but records nothing
+    in the per-user histories.
+
+    Args:
+        messages (list): The messages to classify
+
+    Returns:
+        numpy.ndarray: int8 matrix with one row per message and one column per entry of
+            BATCH_COLUMNS
+    """
+    lookups = get_entry_lookups()
+
+    # Identical messages (after normalization) are only scanned once
+    unique_index = {}
+    row_of_message = np.array([unique_index.setdefault(normalize(message), len(unique_index)) for message in messages], dtype=np.intp)
+    unique_count = len(unique_index)
+
+    # Collect every matched entry as (row, entry id) pairs, per table
+    entry_rows = {table: [] for table in lookups}
+    entry_ids = {table: [] for table in lookups}
+    flags = {table: np.zeros(unique_count, dtype=bool) for table in ["positive_mood", "deep_thought", "wellness_routine", "therapist_request"]}
+    mood_rows = []
+    mood_columns = []
+    mood_column = {mood_type: column_index("negative_mood", mood_type) for mood_type in NEGATIVE_MOOD_PATTERNS}
+
+    for row, text in enumerate(unique_index):
+        detection = detect(text)
+        for table in lookups:
+            matched = detection.entry_ids(table)
+            entry_rows[table].extend([row] * len(matched))
+            entry_ids[table].extend(matched)
+        for table, flag in flags.items():
+            flag[row] = bool(detection.entry_ids(table))
+        for mood_type, _ in match_negative_mood_frames(text):
+            mood_rows.append(row)
+            mood_columns.append(mood_column[mood_type])
+
+    def scatter(table, reduce):
+        lookup = lookups[table]
+        rows = np.array(entry_rows[table], dtype=np.intp)
+        offsets = np.array(entry_ids[table], dtype=np.intp) - lookup["first_id"]
+        reduce(labels, (rows, lookup["columns"][offsets]), lookup["scores"][offsets])
+
+    labels = np.zeros((unique_count, len(BATCH_COLUMNS)), dtype=np.int8)
+
+    # Mental health: a concern takes the most severe of its matched keywords
+    scatter("mental_health", np.maximum.at)
+
+    # Negative mood: free-form phrases plus frame and mood word combinations
+    scatter("negative_mood", np.maximum.at)
+    labels[np.array(mood_rows, dtype=np.intp), np.array(mood_columns, dtype=np.intp)] = 1
+
+    labels[:, column_index("positive_mood")] = flags["positive_mood"]
+    labels[:, column_index("therapist_request")] = flags["therapist_request"]
+
+    # Deep thought: categories only count when a deep thought pattern matched
+    scatter("thought_categories", np.maximum.at)
+    thought_columns = [index for index, (_, group, _) in enumerate(BATCH_LAYOUT) if group == "deep_thought"]
+    labels[~flags["deep_thought"], thought_columns[0]:thought_columns[-1] + 1] = 0
+    no_category = flags["deep_thought"] & ~labels[:, thought_columns].any(axis=1)
+    labels[no_category, column_index("deep_thought", "default")] = 1
+
+    # Routine type: the type with the most keyword matches, "general" without any
+    # (ties go to the first type, like max() over ROUTINE_TYPE_KEYWORDS)
+    first_routine_column = column_index("routine_type", next(iter(ROUTINE_TYPE_KEYWORDS)))
+    type_counts = np.zeros((unique_count, len(ROUTINE_TYPE_KEYWORDS)), dtype=np.int32)
+    lookup = lookups["routine_type"]
+    offsets = np.array(entry_ids["routine_type"], dtype=np.intp) - lookup["first_id"]
+    np.add.at(type_counts, (np.array(entry_rows["routine_type"], dtype=np.intp), lookup["columns"][offsets] - first_routine_column), 1)
+    chosen = first_routine_column + type_counts.argmax(axis=1)
+    chosen[type_counts.max(axis=1) == 0] = column_index("routine_type", "general")
+    routine_rows = np.flatnonzero(flags["wellness_routine"])
+    labels[routine_rows, chosen[routine_rows]] = 1
+
+    return labels[row_of_message]
@@ -0,0 +1,113 @@
+"""
+Benchmark for the asyncio chat backend under many slow LLM calls.
+
+Runs a mock inference API that takes --llm-delay seconds per reply and points the Llama
+backend at it, then sends a burst of concurrent /chat messages, each from a new
+session, to async_api. Every message waits on the slow API, so with the Flask backends a
+burst is served a few worker threads at a time; the async backend keeps all of them in
+flight, so the burst takes one API delay plus the CPU time of the reply pipeline.
+
+Usage:
+    python benchmarks/bench_async_chat.py [--messages N] [--llm-delay S] [--max-concurrency N]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+from aiohttp import ClientSession, DummyCookieJar, TCPConnector, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGES = ["Hello there", "Tell me something nice", "Can you recommend a song?", "What should I do this weekend?"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--llm-delay", type=float, default=2.0, help="seconds the mock API takes per reply")
+    parser.add_argument("--max-concurrency", type=int, default=4096, help="LLM_MAX_CONCURRENCY for the backend")
+    parser.add_argument("--flask-threads", type=int, default=32, help="threads to compare against")
+    return parser.parse_args()
+
+async def start_site(app):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, backlog=4096)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+async def main():
+    args = parse_args()
+    peak = {"in_flight": 0, "now": 0}
+
+    async def inference(request):
+        payload = await request.json()
+        peak["now"] += 1
+        peak["in_flight"] = max(peak["in_flight"], peak["now"])
+        try:
+            await asyncio.sleep(args.llm_delay)
+        finally:
+            peak["now"] -= 1
+        return web.json_response([{"generated_text": f"{payload['inputs']} I'm here to listen."}])
+
+    mock = web.Application()
+    mock.router.add_post("/models/llama", inference)
+    mock_runner, mock_port = await start_site(mock)
+
+    # llama_api reads the API URL when it is imported
+    os.environ["HUGGINGFACE_API_URL"] = f"http://127.0.0.1:{mock_port}/models/llama"
+    os.environ["SESSION_MAX_ENTRIES"] = str(args.messages * 2)
+    # Every message has to wait for the mock API, not be answered from the cache or
+    # given up on at the deadline
+    os.environ["COMPLETION_CACHE_MAX_ENTRIES"] = "0"
+    os.environ["CHAT_DEADLINE_SECONDS"] = "0"
+    logging.disable(logging.INFO)
+    import async_api
+
+    app = async_api.create_app(max_concurrency=args.max_concurrency)
+    app_runner, app_port = await start_site(app)
+    url = f"http://127.0.0.1:{app_port}/chat"
+
+    # A fresh cookie jar per message would be slow; without cookies every message starts
+    # a new session, like a burst of new visitors
+    async with ClientSession(connector=TCPConnector(limit=0), cookie_jar=DummyCookieJar()) as client:
+        async def send(index):
+            start = time.perf_counter()
+            async with client.post(url, json={"message": MESSAGES[index % len(MESSAGES)]}) as response:
+                body = await response.json()
+            return response.status, body["reply"], time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(send(index) for index in range(args.messages)))
+        elapsed = time.perf_counter() - start
+
+        async with client.get(f"http://127.0.0.1:{app_port}/stats/llm") as response:
+            llm_stats = await response.json()
+
+    await app_runner.cleanup()
+    await mock_runner.cleanup()
+
+    failed = [result for result in results if result[0] != 200]
+    from_api = sum(1 for result in results if result[1] == "I'm here to listen.")
+    latencies = sorted(result[2] for result in results)
+    thread_bound = math.ceil(args.messages / args.flask_threads) * args.llm_delay
+
+    print(f"{args.messages} messages, mock API delay {args.llm_delay:.1f}s")
+    print(f"finished in {elapsed:.2f}s ({args.messages / elapsed:.0f} messages/s), {len(failed)} failed, "
+          f"{from_api} answered by the API")
+    print(f"latency p50 {latencies[len(latencies) // 2]:.2f}s, p99 {latencies[int(len(latencies) * 0.99)]:.2f}s")
+    print(f"peak API calls in flight: {peak['in_flight']}")
+    print(f"LLM client: {json.dumps(llm_stats)}")
+    print(f"{args.flask_threads} blocking threads would need at least {thread_bound:.0f}s")
+
+    if failed:
+        print(f"first failure: {failed[0]}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+"""
+Benchmark for time to first byte of /chat and /chat/stream.
+
+Runs llama_api against a mock inference API that produces a reply token by token, like
+the real one, and measures how long a client waits for the first text of the reply and
+for all of it. /chat sends nothing until the whole reply is generated; /chat/stream sends
+canned replies as soon as the detectors have run and generated ones token by token.
+Also checks that every streamed reply ended up in the conversation history.
+
+Usage:
+    python benchmarks/bench_chat_stream.py [--requests N] [--first-token S] [--token-delay S] [--tokens N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGES = {
+    "canned": "Can you recommend a song?",
+    "generated": "What should I do this weekend?",
+}
+
+class StreamingInferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    first_token = 0.3
+    token_delay = 0.02
+    tokens = 40
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        words = [f" word{index}" for index in range(self.tokens)]
+        time.sleep(self.first_token)
+
+        if not payload.get("stream"):
+            time.sleep(self.token_delay * (self.tokens - 1))
+            body = json.dumps([{"generated_text": payload["inputs"] + "".join(words)}]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        # One chunk per token, like the inference API
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, word in enumerate(words):
+            if index:
+                time.sleep(self.token_delay)
+            event = {"token": {"id": index, "text": word, "special": False}, "generated_text": None}
+            if index == len(words) - 1:
+                event["generated_text"] = "".join(words)
+            data = f"data:{json.dumps(event)}\n\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+class ChunkedRequestHandler(WSGIRequestHandler):
+    # Streamed responses are sent chunk by chunk only over HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+def start_thread(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def measure(url, message):
+    # Seconds until the first text of the reply arrives, until all of it has, and the reply
+    session_id = str(uuid.uuid4())
+    start = time.perf_counter()
+    first = None
+    reply = None
+    with requests.post(url, json={"message": message}, cookies={"session_id": session_id}, stream=True) as response:
+        response.raise_for_status()
+        if response.headers["Content-Type"].startswith("application/json"):
+            reply = response.json()["reply"]
+            first = time.perf_counter() - start
+        else:
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    if event == "chunk" and first is None:
+                        first = time.perf_counter() - start
+                    elif event == "done":
+                        reply = json.loads(line[len("data:"):])["reply"]
+    return first, time.perf_counter() - start, session_id, reply
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--first-token", type=float, default=0.3, help="seconds until the mock API's first token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between the mock API's tokens")
+    parser.add_argument("--tokens", type=int, default=40)
+    args = parser.parse_args()
+
+    StreamingInferenceHandler.first_token = args.first_token
+    StreamingInferenceHandler.token_delay = args.token_delay
+    StreamingInferenceHandler.tokens = args.tokens
+    mock = start_thread(ThreadingHTTPServer(("127.0.0.1", 0), StreamingInferenceHandler))
+
+    # llama_api reads the API URL when it is imported
+    os.environ["HUGGINGFACE_API_URL"] = f"http://127.0.0.1:{mock.server_address[1]}/models/llama"
+    # Every message has to wait for the mock API, not be answered from the cache
+    os.environ["COMPLETION_CACHE_MAX_ENTRIES"] = "0"
+    import llama_api
+    logging.disable(logging.INFO)
+    server = start_thread(make_server("127.0.0.1", 0, llama_api.app, threaded=True, request_handler=ChunkedRequestHandler))
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    unrecorded = 0
+    print(f"mock API: first token after {args.first_token:.2f}s, {args.tokens} tokens {args.token_delay * 1e3:.0f}ms apart")
+    print(f"{'endpoint':13} {'reply':10} {'first text ms':>14} {'complete ms':>12}")
+    for kind, message in MESSAGES.items():
+        for endpoint in ("/chat", "/chat/stream"):
+            firsts, totals = [], []
+            for _ in range(args.requests):
+                first, total, session_id, reply = measure(base + endpoint, message)
+                firsts.append(first)
+                totals.append(total)
+                history = llama_api.conversation_history.get(session_id)
+                if history is None or list(history.turns)[-1].content != reply:
+                    unrecorded += 1
+            print(f"{endpoint:13} {kind:10} {statistics.median(firsts) * 1e3:14.1f} {statistics.median(totals) * 1e3:12.1f}")
+
+    print(f"replies missing from the conversation history: {unrecorded}")
+    server.shutdown()
+    mock.shutdown()
+    if unrecorded:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark for the LLM circuit breaker during an API outage.
+
+Runs the Llama pipeline against a mock inference API that stops answering (every call
+runs into the read timeout) or answers 503, first with the circuit breaker disabled and
+then enabled, and reports the latency of the replies. Without the breaker every message
+waits for its call to fail; with it only the calls that open the breaker and the
+occasional half-open trial do. Finally the API recovers and the breaker has to close
+again.
+
+Usage:
+    python benchmarks/bench_circuit_breaker.py [--messages N] [--read-timeout S] [--outage hang|503]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGE = "What should I do this weekend?"
+
+class FlakyInferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mode = "ok"
+    hang = 0.0
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if self.mode == "hang":
+            time.sleep(self.hang)
+            status, body = 200, [{"generated_text": payload["inputs"] + " Too late."}]
+        elif self.mode == "503":
+            time.sleep(0.2)
+            status, body = 503, {"error": "Model is currently loading"}
+        else:
+            status, body = 200, [{"generated_text": payload["inputs"] + " I'm here for you."}]
+        data = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:
+            # The client gave up waiting
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def run(llama_api, count):
+    latencies = []
+    for index in range(count):
+        start = time.perf_counter()
+        llama_api.get_llama_response(MESSAGE, f"bench-circuit-{index % 20}")
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "p50_ms": latencies[len(latencies) // 2] * 1e3,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1e3,
+        "max_ms": latencies[-1] * 1e3,
+        "slow": sum(1 for latency in latencies if latency > 0.1),
+        "seconds": sum(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--read-timeout", type=float, default=2.0, help="HUGGINGFACE_READ_TIMEOUT for the run")
+    parser.add_argument("--reset-seconds", type=float, default=2.0, help="LLM_CIRCUIT_RESET_SECONDS for the run")
+    parser.add_argument("--outage", choices=["hang", "503"], default="hang")
+    args = parser.parse_args()
+
+    FlakyInferenceHandler.hang = args.read_timeout + 1
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyInferenceHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Configuration is read when the client, the breakers and llama_api are first used
+    os.environ["HUGGINGFACE_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}/models/llama"
+    os.environ["HUGGINGFACE_READ_TIMEOUT"] = str(args.read_timeout)
+    os.environ["LLM_CIRCUIT_RESET_SECONDS"] = str(args.reset_seconds)
+    # Every message has to reach the API, not be answered from the cache
+    os.environ["COMPLETION_CACHE_MAX_ENTRIES"] = "0"
+    import circuit_breaker
+    import llama_api
+    logging.disable(logging.CRITICAL)
+
+    print(f"outage: {args.outage}, read timeout {args.read_timeout:.1f}s, breaker reset {args.reset_seconds:.1f}s")
+    print(f"{'breaker':10} {'messages':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'>100ms':>7} {'total s':>8}")
+    FlakyInferenceHandler.mode = args.outage
+    # Without the breaker every message waits for the timeout, so a few show the trend
+    for label, failures, count in (("disabled", "0", min(args.messages, 10)), ("enabled", "5", args.messages)):
+        os.environ["LLM_CIRCUIT_FAILURES"] = failures
+        circuit_breaker._circuit_breakers.clear()
+        result = run(llama_api, count)
+        print(f"{label:10} {count:>8} {result['p50_ms']:8.1f} {result['p99_ms']:8.1f} {result['max_ms']:8.1f} "
+              f"{result['slow']:>7} {result['seconds']:8.1f}")
+    stats = circuit_breaker.circuit_breaker_stats()["huggingface"]
+    print(f"during the outage: {stats}")
+
+    FlakyInferenceHandler.mode = "ok"
+    time.sleep(args.reset_seconds)
+    reply = llama_api.get_llama_response(MESSAGE, "bench-circuit-recovered")
+    stats = circuit_breaker.circuit_breaker_stats()["huggingface"]
+    print(f"after recovery: state {stats['state']}, reply {reply!r}")
+    server.shutdown()
+    if stats["state"] != circuit_breaker.CLOSED:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark for the LLM completion cache.
+
+Sends a stream of chat messages through the Llama pipeline, drawn from the benchmark
+corpus with a skewed distribution (a few messages such as greetings are far more common
+than the rest) and with random changes of case and spacing. The inference API is stubbed
+with a fixed network delay. Compares the calls made and the time per message without the
+cache, with the in-process cache, and after a restart with only the shared SQLite tier
+left warm. Every message opens a new session, as only first messages are cached.
+
+Usage:
+    python benchmarks/bench_completion_cache.py [--messages N] [--llm-delay S]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import completion_cache
+import llama_api
+from bench_detectors import stub_llm_post
+from completion_cache import CompletionCache, SQLiteCompletionTier
+from llm_client import get_llm_client
+
+def workload(count, seed=1):
+    with open(os.path.join(BENCHMARK_DIR, "corpus.json")) as corpus:
+        texts = [entry["text"] for entry in json.load(corpus)]
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, len(texts) + 1)]
+    messages = []
+    for text in rng.choices(texts, weights=weights, k=count):
+        if rng.random() < 0.3:
+            text = text.upper() if rng.random() < 0.5 else f"  {text}  "
+        messages.append(text)
+    return messages
+
+def use_cache(cache):
+    completion_cache._completion_cache = cache
+    completion_cache._completion_cache_created = True
+
+def run(messages, llm_delay, label):
+    calls = 0
+
+    def slow_llm_post(backend, url, headers=None, json=None):
+        nonlocal calls
+        calls += 1
+        time.sleep(llm_delay)
+        return stub_llm_post(backend, url, headers=headers, json=json)
+
+    get_llm_client().post = slow_llm_post
+    start = time.perf_counter()
+    for index, message in enumerate(messages):
+        llama_api.get_llama_response(message, f"bench-cache-{label}-{index}")
+    return calls, (time.perf_counter() - start) / len(messages)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--llm-delay", type=float, default=0.05, help="seconds the stubbed API call takes")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    messages = workload(args.messages)
+    directory = tempfile.mkdtemp(prefix="bench-completion-cache-")
+    db_path = os.path.join(directory, "completions.db")
+    try:
+        print(f"{args.messages} messages, {len(set(messages))} distinct, API delay {args.llm_delay * 1e3:.0f}ms")
+        print(f"{'cache':28} {'API calls':>9} {'ms/message':>11} {'hit rate':>9}")
+
+        use_cache(None)
+        calls, per_message = run(messages, args.llm_delay, "none")
+        print(f"{'none':28} {calls:>9} {per_message * 1e3:11.2f} {'-':>9}")
+
+        use_cache(CompletionCache(shared=SQLiteCompletionTier(db_path)))
+        calls, per_message = run(messages, args.llm_delay, "cold")
+        stats = completion_cache.get_completion_cache().stats()
+        print(f"{'in process + SQLite':28} {calls:>9} {per_message * 1e3:11.2f} {stats['hit_rate']:>9.1%}")
+
+        # A restarted worker starts with an empty in-process tier
+        use_cache(CompletionCache(shared=SQLiteCompletionTier(db_path)))
+        calls, per_message = run(messages, args.llm_delay, "restart")
+        stats = completion_cache.get_completion_cache().stats()
+        print(f"{'after restart, SQLite warm':28} {calls:>9} {per_message * 1e3:11.2f} {stats['hit_rate']:>9.1%}")
+        print(f"cache stats: {stats}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
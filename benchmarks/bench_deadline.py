@@ -0,0 +1,110 @@
+"""
+Benchmark for the /chat deadline with a slow LLM API.
+
+Sends /chat requests to llama_api from several threads while a mock inference API takes
+anywhere from --min-delay to --max-delay seconds per answer, first without a deadline and
+then with CHAT_DEADLINE_SECONDS set. With the deadline no reply takes much longer than it,
+and the messages the API missed it for are answered with the fallback. The late answers
+still fill the completion cache, so opening sessions with the same messages again is fast.
+
+Usage:
+    python benchmarks/bench_deadline.py [--requests N] [--threads N] [--deadline S] [--max-delay S]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+API_SUFFIX = " Here is a thought from the model."
+
+class SlowInferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    min_delay = 0.2
+    max_delay = 3.0
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(random.uniform(self.min_delay, self.max_delay))
+        data = json.dumps([{"generated_text": payload["inputs"] + API_SUFFIX}]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def run(llama_api, messages, threads, label):
+    def send(index):
+        client = llama_api.app.test_client()
+        client.set_cookie("session_id", f"bench-deadline-{label}-{index}")
+        start = time.perf_counter()
+        response = client.post("/chat", json={"message": messages[index]})
+        return time.perf_counter() - start, response.get_json()["reply"]
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(send, range(len(messages))))
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "p50_s": latencies[len(latencies) // 2],
+        "p99_s": latencies[int(len(latencies) * 0.99)],
+        "max_s": latencies[-1],
+        "from_api": sum(1 for _, reply in results if API_SUFFIX.strip() in reply),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--deadline", type=float, default=1.0)
+    parser.add_argument("--min-delay", type=float, default=0.2)
+    parser.add_argument("--max-delay", type=float, default=3.0)
+    args = parser.parse_args()
+
+    SlowInferenceHandler.min_delay = args.min_delay
+    SlowInferenceHandler.max_delay = args.max_delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowInferenceHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # llama_api reads the API URL when it is imported
+    os.environ["HUGGINGFACE_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}/models/llama"
+    os.environ["LLM_POOL_MAXSIZE"] = str(args.threads * 2)
+    import completion_cache
+    import llama_api
+    logging.disable(logging.CRITICAL)
+
+    # Distinct messages, so the first two runs can't answer each other's from the cache
+    def messages(run_index):
+        return [f"What should I do this weekend? (run {run_index}, message {index})" for index in range(args.requests)]
+
+    print(f"{args.requests} requests on {args.threads} threads, API answers in "
+          f"{args.min_delay:.1f}-{args.max_delay:.1f}s, deadline {args.deadline:.1f}s")
+    print(f"{'deadline':22} {'p50 s':>6} {'p99 s':>6} {'max s':>6} {'from API':>9}")
+    os.environ["CHAT_DEADLINE_SECONDS"] = "0"
+    result = run(llama_api, messages(0), args.threads, "none")
+    print(f"{'none':22} {result['p50_s']:6.2f} {result['p99_s']:6.2f} {result['max_s']:6.2f} {result['from_api']:>9}")
+
+    os.environ["CHAT_DEADLINE_SECONDS"] = str(args.deadline)
+    result = run(llama_api, messages(1), args.threads, "on")
+    print(f"{'on':22} {result['p50_s']:6.2f} {result['p99_s']:6.2f} {result['max_s']:6.2f} {result['from_api']:>9}")
+
+    # Give the calls that missed the deadline time to finish and fill the cache
+    time.sleep(args.max_delay)
+    result = run(llama_api, messages(1), args.threads, "again")
+    print(f"{'on, same messages again':22} {result['p50_s']:6.2f} {result['p99_s']:6.2f} {result['max_s']:6.2f} {result['from_api']:>9}")
+    print(f"cache: {completion_cache.get_completion_cache().stats()}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark for deep_listening.detect_deep_thought.
+
+Compares the per-message cost of the compiled phrase matcher against the previous
+approach of one `re.search` per pattern, and checks that both find the same patterns.
+
+Usage:
+    python benchmarks/bench_deep_listening.py [--iterations N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_listening import DEEP_THOUGHT_PATTERNS, detect_deep_thought
+
+MESSAGES = [
+    "hi",
+    "Hello, how are you today?",
+    "Can you suggest a song for me?",
+    "I used to play piano every day when I was younger, growing up it meant everything to me.",
+    "I've been thinking about my childhood a lot and I realized I miss my grandmother.",
+    "I'm not good enough and I'm not smart enough, I feel alone and I don't belong anywhere.",
+    "Honestly I'm not sure what to say. Work was long, the commute was worse, and I just want to sleep.",
+    "I was bullied in school and I was rejected by my friends, someone hurt me badly.",
+    "My goal is to run a marathon. I'm trying to get better every week and I'm proud of my progress.",
+    "I'm worried about my exams and I'm scared I failed the last one.",
+]
+
+def legacy_matches(text):
+    """Reproduce the previous matching loop: one re.search per pattern."""
+    text = text.lower()
+    return [pattern for pattern in DEEP_THOUGHT_PATTERNS if re.search(r'\b' + pattern + r'\b', text)]
+
+def time_per_message(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in MESSAGES:
+            func(message)
+    elapsed = time.perf_counter() - start
+    return elapsed / (iterations * len(MESSAGES)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    for message in MESSAGES:
+        expected = list(dict.fromkeys(legacy_matches(message)))
+        actual = detect_deep_thought(message).get("matches", [])
+        if expected != actual:
+            sys.exit(f"Mismatch for {message!r}: expected {expected}, got {actual}")
+
+    legacy_us = time_per_message(legacy_matches, args.iterations)
+    compiled_us = time_per_message(detect_deep_thought, args.iterations)
+
+    print(f"messages:          {len(MESSAGES)}")
+    print(f"patterns:          {len(DEEP_THOUGHT_PATTERNS)} ({len(set(DEEP_THOUGHT_PATTERNS))} unique)")
+    print(f"per-pattern regex: {legacy_us:8.1f} us/message")
+    print(f"compiled matcher:  {compiled_us:8.1f} us/message")
+    print(f"speedup:           {legacy_us / compiled_us:8.1f}x")
+
+if __name__ == "__main__":
+    main()
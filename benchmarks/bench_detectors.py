@@ -0,0 +1,171 @@
+"""
+Benchmark suite for the per-message analysis.
+
+Runs the labelled corpus in corpus.json through each detector on its own, both
+`fallback_response` variants, and the full `get_llama_response` pipeline with the LLM
+call stubbed out. Reports p50/p95/p99 latency and messages per second for each, and
+writes the results as JSON so runs can be compared across commits.
+
+Usage:
+    python benchmarks/bench_detectors.py [--iterations N] [--output PATH] [--only NAME ...]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+# Every message has to go through the whole pipeline, not be answered from the cache
+os.environ["COMPLETION_CACHE_MAX_ENTRIES"] = "0"
+
+import gpti
+import llama_api
+from llm_client import get_llm_client
+from deep_listening import detect_deep_thought
+from mental_health_analysis import analyze_text
+from mood_encouragement import detect_negative_mood
+from positive_responses import detect_positive_mood
+from therapist_contacts import detect_therapist_request
+from wellness_routines import detect_wellness_routine_request
+
+CORPUS_PATH = os.path.join(BENCHMARK_DIR, "corpus.json")
+USER_ID = "bench-user"
+
+class StubLLMResponse:
+    """Minimal stand-in for the HuggingFace inference response."""
+
+    status_code = 200
+
+    def __init__(self, prompt):
+        self.text = json.dumps([{"generated_text": prompt + " Thank you for sharing that with me. I'm here for you."}])
+
+    def json(self):
+        return json.loads(self.text)
+
+def stub_llm_post(backend, url, headers=None, json=None):
+    """Reply instantly instead of calling the inference API."""
+    return StubLLMResponse(json["inputs"])
+
+@contextmanager
+def stubbed_llm():
+    """Route the LLM client's calls to the stub for the duration of the block."""
+    client = get_llm_client()
+    client.post = stub_llm_post
+    try:
+        yield
+    finally:
+        del client.post
+
+def run_pipeline(text):
+    with stubbed_llm():
+        return llama_api.get_llama_response(text, "bench-session")
+
+BENCHMARKS = {
+    "detect_deep_thought": detect_deep_thought,
+    "detect_negative_mood": lambda text: detect_negative_mood(text, USER_ID),
+    "detect_positive_mood": detect_positive_mood,
+    "detect_wellness_routine_request": detect_wellness_routine_request,
+    "detect_therapist_request": detect_therapist_request,
+    "analyze_text": lambda text: analyze_text(text, USER_ID),
+    "fallback_response[llama_api]": llama_api.fallback_response,
+    "fallback_response[gpti]": gpti.fallback_response,
+    "get_llama_response[stubbed llm]": run_pipeline,
+}
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as corpus_file:
+        return json.load(corpus_file)
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_samples) - 1, int(round(fraction * len(sorted_samples) + 0.5)) - 1))
+    return sorted_samples[index]
+
+def summarize(samples_ns):
+    samples = sorted(samples_ns)
+    total_s = sum(samples) / 1e9
+    return {
+        "calls": len(samples),
+        "p50_us": percentile(samples, 0.50) / 1e3,
+        "p95_us": percentile(samples, 0.95) / 1e3,
+        "p99_us": percentile(samples, 0.99) / 1e3,
+        "mean_us": total_s * 1e6 / len(samples),
+        "messages_per_second": len(samples) / total_s if total_s else float("inf"),
+    }
+
+def run_benchmark(func, corpus, iterations):
+    """Time every call separately; returns the overall summary and one per label."""
+    # One untimed pass so lazy compilation and first-use caches are not measured
+    for entry in corpus:
+        func(entry["text"])
+
+    samples = []
+    samples_by_label = {}
+    clock = time.perf_counter_ns
+    for _ in range(iterations):
+        for entry in corpus:
+            start = clock()
+            func(entry["text"])
+            elapsed = clock() - start
+            samples.append(elapsed)
+            samples_by_label.setdefault(entry["label"], []).append(elapsed)
+
+    result = summarize(samples)
+    result["by_label"] = {label: summarize(label_samples) for label, label_samples in samples_by_label.items()}
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=50, help="passes over the corpus per benchmark")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="labelled corpus (JSON list of {label, text})")
+    parser.add_argument("--output", default="bench_detectors.json", help="where to write the JSON results")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only the named benchmarks")
+    args = parser.parse_args()
+
+    # The servers log every reply at INFO; keep that out of the timings and the report
+    logging.getLogger().setLevel(logging.WARNING)
+
+    corpus = load_corpus(args.corpus)
+    names = args.only or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"Unknown benchmark(s): {', '.join(unknown)}. Available: {', '.join(BENCHMARKS)}")
+
+    results = {}
+    print(f"{'benchmark':34} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9} {'msg/s':>10}")
+    for name in names:
+        result = results[name] = run_benchmark(BENCHMARKS[name], corpus, args.iterations)
+        print(f"{name:34} {result['p50_us']:9.1f} {result['p95_us']:9.1f} {result['p99_us']:9.1f} {result['messages_per_second']:10.0f}")
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {"path": os.path.abspath(args.corpus), "messages": len(corpus)},
+        "iterations": args.iterations,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
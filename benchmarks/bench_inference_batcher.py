@@ -0,0 +1,116 @@
+"""
+Benchmark for micro-batching of Llama API calls.
+
+Sends messages through the Llama pipeline from many threads against a mock inference
+server that, like a single GPU, works on one request at a time: each request costs a
+fixed overhead plus a little per prompt in it. Compares the throughput and latency
+without batching and with batches of several sizes, and checks that every message got
+the answer to its own prompt back.
+
+Usage:
+    python benchmarks/bench_inference_batcher.py [--messages N] [--threads N] [--window-ms MS]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class BatchingInferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    request_cost = 0.04
+    prompt_cost = 0.002
+    device = threading.Lock()
+    requests = 0
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        prompts = payload["inputs"] if isinstance(payload["inputs"], list) else [payload["inputs"]]
+        with self.device:
+            type(self).requests += 1
+            time.sleep(self.request_cost + self.prompt_cost * len(prompts))
+        # Echo the user's message, so a reply that went to the wrong caller shows
+        results = [
+            [{"generated_text": f"{prompt} You said: {prompt.rsplit(chr(10), 1)[-1].replace(' [/INST]', '')}"}]
+            for prompt in prompts
+        ]
+        data = json.dumps(results if isinstance(payload["inputs"], list) else results[0]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def run(llama_api, count, threads, tag):
+    def send(index):
+        message = f"Tell me something about the weather ({tag} {index})"
+        start = time.perf_counter()
+        reply = llama_api.get_llama_response(message, f"bench-batcher-{tag}-{index}")
+        return time.perf_counter() - start, reply == f"You said: {message}"
+
+    BatchingInferenceHandler.requests = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(send, range(count)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "throughput": count / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1e3,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1e3,
+        "api_requests": BatchingInferenceHandler.requests,
+        "wrong": sum(1 for _, correct in results if not correct),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--sizes", default="4,8,16", help="batch sizes to compare, comma separated")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BatchingInferenceHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # llama_api reads its configuration when it is imported
+    os.environ["HUGGINGFACE_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}/models/llama"
+    os.environ["LLM_POOL_MAXSIZE"] = str(args.threads)
+    # Every message has to reach the API, however long it queues there
+    os.environ["COMPLETION_CACHE_MAX_ENTRIES"] = "0"
+    os.environ["HUGGINGFACE_READ_TIMEOUT"] = "120"
+    import llama_api
+    from inference_batcher import InferenceBatcher
+    logging.disable(logging.CRITICAL)
+
+    print(f"{args.messages} messages on {args.threads} threads; the API takes "
+          f"{BatchingInferenceHandler.request_cost * 1e3:.0f}ms per request + "
+          f"{BatchingInferenceHandler.prompt_cost * 1e3:.0f}ms per prompt, one request at a time")
+    print(f"{'batching':24} {'msgs/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'API requests':>13} {'wrong':>6}")
+    failed = False
+    configurations = [("none", None)] + [(int(size), InferenceBatcher(llama_api.post_llama_api, int(size), args.window_ms / 1e3))
+                                         for size in args.sizes.split(",")]
+    for size, batcher in configurations:
+        llama_api.llama_batcher = batcher
+        result = run(llama_api, args.messages, args.threads, size)
+        label = "none" if batcher is None else f"up to {size}, {args.window_ms:g}ms window"
+        print(f"{label:24} {result['throughput']:7.1f} {result['p50_ms']:8.1f} {result['p99_ms']:8.1f} "
+              f"{result['api_requests']:>13} {result['wrong']:>6}")
+        failed = failed or result["wrong"] > 0
+    server.shutdown()
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark for the pooled LLM HTTP client.
+
+Runs a local HTTPS server that answers like the inference API and compares the
+previous per-message `requests.post` call, which opens a new connection (TCP and TLS
+handshake) every time, with LLMClient's keep-alive pool, sequentially and from several
+threads. Reports latency and the connections each one opened.
+
+Needs the `openssl` command to create a self-signed certificate; without it the server
+falls back to plain HTTP, which leaves out the TLS handshake.
+
+Usage:
+    python benchmarks/bench_llm_client.py [--requests N] [--threads N] [--server-delay S]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_client import LLMClient
+
+REPLY = json.dumps([{"generated_text": "[INST] hi [/INST] I'm here for you."}]).encode()
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    connections = 0
+    connections_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; without this Nagle's algorithm holds
+        # the body back until the client acknowledges the headers
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with InferenceHandler.connections_lock:
+            InferenceHandler.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.delay:
+            time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(REPLY)))
+        self.end_headers()
+        self.wfile.write(REPLY)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(directory):
+    server = ThreadingHTTPServer(("localhost", 0), InferenceHandler)
+    server.daemon_threads = True
+    scheme, certificate = "http", None
+    if shutil.which("openssl"):
+        certificate = os.path.join(directory, "cert.pem")
+        key = os.path.join(directory, "key.pem")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", certificate,
+             "-days", "1", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"],
+            check=True, capture_output=True
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certificate, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://localhost:{server.server_address[1]}/models/llama", certificate
+
+def run(post, requests_count, threads):
+    payload = {"inputs": "[INST] hi [/INST]", "parameters": {"max_new_tokens": 150}}
+    InferenceHandler.connections = 0
+
+    def timed(_):
+        start = time.perf_counter()
+        response = post(payload)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        samples = sorted(executor.map(timed, range(requests_count)))
+    elapsed = time.perf_counter() - start
+    return {
+        "p50_ms": samples[len(samples) // 2] * 1e3,
+        "p99_ms": samples[int(len(samples) * 0.99)] * 1e3,
+        "requests_per_second": requests_count / elapsed,
+        "connections": InferenceHandler.connections,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--server-delay", type=float, default=0.0, help="seconds the server takes per reply")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench-llm-client-")
+    try:
+        InferenceHandler.delay = args.server_delay
+        server, url, certificate = start_server(directory)
+        verify = certificate or True
+
+        client = LLMClient(pool_maxsize=args.threads)
+        # A CA bundle from the environment would otherwise take precedence over `verify`
+        client.session.trust_env = False
+        client.session.verify = verify
+
+        def per_call(payload):
+            return requests.post(url, json=payload, verify=verify, timeout=(3.05, 30))
+
+        def pooled(payload):
+            return client.post("huggingface", url, json=payload)
+
+        print(f"server: {url}")
+        print(f"{'client':22} {'threads':>7} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8} {'connections':>12}")
+        for threads in (1, args.threads):
+            for name, post in (("requests.post per call", per_call), ("pooled LLMClient", pooled)):
+                result = run(post, args.requests, threads)
+                print(f"{name:22} {threads:>7} {result['p50_ms']:8.2f} {result['p99_ms']:8.2f} "
+                      f"{result['requests_per_second']:8.0f} {result['connections']:>12}")
+        print(f"client stats: {client.stats()}")
+        server.shutdown()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark for the token-budgeted prompt builder.
+
+Plays conversations drawn from the benchmark corpus turn by turn and builds the Llama
+prompt for every new message, as the Llama backend does. Reports the time per prompt
+with the token counts cached on the messages and with every message recounted each
+time, and the size of the prompts against a prompt of the whole history.
+
+Usage:
+    python benchmarks/bench_prompt_builder.py [--turns N] [--budget TOKENS] [--history N]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from conversation import ConversationHistory, register_system_message
+from prompt_builder import PromptBuilder, count_tokens, llama_prompt
+from records import MessageRecord, ROLE_USER, ROLE_ASSISTANT
+
+def conversation(turns, seed=1):
+    with open(os.path.join(BENCHMARK_DIR, "corpus.json")) as corpus:
+        texts = [entry["text"] for entry in json.load(corpus)]
+    rng = random.Random(seed)
+    # Replies are a few of the corpus messages long, like the model's
+    return [(rng.choice(texts), " ".join(rng.choices(texts, k=3))) for _ in range(turns)]
+
+def run(builder, exchanges, capacity, recount):
+    history = ConversationHistory(capacity, "bench")
+    elapsed = 0.0
+    sizes = []
+    for user, reply in exchanges:
+        history.append(MessageRecord(ROLE_USER, user))
+        if recount:
+            for message in history:
+                message.tokens = None
+        start = time.perf_counter()
+        prompt = builder.llama_prompt(history)
+        elapsed += time.perf_counter() - start
+        sizes.append((count_tokens(prompt), count_tokens(llama_prompt(history.chat_messages()))))
+        history.append(MessageRecord(ROLE_ASSISTANT, reply))
+    return elapsed / len(exchanges), sizes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--budget", type=int, default=1024, help="PROMPT_TOKEN_BUDGET for the run")
+    parser.add_argument("--history", type=int, default=50, help="turns kept in the history")
+    args = parser.parse_args()
+
+    register_system_message(
+        "bench",
+        "You are a supportive mental health chatbot. Respond with empathy and care. Provide helpful suggestions "
+        "but make it clear you are not a replacement for professional help."
+    )
+    builder = PromptBuilder(args.budget)
+    exchanges = conversation(args.turns)
+
+    print(f"{args.turns} turns, history of {args.history} turns, budget {args.budget} tokens")
+    print(f"{'token counts':14} {'us/prompt':>10}")
+    for label, recount in (("recounted", True), ("cached", False)):
+        per_prompt, sizes = run(builder, exchanges, args.history, recount)
+        print(f"{label:14} {per_prompt * 1e6:10.1f}")
+
+    packed = sorted(size for size, _ in sizes)
+    full = sorted(size for _, size in sizes)
+    print(f"prompt tokens, packed:       p50 {packed[len(packed) // 2]:>6}  max {packed[-1]:>6}")
+    print(f"prompt tokens, full history: p50 {full[len(full) // 2]:>6}  max {full[-1]:>6}")
+    # The estimate of the built prompt can run a little over the per-message estimates
+    if packed[-1] > args.budget * 1.1:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
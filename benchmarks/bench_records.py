@@ -0,0 +1,77 @@
+"""
+Benchmark for the compact history records.
+
+Compares the previous history entries (dicts holding an ISO-8601 timestamp string) with
+MessageRecord/MoodEvent (slotted objects holding a float epoch timestamp): memory and
+pickled size of a full session history, and the cost of a one-hour cooldown check.
+
+Usage:
+    python benchmarks/bench_records.py [--sessions N] [--iterations N]
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import MessageRecord, MoodEvent, seconds_since
+
+MESSAGES_PER_SESSION = 10
+MOODS_PER_SESSION = 20
+
+def legacy_session(index):
+    conversation = [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f"message {index}-{i}", 'timestamp': datetime.now().isoformat()}
+        for i in range(MESSAGES_PER_SESSION)
+    ]
+    moods = [{"type": "sadness", "timestamp": datetime.now().isoformat()} for _ in range(MOODS_PER_SESSION)]
+    return conversation, moods
+
+def record_session(index):
+    conversation = [
+        MessageRecord.now('user' if i % 2 == 0 else 'assistant', f"message {index}-{i}")
+        for i in range(MESSAGES_PER_SESSION)
+    ]
+    moods = [MoodEvent("sadness", time.time()) for _ in range(MOODS_PER_SESSION)]
+    return conversation, moods
+
+def measure_memory(make_session, sessions):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    histories = [make_session(i) for i in range(sessions)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    pickled = sum(len(pickle.dumps(history, pickle.HIGHEST_PROTOCOL)) for history in histories) / sessions
+    return (after - before) / sessions, pickled
+
+def time_cooldown(check, value, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        check(value)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    legacy_bytes, legacy_pickled = measure_memory(legacy_session, args.sessions)
+    record_bytes, record_pickled = measure_memory(record_session, args.sessions)
+
+    legacy_ns = time_cooldown(lambda stamp: datetime.now() - datetime.fromisoformat(stamp) < timedelta(hours=1), datetime.now().isoformat(), args.iterations)
+    record_ns = time_cooldown(lambda stamp: seconds_since(stamp) < 3600, time.time(), args.iterations)
+
+    print(f"session: {MESSAGES_PER_SESSION} messages + {MOODS_PER_SESSION} mood events")
+    print(f"{'':22} {'dict + ISO':>12} {'records':>12}")
+    print(f"{'memory bytes/session':22} {legacy_bytes:12.0f} {record_bytes:12.0f}")
+    print(f"{'pickled bytes/session':22} {legacy_pickled:12.0f} {record_pickled:12.0f}")
+    print(f"{'cooldown check ns':22} {legacy_ns:12.0f} {record_ns:12.0f}")
+
+if __name__ == "__main__":
+    main()
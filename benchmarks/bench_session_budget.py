@@ -0,0 +1,54 @@
+"""
+Benchmark for the session store's memory budget.
+
+Simulates a burst of requests that each arrive without a session cookie, so every one
+creates a new session with a conversation history, mood history and mental health
+history, and samples the process's resident memory as the burst goes on. With the
+budget enforced, memory levels off once the store is full and the oldest sessions are
+evicted instead.
+
+Usage:
+    python benchmarks/bench_session_budget.py [--sessions N] [--max-bytes N]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_session_journal import session_values
+from session_store import MemorySessionStore
+
+def resident_bytes():
+    # Current resident set size; Linux only
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200000)
+    parser.add_argument("--max-bytes", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--samples", type=int, default=8)
+    args = parser.parse_args()
+
+    store = MemorySessionStore(max_entries=args.sessions, max_bytes=args.max_bytes)
+    baseline = resident_bytes()
+    step = max(1, args.sessions // args.samples)
+
+    print(f"budget: {args.max_bytes / 2**20:.0f} MiB")
+    print(f"{'sessions created':>16} {'stored':>8} {'accounted MiB':>14} {'RSS growth MiB':>15} {'evicted':>8}")
+    for index in range(1, args.sessions + 1):
+        session_id = str(uuid.uuid4())
+        for namespace, value in session_values(index).items():
+            store.set(namespace, session_id, value)
+        if index % step == 0:
+            gc.collect()
+            stats = store.stats()
+            print(f"{index:>16} {stats['sessions']:>8} {stats['bytes'] / 2**20:>14.1f} "
+                  f"{(resident_bytes() - baseline) / 2**20:>15.1f} {stats['evictions']['max_bytes']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark for session expiry at large session counts.
+
+Compares the per-request cost of the old `cleanup_old_sessions` hook, which scanned every
+stored conversation before each request, with the request path of the session store,
+whose expired sessions are removed by a background sweep. Also reports how long the
+sweep takes to drain every session once they have all expired.
+
+Usage:
+    python benchmarks/bench_session_expiry.py [--sessions N [N ...]] [--requests N]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import MemorySessionStore
+
+def make_history():
+    return [{'role': 'user', 'content': 'hello', 'timestamp': datetime.now().isoformat()}]
+
+def legacy_cleanup(conversation_history):
+    """Reproduce the old before_request hook: parse every session's last timestamp."""
+    current_time = datetime.now()
+    sessions_to_remove = []
+
+    for session_id, history in conversation_history.items():
+        if history:
+            last_message_time = datetime.fromisoformat(history[-1]['timestamp'])
+            if (current_time - last_message_time).total_seconds() > 86400:
+                sessions_to_remove.append(session_id)
+
+    for session_id in sessions_to_remove:
+        del conversation_history[session_id]
+
+def store_request(conversations, session_id):
+    """The session store traffic of one chat request: read, append, write back."""
+    history = conversations.get(session_id, [])
+    history.append({'role': 'user', 'content': 'how are you?', 'timestamp': datetime.now().isoformat()})
+    conversations[session_id] = history[-10:]
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+def bench_legacy(count, requests):
+    conversation_history = {f"session-{i}": make_history() for i in range(count)}
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        legacy_cleanup(conversation_history)
+        samples.append((time.perf_counter() - start) * 1e3)
+    return percentiles(samples)
+
+def bench_store(count, requests):
+    store = MemorySessionStore(ttl_seconds=3600, max_entries=count + 1, max_bytes=1 << 40)
+    conversations = store.namespace("conversation")
+    for i in range(count):
+        conversations[f"session-{i}"] = make_history()
+
+    samples = []
+    for i in range(requests):
+        start = time.perf_counter()
+        store_request(conversations, f"session-{(i * 7919) % count}")
+        samples.append((time.perf_counter() - start) * 1e3)
+    request_p50, request_p99 = percentiles(samples)
+
+    # Let every session expire, then time the background sweep
+    store.ttl_seconds = 0
+    start = time.perf_counter()
+    removed = store.expire()
+    sweep_s = time.perf_counter() - start
+    return request_p50, request_p99, removed, sweep_s
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--requests", type=int, default=2000, help="requests timed against the store")
+    parser.add_argument("--legacy-requests", type=int, default=5, help="requests timed against the old scan")
+    args = parser.parse_args()
+
+    print(f"{'sessions':>10} {'old hook p50 ms':>16} {'store p50 ms':>13} {'store p99 ms':>13} {'sweep s':>9}")
+    for count in args.sessions:
+        legacy_p50, _ = bench_legacy(count, args.legacy_requests)
+        gc.collect()
+        request_p50, request_p99, removed, sweep_s = bench_store(count, args.requests)
+        gc.collect()
+        if removed != count:
+            sys.exit(f"Sweep removed {removed} of {count} sessions")
+        print(f"{count:>10} {legacy_p50:16.2f} {request_p50:13.4f} {request_p99:13.4f} {sweep_s:9.2f}")
+
+if __name__ == "__main__":
+    main()
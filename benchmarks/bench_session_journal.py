@@ -0,0 +1,108 @@
+"""
+Benchmark for the session journal.
+
+Fills a MemorySessionStore with sessions shaped like the chatbot's (a conversation
+history, mood events and mental health counters per session), with and without a
+journal, and compares the time of a write on the request path. Then measures how long
+a restart takes to restore every session, from the journal segments alone and from a
+compacted snapshot.
+
+Usage:
+    python benchmarks/bench_session_journal.py [--sessions N] [--directory PATH]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation import ConversationHistory, register_system_message
+from records import MessageRecord, MoodEvent
+from session_journal import SessionJournal
+from session_store import MemorySessionStore
+
+TTL_SECONDS = 86400
+
+register_system_message("bench", "You are a supportive mental health assistant.")
+
+def session_values(index):
+    now = time.time()
+    history = ConversationHistory(9, "bench")
+    for turn in range(9):
+        history.append(MessageRecord("user" if turn % 2 == 0 else "assistant", f"message {index}-{turn} about my day", now))
+    moods = {"moods": [MoodEvent("sadness", now) for _ in range(5)], "last_encouragement": now}
+    trend = {"message_count": 9, "concerns": {"anxiety": {"count": 3, "severity": "medium", "first_detected": now, "last_detected": now, "last_message": 8}}}
+    return {"llama_conversation": history, "mood": moods, "mental_health": trend}
+
+def fill(store, sessions):
+    samples = []
+    for index in range(sessions):
+        session_id = f"session-{index:08d}"
+        for namespace, value in session_values(index).items():
+            start = time.perf_counter()
+            store.set(namespace, session_id, value)
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+def restore(directory, sessions):
+    store = MemorySessionStore(ttl_seconds=TTL_SECONDS, max_entries=sessions, max_bytes=1 << 40)
+    journal = SessionJournal(directory, TTL_SECONDS, compact_bytes=1 << 40)
+    start = time.perf_counter()
+    restored = journal.restore(store)
+    elapsed = time.perf_counter() - start
+    journal.close()
+    if restored != sessions:
+        sys.exit(f"Restored {restored} sessions, expected {sessions}")
+    start = time.perf_counter()
+    store.get("llama_conversation", f"session-{sessions // 2:08d}")
+    first_read = (time.perf_counter() - start) * 1e6
+    return elapsed, first_read
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--directory", help="journal directory (default: a temporary directory)")
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp(prefix="session-journal-")
+    try:
+        plain = MemorySessionStore(ttl_seconds=TTL_SECONDS, max_entries=args.sessions, max_bytes=1 << 40)
+        plain_p50, plain_p99 = fill(plain, args.sessions)
+        del plain
+
+        store = MemorySessionStore(ttl_seconds=TTL_SECONDS, max_entries=args.sessions, max_bytes=1 << 40)
+        journal = SessionJournal(directory, TTL_SECONDS, compact_bytes=1 << 40)
+        journal.restore(store)
+        journal_p50, journal_p99 = fill(store, args.sessions)
+        start = time.perf_counter()
+        journal.close()
+        drain = time.perf_counter() - start
+        del store
+
+        journal_bytes = directory_bytes(directory)
+        # Restoring only replays the journal, then compacts it in the background
+        from_journal, _ = restore(directory, args.sessions)
+        snapshot_bytes = directory_bytes(directory)
+        from_snapshot, first_read = restore(directory, args.sessions)
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"sessions: {args.sessions}, 3 namespaces each")
+    print(f"{'write p50/p99 us, no journal':34} {plain_p50:8.1f} {plain_p99:8.1f}")
+    print(f"{'write p50/p99 us, journal':34} {journal_p50:8.1f} {journal_p99:8.1f}")
+    print(f"{'writer drain on close s':34} {drain:8.2f}")
+    print(f"{'restore from journal s':34} {from_journal:8.2f}   ({journal_bytes / 1e6:.1f} MB)")
+    print(f"{'restore from snapshot s':34} {from_snapshot:8.2f}   ({snapshot_bytes / 1e6:.1f} MB)")
+    print(f"{'first read after restore us':34} {first_read:8.1f}")
+
+if __name__ == "__main__":
+    main()
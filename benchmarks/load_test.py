@@ -0,0 +1,211 @@
+"""
+Load test for multi-worker serving with the shared session store.
+
+Starts one of the backends under gunicorn (using gunicorn.conf.py) with each requested
+worker count, drives it with concurrent simulated users, and reports throughput and
+latency. Each simulated user keeps one session_id cookie for several messages; after the
+run the session store is checked to confirm every session's messages were recorded in
+one conversation, whichever workers served them.
+
+With --mock-llm, the gpti and llama_api backends get their replies from the local
+stand-in LLM API (mock_llm_server.py) with the given latency distribution, so the run
+spends no API quota and doesn't depend on the network.
+
+Usage:
+    python benchmarks/load_test.py [--app app:app] [--workers 1 2 4] [--concurrency N] [--duration S]
+        [--mock-llm lognormal:0.8,0.5]
+"""
+
+import argparse
+import http.client
+import importlib
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from mock_llm_server import start_mock_llm_server
+from session_store import SQLiteSessionStore
+
+# Session store namespace each backend keeps its conversations in
+CONVERSATION_NAMESPACES = {
+    "app": "app_conversation",
+    "gpti": "gpti_conversation",
+    "llama_api": "llama_conversation",
+}
+
+MESSAGES = [
+    "Hello there",
+    "I have been feeling sad and tired lately",
+    "Work has been stressful",
+    "Thanks for listening",
+    "Can you help me feel better?",
+]
+
+def wait_for_port(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+def simulated_user(port, deadline, messages_per_session, results, lock):
+    """Send sessions of several messages until the deadline, each with its own cookie."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    latencies = []
+    sessions = {}
+    errors = 0
+
+    while time.time() < deadline:
+        session_id = str(uuid.uuid4())
+        sent = []
+        for index in range(messages_per_session):
+            message = f"{MESSAGES[index % len(MESSAGES)]} ({session_id[:8]} #{index})"
+            body = json.dumps({"message": message})
+            start = time.perf_counter()
+            try:
+                connection.request("POST", "/chat", body, {"Content-Type": "application/json", "Cookie": f"session_id={session_id}"})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+                break
+            sent.append(message.lower())
+        sessions[session_id] = sent
+
+    connection.close()
+    with lock:
+        results["latencies"].extend(latencies)
+        results["sessions"].update(sessions)
+        results["errors"] += errors
+
+def verify_sessions(db_path, namespace, sessions):
+    """Check that every session's stored conversation holds the messages sent with its cookie."""
+    conversations = SQLiteSessionStore(db_path).namespace(namespace)
+    verified = 0
+    for session_id, sent in sessions.items():
+        if len(sent) < 2:
+            continue
+        history = conversations.get(session_id)
+        stored = [message.content.lower() for message in history or [] if message.role == "user"]
+        # The history may have dropped the oldest turns, but what is left has to be the
+        # most recent messages of this session, in order
+        if len(stored) < 2 or stored != sent[-len(stored):]:
+            return verified, False
+        verified += 1
+    return verified, True
+
+def run(app, workers, concurrency, duration, messages_per_session, port, verbose, llm_env=None):
+    db_dir = tempfile.mkdtemp(prefix="load-test-")
+    db_path = os.path.join(db_dir, "sessions.db")
+    env = dict(os.environ, SESSION_STORE="sqlite", SESSION_DB_PATH=db_path, PORT=str(port), WEB_CONCURRENCY=str(workers))
+    env.update(llm_env or {})
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--access-logfile", "/dev/null", "--log-level", "warning", app],
+        cwd=PROJECT_DIR, env=env, stdout=None if verbose else subprocess.DEVNULL, stderr=None if verbose else subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port, 30)
+        results = {"latencies": [], "sessions": {}, "errors": 0}
+        lock = threading.Lock()
+        deadline = time.time() + duration
+        threads = [
+            threading.Thread(target=simulated_user, args=(port, deadline, messages_per_session, results, lock))
+            for _ in range(concurrency)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    latencies = sorted(results["latencies"])
+    module = app.split(":")[0]
+    namespace = CONVERSATION_NAMESPACES[module]
+    # Stored histories refer to their backend's system prompt by name, so the backend has
+    # to be loaded to read them back
+    importlib.import_module(module)
+    verified, consistent = verify_sessions(db_path, namespace, results["sessions"])
+    shutil.rmtree(db_dir, ignore_errors=True)
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": results["errors"],
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1e3 if latencies else 0,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e3 if latencies else 0,
+        "sessions_verified": verified,
+        "sessions_consistent": consistent,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", default="app:app", help="WSGI app to serve (app:app, gpti:app or llama_api:app)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=16, help="simulated users")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per worker count")
+    parser.add_argument("--messages-per-session", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the server's log output")
+    parser.add_argument("--mock-llm", metavar="LATENCY", help="answer LLM calls from the local stand-in API with this latency distribution")
+    parser.add_argument("--mock-llm-error-rate", type=float, default=0.0, help="share of stand-in API calls that fail")
+    args = parser.parse_args()
+
+    if args.app.split(":")[0] not in CONVERSATION_NAMESPACES:
+        sys.exit(f"Unknown app: {args.app}")
+
+    llm_env = None
+    if args.mock_llm:
+        mock_llm = start_mock_llm_server(latency=args.mock_llm, error_rate=args.mock_llm_error_rate)
+        llm_env = {
+            "LLM_PROVIDER": "local",
+            "LOCAL_LLM_URL": f"{mock_llm.url}/models/llama",
+            "OPENAI_BASE_URL": f"{mock_llm.url}/v1",
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-mock"),
+        }
+
+    print(f"{'workers':>7} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'sessions ok':>12}")
+    all_results = []
+    for workers in args.workers:
+        result = run(args.app, workers, args.concurrency, args.duration, args.messages_per_session, args.port, args.verbose, llm_env)
+        all_results.append(result)
+        sessions = f"{result['sessions_verified']}" if result["sessions_consistent"] else "MISMATCH"
+        print(f"{workers:>7} {result['requests']:>9} {result['errors']:>7} {result['requests_per_second']:8.1f} "
+              f"{result['p50_ms']:8.1f} {result['p99_ms']:8.1f} {sessions:>12}")
+
+    if args.mock_llm:
+        print(f"stand-in LLM API answers: {mock_llm.stats()}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"app": args.app, "concurrency": args.concurrency, "results": all_results}, output_file, indent=2)
+
+    if not all(result["sessions_consistent"] for result in all_results):
+        sys.exit("Some sessions lost messages across workers")
+
+if __name__ == "__main__":
+    main()
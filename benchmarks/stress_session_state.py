@@ -0,0 +1,140 @@
+"""
+Stress test for concurrent requests against the per-session state.
+
+Sends thousands of /chat requests to llama_api through Flask test clients on many
+threads, with several requests of each session in flight at once and the LLM call
+stubbed with a short delay. Afterwards every session's state has to account for every
+request: the mental health history counted each message once, and the conversation
+history holds complete user/assistant turns for the latest messages.
+
+Run with --no-lock to see the lost updates the session locks prevent.
+
+Usage:
+    python benchmarks/stress_session_state.py [--threads N] [--sessions N] [--requests N] [--store memory|sqlite] [--no-lock]
+"""
+
+import argparse
+import logging
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGES = [
+    "I feel sad and lonely today",
+    "I'm so anxious about my exams",
+    "Work has been stressful and I can't sleep",
+    "Tell me something nice",
+    "I feel hopeless and tired",
+    "Can you recommend a song?",
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--llm-delay", type=float, default=0.002, help="seconds the stubbed LLM call takes")
+    parser.add_argument("--store", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--no-lock", action="store_true", help="run without the session locks")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    # The store is configured from the environment when it is first used
+    database_dir = tempfile.mkdtemp(prefix="stress-sessions-")
+    os.environ["SESSION_STORE"] = args.store
+    os.environ["SESSION_DB_PATH"] = os.path.join(database_dir, "sessions.db")
+    os.environ["SESSION_MAX_ENTRIES"] = str(args.sessions * 2)
+    os.environ["SESSION_EXPIRY_INTERVAL"] = "0"
+    # Every message has to wait for the stubbed LLM call, not be answered from the cache
+    os.environ["COMPLETION_CACHE_MAX_ENTRIES"] = "0"
+
+    import llama_api
+    import session_store
+    from bench_detectors import stub_llm_post
+    from llm_client import get_llm_client
+    from mental_health_analysis import user_mental_health_history
+
+    logging.disable(logging.INFO)
+
+    def slow_llm_post(backend, url, headers=None, json=None):
+        time.sleep(args.llm_delay)
+        return stub_llm_post(backend, url, headers=headers, json=json)
+
+    get_llm_client().post = slow_llm_post
+    if args.no_lock:
+        llama_api.session_lock = lambda session_id: nullcontext()
+
+    # Each request goes to a random session, so the threads often hold several requests
+    # of one session at once
+    session_ids = [f"stress-{index}" for index in range(args.sessions)]
+    sent = {session_id: 0 for session_id in session_ids}
+    requests = []
+    for index in range(args.requests):
+        session_id = random.choice(session_ids)
+        sent[session_id] += 1
+        requests.append((session_id, f"{random.choice(MESSAGES)} #{index}"))
+    work = queue.SimpleQueue()
+    for request in requests:
+        work.put(request)
+    failures = []
+
+    def worker():
+        client = llama_api.app.test_client()
+        while True:
+            try:
+                session_id, message = work.get_nowait()
+            except queue.Empty:
+                return
+            client.set_cookie("session_id", session_id)
+            response = client.post("/chat", json={"message": message})
+            if response.status_code != 200:
+                failures.append((session_id, response.status_code, response.get_data(as_text=True)))
+
+    # Switch threads far more often than usual, so races get every chance to show up
+    sys.setswitchinterval(1e-5)
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    lost_counts = 0
+    broken_histories = 0
+    for session_id in session_ids:
+        trend = user_mental_health_history.get(session_id) or {}
+        if trend.get("message_count") != sent[session_id]:
+            lost_counts += 1
+        history = llama_api.conversation_history.get(session_id)
+        turns = list(history.turns) if history is not None else []
+        roles = [message.role for message in turns]
+        # Each request adds a user turn then an assistant turn; a lost update shows up as
+        # a short history or two turns of the same role in a row
+        complete = len(turns) == min(2 * sent[session_id], llama_api.HISTORY_TURNS)
+        if not complete or any(first == second for first, second in zip(roles, roles[1:])):
+            broken_histories += 1
+
+    print(f"{args.requests} requests, {args.sessions} sessions, {args.threads} threads, "
+          f"{args.store} store, locks {'off' if args.no_lock else 'on'}")
+    print(f"{args.requests / elapsed:.0f} req/s, {len(failures)} failed requests")
+    print(f"sessions with lost message counts: {lost_counts}")
+    print(f"sessions with broken conversation histories: {broken_histories}")
+    print(f"session locks still held: {len(session_store._session_locks)}")
+
+    if failures:
+        print(f"first failure: {failures[0]}")
+    if failures or lost_counts or broken_histories or len(session_store._session_locks):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
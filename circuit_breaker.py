@@ -0,0 +1,206 @@
+"""
+Circuit breakers for the LLM backends.
+
+When an LLM API is down or rate limited, every message would still wait for its call to
+fail before the backend falls back to its rule-based replies. A backend's breaker opens
+after a run of consecutive failed calls (errors, timeouts, 429 and 5xx responses); while
+it is open, calls are rejected at once with CircuitOpenError and the backends reply with
+their fallback without touching the network. Once `reset_timeout` has passed, the breaker
+lets a few trial calls through (half-open): one success closes it again, one failure opens
+it for another `reset_timeout`.
+
+The LLM clients check the breaker of the backend they call. Breakers are per process, and
+are configured with environment variables:
+
+- LLM_CIRCUIT_FAILURES: Consecutive failures that open a breaker (default 5; 0 disables the breakers)
+- LLM_CIRCUIT_RESET_SECONDS: Seconds a breaker stays open before it lets trial calls through (default 30)
+- LLM_CIRCUIT_HALF_OPEN_CALLS: Trial calls let through at once while half-open (default 1)
+"""
+
+import logging
+import os
+import threading
+import time
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+DEFAULT_HALF_OPEN_CALLS = 1
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit breaker is open."""
+
+def is_failure_status(status_code):
+    """
+    Tell whether an API response counts as a failure of the backend.
+
+    Args:
+        status_code (int): HTTP status code, or None if no response arrived
+
+    Returns:
+        bool: True for no response, rate limiting and server errors
+    """
+    return status_code is None or status_code == 429 or status_code >= 500
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one backend. Safe to share between threads.
+
+    Call `allow()` before each call to the backend and, if it allowed the call,
+    `record(succeeded)` once the call is over, or `cancel()` if it was abandoned.
+
+    Args:
+        name (str): Backend name, for logging
+        failure_threshold (int): Consecutive failures that open the breaker; 0 never opens it
+        reset_timeout (float): Seconds the breaker stays open before trial calls
+        half_open_calls (int): Trial calls let through at once while half-open
+    """
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT,
+                 half_open_calls=DEFAULT_HALF_OPEN_CALLS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._lock = threading.Lock()
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self):
+        """
+        Decide whether a call may go to the backend.
+
+        Returns:
+            bool: False if the breaker is open, or half-open with all trial calls taken
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self._trials = 0
+                logging.info(f"Circuit for {self.name} is half-open, sending trial calls")
+            if self.state == HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    self.rejected += 1
+                    return False
+                self._trials += 1
+            return True
+
+    def record(self, succeeded):
+        """
+        Record the outcome of a call `allow()` let through.
+
+        Args:
+            succeeded (bool): False if the call failed, see `is_failure_status`
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trials = max(self._trials - 1, 0)
+            if succeeded:
+                self.successes += 1
+                self.consecutive_failures = 0
+                if self.state == HALF_OPEN:
+                    self.state = CLOSED
+                    logging.info(f"Circuit for {self.name} is closed again")
+                return
+
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                reason = "a failed trial call"
+            elif self.state == CLOSED and 0 < self.failure_threshold <= self.consecutive_failures:
+                reason = f"{self.consecutive_failures} consecutive failures"
+            else:
+                return
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+            logging.warning(
+                f"Circuit for {self.name} opened after {reason}; using fallback replies for {self.reset_timeout}s"
+            )
+
+    def cancel(self):
+        """
+        Give back a call `allow()` let through that was abandoned before it had an outcome,
+        e.g. because the client went away.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trials = max(self._trials - 1, 0)
+
+    def stats(self):
+        """
+        Report the breaker's state and counters.
+
+        Returns:
+            dict: Statistics, safe to serialize as JSON
+        """
+        with self._lock:
+            retry_in = 0.0
+            if self.state == OPEN:
+                retry_in = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "retry_in": retry_in,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+            }
+
+_circuit_breakers = {}
+_circuit_breakers_pid = None
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(backend):
+    """
+    Get the process's circuit breaker of a backend, creating it on first use.
+
+    Worker processes forked by gunicorn each start with closed breakers.
+
+    Args:
+        backend (str): Backend name
+
+    Returns:
+        CircuitBreaker: The backend's breaker
+    """
+    global _circuit_breakers_pid
+
+    with _circuit_breakers_lock:
+        if _circuit_breakers_pid != os.getpid():
+            _circuit_breakers.clear()
+            _circuit_breakers_pid = os.getpid()
+        breaker = _circuit_breakers.get(backend)
+        if breaker is None:
+            breaker = _circuit_breakers[backend] = CircuitBreaker(
+                backend,
+                failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURES", DEFAULT_FAILURE_THRESHOLD)),
+                reset_timeout=float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", DEFAULT_RESET_TIMEOUT)),
+                half_open_calls=int(os.getenv("LLM_CIRCUIT_HALF_OPEN_CALLS", DEFAULT_HALF_OPEN_CALLS))
+            )
+        return breaker
+
+def circuit_breaker_stats():
+    """
+    Report the state of every backend's circuit breaker in this process.
+
+    Returns:
+        dict: Backend name -> breaker statistics
+    """
+    with _circuit_breakers_lock:
+        breakers = dict(_circuit_breakers) if _circuit_breakers_pid == os.getpid() else {}
+    return {backend: breaker.stats() for backend, breaker in breakers.items()}
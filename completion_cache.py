@@ -0,0 +1,271 @@
+"""
+Cache of LLM completions.
+
+The Llama prompt carries as much of the conversation as fits (see prompt_builder.py), so
+only a session's first message, whose prompt holds the system text and that message
+alone, sends the same request to the inference API whenever it is repeated ("hi", "i feel
+anxious"). The Llama backends cache the API's successful answers to those prompts, keyed
+on the backend, the normalized prompt (case and runs of whitespace ignored) and the
+generation parameters, so a repeated opening message is answered without a network call.
+Answers to later messages are not cached, as their prompts are practically never sent
+again.
+
+Two tiers are used:
+
+- An in-process LRU of at most `max_entries` answers, each kept for `ttl_seconds`.
+- Optionally a SQLite database, shared by all worker processes and kept across restarts.
+  An answer found there is copied into the in-process tier.
+
+The cache is configured with environment variables:
+
+- COMPLETION_CACHE_MAX_ENTRIES: Answers kept in process (default 1000; 0 disables the cache)
+- COMPLETION_CACHE_TTL_SECONDS: Seconds an answer is reused (default 3600)
+- COMPLETION_CACHE_DB_PATH: SQLite database for the shared tier (unset by default, no shared tier)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL_SECONDS = 60 * 60
+
+# Seconds between sweeps of expired answers from the shared tier
+PURGE_INTERVAL = 60
+
+def normalize_prompt(prompt):
+    """
+    Normalize a prompt for use in a cache key.
+
+    Args:
+        prompt (str): Prompt sent to the API
+
+    Returns:
+        str: The prompt lowercased, with runs of whitespace collapsed to one space
+    """
+    return " ".join(prompt.lower().split())
+
+def completion_key(backend, payload):
+    """
+    Build the cache key of an inference API request.
+
+    Args:
+        backend (str): Backend name
+        payload (dict): Request body, with the prompt in "inputs" and the generation
+            parameters in "parameters"
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    key = json.dumps({
+        "backend": backend,
+        "prompt": normalize_prompt(payload["inputs"]),
+        "parameters": payload.get("parameters", {}),
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+class SQLiteCompletionTier:
+    """
+    Completions stored in a SQLite database in WAL mode, shared by worker processes.
+
+    Each thread, and each process after a fork, opens its own connection. Expired
+    answers are swept every PURGE_INTERVAL seconds while answers are being stored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._last_purge = 0.0
+        self._connection()
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, body TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS completions_expires_at ON completions (expires_at)")
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def get(self, key):
+        """
+        Look up an answer.
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            tuple: (body, expiry as a Unix time), or None if there is no live answer
+        """
+        row = self._connection().execute(
+            "SELECT body, expires_at FROM completions WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def set(self, key, body, expires_at):
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO completions (key, body, expires_at) VALUES (?, ?, ?)", (key, body, expires_at)
+        )
+        now = time.time()
+        if now - self._last_purge >= PURGE_INTERVAL:
+            self._last_purge = now
+            connection.execute("DELETE FROM completions WHERE expires_at < ?", (now,))
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM completions WHERE expires_at >= ?", (time.time(),)
+        ).fetchone()[0]
+
+class CompletionCache:
+    """
+    LRU cache of LLM API answers with a time to live and an optional shared tier.
+
+    Safe to share between threads.
+
+    Args:
+        max_entries (int): Answers kept in process; the least recently used is evicted
+        ttl_seconds (float): Seconds an answer is reused after it was stored
+        shared (SQLiteCompletionTier): Shared tier, or None for an in-process cache only
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, shared=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        # key -> (body, expiry as a Unix time), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, backend, payload):
+        """
+        Look up the API's answer to a request.
+
+        Args:
+            backend (str): Backend name
+            payload (dict): Request body
+
+        Returns:
+            str: The cached response body, or None
+        """
+        key = completion_key(backend, payload)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+                self.expired += 1
+
+        entry = self.shared.get(key) if self.shared is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+            self._put(key, entry)
+        return entry[0]
+
+    def set(self, backend, payload, body):
+        """
+        Store the API's answer to a request.
+
+        Args:
+            backend (str): Backend name
+            payload (dict): Request body
+            body (str): Response body of a successful call
+        """
+        key = completion_key(backend, payload)
+        entry = (body, time.time() + self.ttl_seconds)
+        with self._lock:
+            self.stores += 1
+            self._put(key, entry)
+        if self.shared is not None:
+            self.shared.set(key, *entry)
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Report the cache's size, hits and misses.
+
+        Returns:
+            dict: Statistics of this process, safe to serialize as JSON
+        """
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            stats = {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+        if self.shared is not None:
+            stats["shared_entries"] = len(self.shared)
+        return stats
+
+def create_completion_cache():
+    """
+    Create a completion cache from the COMPLETION_CACHE_* environment variables.
+
+    Returns:
+        CompletionCache: The configured cache, or None if it is disabled
+    """
+    max_entries = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    if max_entries <= 0:
+        return None
+    db_path = os.getenv("COMPLETION_CACHE_DB_PATH")
+    return CompletionCache(
+        max_entries=max_entries,
+        ttl_seconds=float(os.getenv("COMPLETION_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+        shared=SQLiteCompletionTier(db_path) if db_path else None
+    )
+
+_completion_cache = None
+_completion_cache_created = False
+_completion_cache_lock = threading.Lock()
+
+def get_completion_cache():
+    """
+    Get the process-wide completion cache, creating it on first use.
+
+    Returns:
+        CompletionCache: The shared cache, or None if it is disabled
+    """
+    global _completion_cache, _completion_cache_created
+
+    if not _completion_cache_created:
+        with _completion_cache_lock:
+            if not _completion_cache_created:
+                _completion_cache = create_completion_cache()
+                _completion_cache_created = True
+    return _completion_cache
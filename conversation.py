@@ -0,0 +1,101 @@
+"""
+Conversation history container shared by the chat backends.
+
+A ConversationHistory keeps the most recent turns of a conversation in a fixed-capacity
+ring buffer, so adding a turn drops the oldest one in O(1) instead of copying the list
+to trim it. The system prompt is not stored per session: it is registered once per
+process under a name, and each history only keeps that name, also when it is pickled
+into the session store.
+"""
+
+import sys
+from collections import deque
+from records import MessageRecord, ROLE_SYSTEM
+
+# Registered system messages: name -> MessageRecord
+SYSTEM_MESSAGES = {}
+
+def register_system_message(name, content):
+    """
+    Register a system prompt that conversation histories can pin by name.
+
+    Args:
+        name (str): Name the histories refer to the prompt by
+        content (str): The system prompt
+
+    Returns:
+        MessageRecord: The shared system message
+    """
+    message = SYSTEM_MESSAGES[name] = MessageRecord(ROLE_SYSTEM, sys.intern(content))
+    return message
+
+class ConversationHistory:
+    """
+    The system message (if any) followed by the last `capacity` turns of a conversation.
+
+    Iterating yields the messages in order, system message first, the same list the
+    backends used to build by slicing; `chat_messages` gives them in the format chat
+    completion APIs expect.
+    """
+
+    __slots__ = ("system_message_name", "turns")
+
+    def __init__(self, capacity, system_message_name=None, turns=()):
+        if system_message_name is not None and system_message_name not in SYSTEM_MESSAGES:
+            raise KeyError(f"Unknown system message: {system_message_name}")
+        self.system_message_name = system_message_name
+        self.turns = deque(turns, maxlen=capacity)
+
+    @property
+    def capacity(self):
+        return self.turns.maxlen
+
+    @property
+    def system_message(self):
+        if self.system_message_name is None:
+            return None
+        return SYSTEM_MESSAGES[self.system_message_name]
+
+    def append(self, message):
+        """
+        Add a turn, dropping the oldest one when the history is full.
+
+        Args:
+            message (MessageRecord): The new message
+        """
+        self.turns.append(message)
+
+    def chat_messages(self):
+        """
+        Get the messages as {"role", "content"} dicts, system message first.
+
+        Returns:
+            list: The messages
+        """
+        return [message.as_chat_message() for message in self]
+
+    def __iter__(self):
+        if self.system_message_name is not None:
+            yield SYSTEM_MESSAGES[self.system_message_name]
+        yield from self.turns
+
+    def __len__(self):
+        return len(self.turns) + (self.system_message_name is not None)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if self.system_message_name is not None:
+            if index == 0:
+                return SYSTEM_MESSAGES[self.system_message_name]
+            index -= 1
+        if index < 0:
+            raise IndexError("history index out of range")
+        return self.turns[index]
+
+    def __reduce__(self):
+        # Only the system message's name is pickled, never the prompt itself
+        return (ConversationHistory, (self.turns.maxlen, self.system_message_name, list(self.turns)))
+
+    def __repr__(self):
+        return f"ConversationHistory({self.capacity}, {self.system_message_name!r}, {list(self.turns)!r})"
@@ -0,0 +1,105 @@
+"""
+Latency budgets for chat requests.
+
+Every /chat request gets a Deadline when it arrives. Waiting for the session lock, the
+detectors and the history updates spend part of it, and the LLM call only gets what is
+left: `run_within` runs the call on a background thread and stops waiting for it when the
+deadline passes, so the backend can reply with its fallback at once. The call itself runs
+on to completion, so a late answer can still be cached for the next time.
+
+Configured with environment variables:
+
+- CHAT_DEADLINE_SECONDS: Time a /chat request has to produce its reply (default 10; 0 disables the deadline)
+- LLM_CALL_WORKERS: Threads making LLM calls for requests with a deadline (default 32)
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+DEFAULT_CHAT_DEADLINE = 10
+DEFAULT_LLM_CALL_WORKERS = 32
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before the work it waited for is done."""
+
+class Deadline:
+    """
+    Point in time by which a request has to be answered.
+
+    Args:
+        seconds (float): Time from now until the deadline
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """
+        Get the time left until the deadline.
+
+        Returns:
+            float: Seconds left, 0 once the deadline has passed
+        """
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+def chat_deadline():
+    """
+    Start the deadline of a /chat request from CHAT_DEADLINE_SECONDS.
+
+    Returns:
+        Deadline: The request's deadline, or None if deadlines are disabled
+    """
+    seconds = float(os.getenv("CHAT_DEADLINE_SECONDS", DEFAULT_CHAT_DEADLINE))
+    return Deadline(seconds) if seconds > 0 else None
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor, _executor_pid
+
+    # Worker processes forked by gunicorn each start their own threads
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("LLM_CALL_WORKERS", DEFAULT_LLM_CALL_WORKERS)),
+                    thread_name_prefix="llm-call"
+                )
+                _executor_pid = os.getpid()
+    return _executor
+
+def run_within(deadline, function, *args):
+    """
+    Call a function, waiting for it no longer than a deadline allows.
+
+    Args:
+        deadline (Deadline): The request's deadline, or None to wait as long as it takes
+        function: The function to call
+        *args: Its arguments
+
+    Returns:
+        The function's result
+
+    Raises:
+        DeadlineExceeded: If the deadline passed first. A call that had started runs on
+            in the background and its result is dropped; one still queued is cancelled.
+    """
+    if deadline is None:
+        return function(*args)
+    if deadline.expired():
+        raise DeadlineExceeded(f"Deadline of {deadline.seconds}s passed")
+
+    future = _get_executor().submit(function, *args)
+    try:
+        return future.result(timeout=deadline.remaining())
+    except FutureTimeoutError:
+        future.cancel()
+        raise DeadlineExceeded(f"Deadline of {deadline.seconds}s passed") from None
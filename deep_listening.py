@@ -3,9 +3,9 @@ Deep listening module for detecting personal stories, deep thoughts, and past ex
 and providing positive, encouraging responses.
 """
 
-import re
 import random
 from datetime import datetime
+from detection_engine import detect, register_table
 
 # Patterns to identify deep thoughts or personal stories
 DEEP_THOUGHT_PATTERNS = [
@@ -285,32 +285,31 @@ FOLLOW_UP_QUESTIONS = {
     ]
 }
 
-def detect_deep_thought(text):
+# Register the tables with the shared detection engine
+register_table("deep_thought", [(pattern, pattern) for pattern in DEEP_THOUGHT_PATTERNS], whole_word=True)
+register_table("thought_categories", [(keyword, category) for category, keywords in THOUGHT_CATEGORIES.items() for keyword in keywords], literal=True)
+
+def detect_deep_thought(text, detection=None):
     """
     Detect if the text contains deep thoughts or personal stories.
     
     Args:
         text (str): The user's message
+        detection (Detection, optional): Result of detection_engine.detect for the message
         
     Returns:
         dict: Detection results including category and matched patterns
     """
-    text = text.lower()
+    detection = detection or detect(text)
     
     # Check for deep thought patterns
-    matches = []
-    for pattern in DEEP_THOUGHT_PATTERNS:
-        if re.search(r'\b' + pattern + r'\b', text):
-            matches.append(pattern)
+    matches = list(detection.hits("deep_thought"))
     
     if not matches:
         return {"is_deep_thought": False}
     
     # Determine the category of the deep thought
-    categories = []
-    for category, keywords in THOUGHT_CATEGORIES.items():
-        if any(keyword in text for keyword in keywords):
-            categories.append(category)
+    categories = list(dict.fromkeys(detection.hits("thought_categories")))
     
     # Default to general category if no specific one is found
     if not categories:
@@ -349,17 +348,18 @@ def generate_encouraging_response(deep_thought_info, include_follow_up=True):
     
     return response
 
-def process_deep_thought(text):
+def process_deep_thought(text, detection=None):
     """
     Process text to detect deep thoughts and generate an encouraging response.
     
     Args:
         text (str): The user's message
+        detection (Detection, optional): Result of detection_engine.detect for the message
         
     Returns:
         dict: Processing results including detection and response
     """
-    deep_thought_info = detect_deep_thought(text)
+    deep_thought_info = detect_deep_thought(text, detection)
     
     if not deep_thought_info.get("is_deep_thought", False):
         return {"is_deep_thought": False}
@@ -0,0 +1,209 @@
+"""
+Shared detection engine that scans a message against every detector table in one pass.
+
+Each analyzer module registers its pattern and keyword tables here when it is imported.
+`detect` lowercases the message once and runs it through a single phrase automaton built
+from all registered tables; the few patterns that cannot be expressed as literal phrases
+are kept as precompiled regular expressions, which only run the first time their table is
+read. The resulting `Detection` is passed to the modules' `detect_*` and `process_*`
+functions so no module has to rescan the text.
+"""
+
+import re
+from phrase_matcher import PhraseMatcher, expand_pattern
+
+# Maximum number of literal phrases a single pattern may expand to before it is kept as a regex
+MAX_PATTERN_EXPANSION = 64
+
+# Registered tables: name -> list of (pattern, value, whole_word, literal)
+DETECTION_TABLES = {}
+
+# Compiled form of the registered tables, rebuilt when a table is registered
+_compiled_tables = None
+
+def register_table(name, entries, whole_word=False, literal=False):
+    """
+    Register a pattern or keyword table with the engine.
+
+    Args:
+        name (str): Table name used to read the results back from a Detection
+        entries (list): (pattern, value) pairs; the value is reported when the pattern matches
+        whole_word (bool): Match the patterns between word boundaries, like `\\b...\\b`
+        literal (bool): The patterns are plain keywords matched as substrings, not regexes
+    """
+    global _compiled_tables
+
+    DETECTION_TABLES[name] = [(pattern, value, whole_word, literal) for pattern, value in entries]
+    _compiled_tables = None
+
+def compile_tables():
+    """
+    Compile all registered tables into one phrase automaton plus a list of regexes.
+
+    Returns:
+        dict: The compiled matcher, the regexes grouped by table, and the entry lookup used by `detect`
+    """
+    phrase_matcher = PhraseMatcher()
+    regexes = {}
+    entry_tables = []
+    entry_values = []
+
+    for name, entries in DETECTION_TABLES.items():
+        seen = set()
+        for pattern, value, whole_word, literal in entries:
+            # Duplicate entries in a table would only be reported twice
+            if (pattern, value) in seen:
+                continue
+            seen.add((pattern, value))
+
+            entry_id = len(entry_tables)
+            entry_tables.append(name)
+            entry_values.append(value)
+
+            phrases = [pattern] if literal else expand_pattern(pattern, MAX_PATTERN_EXPANSION)
+            if phrases is None:
+                regex = re.compile(r'\b' + pattern + r'\b' if whole_word else pattern)
+                regexes.setdefault(name, []).append((entry_id, regex))
+            else:
+                for phrase in phrases:
+                    phrase_matcher.add(phrase, entry_id, whole_word=whole_word)
+
+    phrase_matcher.build()
+
+    return {
+        "phrase_matcher": phrase_matcher,
+        "regexes": regexes,
+        "entry_tables": entry_tables,
+        "entry_values": entry_values
+    }
+
+class Detection:
+    """
+    Result of scanning one message against every registered table.
+
+    Attributes:
+        text (str): The normalized (lowercased) message
+    """
+
+    def __init__(self, text, phrase_hits, compiled):
+        self.text = text
+        self._phrase_hits = phrase_hits
+        self._compiled = compiled
+        self._entry_ids = {}
+        self._hits = {}
+
+    def entry_ids(self, table):
+        """
+        Get the ids of the entries of a table that matched the message.
+
+        Args:
+            table (str): Name of a registered table
+
+        Returns:
+            list: Matched entry ids, in the order the entries were registered
+        """
+        entry_ids = self._entry_ids.get(table)
+        if entry_ids is None:
+            # Regex entries are only run when their table is first read
+            entry_ids = list(self._phrase_hits.get(table, []))
+            for entry_id, regex in self._compiled["regexes"].get(table, []):
+                if regex.search(self.text):
+                    entry_ids.append(entry_id)
+            entry_ids = self._entry_ids[table] = sorted(entry_ids)
+
+        return entry_ids
+
+    def hits(self, table):
+        """
+        Get the values of the entries of a table that matched the message.
+
+        Args:
+            table (str): Name of a registered table
+
+        Returns:
+            list: Matched values, in the order the entries were registered
+        """
+        values = self._hits.get(table)
+        if values is None:
+            entry_values = self._compiled["entry_values"]
+            values = self._hits[table] = [entry_values[entry_id] for entry_id in self.entry_ids(table)]
+
+        return values
+
+    def matched(self, table):
+        """
+        Check whether any entry of a table matched the message.
+
+        Args:
+            table (str): Name of a registered table
+
+        Returns:
+            bool: True if at least one entry matched
+        """
+        return bool(self.hits(table))
+
+def get_compiled_tables():
+    """
+    Get the compiled tables, compiling them if a table was registered since the last call.
+
+    Returns:
+        dict: The compiled tables, as returned by `compile_tables`
+    """
+    global _compiled_tables
+
+    if _compiled_tables is None:
+        _compiled_tables = compile_tables()
+
+    return _compiled_tables
+
+def table_entries(name):
+    """
+    Get the compiled entries of a table, for callers that work with entry ids directly.
+
+    Duplicate entries are only listed once, the same way they are only reported once.
+
+    Args:
+        name (str): Name of a registered table
+
+    Returns:
+        list: (entry_id, value) pairs, in the order the entries were registered
+    """
+    compiled = get_compiled_tables()
+    return [
+        (entry_id, value)
+        for entry_id, (table, value) in enumerate(zip(compiled["entry_tables"], compiled["entry_values"]))
+        if table == name
+    ]
+
+def normalize(text):
+    """
+    Normalize a message the way every detector expects it.
+
+    Args:
+        text (str): The user's message
+
+    Returns:
+        str: The normalized message
+    """
+    return text.lower()
+
+def detect(text):
+    """
+    Scan a message against every registered table in one pass.
+
+    Args:
+        text (str): The user's message
+
+    Returns:
+        Detection: The matches for every table
+    """
+    compiled = get_compiled_tables()
+
+    text = normalize(text)
+
+    phrase_hits = {}
+    entry_tables = compiled["entry_tables"]
+    for entry_id in compiled["phrase_matcher"].matches(text):
+        phrase_hits.setdefault(entry_tables[entry_id], []).append(entry_id)
+
+    return Detection(text, phrase_hits, compiled)
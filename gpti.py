@@ -9,6 +9,14 @@ from flask_cors import CORS
 from dotenv import load_dotenv
 from songs_data import get_song_recommendations
 from wellness_centers import get_wellness_centers, format_wellness_center_recommendations
+from session_store import session_namespace, get_session_store, session_lock
+from llm_client import get_llm_client
+from llm_providers import create_llm_provider
+from circuit_breaker import CircuitOpenError, circuit_breaker_stats
+from deadline import DeadlineExceeded, chat_deadline, run_within
+from records import MessageRecord, ROLE_USER, ROLE_ASSISTANT
+from conversation import ConversationHistory, register_system_message
+from prompt_builder import create_prompt_builder
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,8 +36,30 @@ CORS(app,
      methods=["GET", "POST", "OPTIONS"]
 )
 
-# Function to call OpenAI API
-def get_chatgpt_response(user_message):
+# Store conversation history in the shared session store, keyed by session ID; a history
+# read from it has to be assigned back after it is changed
+conversation_history = session_namespace("gpti_conversation")
+app.conversation_history = conversation_history
+
+# Each history keeps the system message plus the last 9 turns to stay within token limits
+HISTORY_TURNS = 9
+register_system_message(
+    "gpti",
+    'You are a supportive mental health chatbot. Respond with empathy and care. ' +
+    'Provide helpful suggestions but make it clear you are not a replacement for professional help. ' +
+    'Keep responses concise and focused on the user\'s well-being.'
+)
+
+# Requests carry as many recent turns as fit within PROMPT_TOKEN_BUDGET
+gpti_prompt_builder = create_prompt_builder()
+
+# OpenAI-compatible API the replies come from; OPENAI_BASE_URL can point it at another
+# server, such as mock_llm_server.py (see llm_providers.py)
+OPENAI_PROVIDER = create_llm_provider("openai")
+
+# Function to call OpenAI API. With a deadline, the API call only gets the time the
+# deadline has left, and the fallback reply is used once it passes.
+def get_chatgpt_response(user_message, session_id, deadline=None):
     api_key = os.getenv('OPENAI_API_KEY')  # Use environment variable for API key
 
     if not api_key:
@@ -39,51 +69,47 @@ def get_chatgpt_response(user_message):
         'Authorization': f'Bearer {api_key}',
         'Content-Type': 'application/json'
     }
-    # Store conversation history in a dictionary with session IDs as keys
-    conversation_history = getattr(app, 'conversation_history', {})
+    # Get or initialize conversation history for this session
+    # (pinned to the shared system message that sets the context for the AI)
+    history = conversation_history.get(session_id)
+    if history is None:
+        history = ConversationHistory(HISTORY_TURNS, "gpti")
 
-    # Get or create session ID from request
-    session_id = request.cookies.get('session_id')
-    if not session_id:
-        session_id = str(uuid.uuid4())
+    # Add the new user message to history; the oldest turn is dropped once it is full
+    history.append(MessageRecord(ROLE_USER, user_message))
 
-    # Get or initialize conversation history for this session
-    if session_id not in conversation_history:
-        conversation_history[session_id] = []
-        # Add system message to set the context for the AI
-        conversation_history[session_id].append({
-            'role': 'system',
-            'content': 'You are a supportive mental health chatbot. Respond with empathy and care. ' +
-                      'Provide helpful suggestions but make it clear you are not a replacement for professional help. ' +
-                      'Keep responses concise and focused on the user\'s well-being.'
-        })
-
-    # Add the new user message to history
-    conversation_history[session_id].append({'role': 'user', 'content': user_message})
-
-    # Limit history to last 10 messages to prevent token limits
-    if len(conversation_history[session_id]) > 10:
-        # Keep the system message and the most recent messages
-        conversation_history[session_id] = [conversation_history[session_id][0]] + conversation_history[session_id][-9:]
-
-    # Save the conversation history back to the app
-    app.conversation_history = conversation_history
+    # Save the conversation history back to the store
+    conversation_history[session_id] = history
 
     # Prepare the messages for the API call
     data = {
-        'model': 'gpt-3.5-turbo',  # Use the appropriate model
-        'messages': conversation_history[session_id],
+        'model': OPENAI_PROVIDER.model,  # OPENAI_MODEL, gpt-3.5-turbo by default
+        'messages': gpti_prompt_builder.chat_messages(history),
         'max_tokens': 150,  # Adjust as needed
         'temperature': 0.7  # Add some variability but keep responses focused
     }
 
-    response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
+    try:
+        response = run_within(
+            deadline,
+            lambda: get_llm_client().post(OPENAI_PROVIDER.backend, OPENAI_PROVIDER.url, headers=headers, json=data)
+        )
+    except DeadlineExceeded:
+        logging.warning(f"OpenAI API did not answer within the {deadline.seconds}s deadline, using the fallback")
+        return fallback_response(user_message)
+    except CircuitOpenError:
+        # The API has been failing, so reply with the fallback right away
+        return fallback_response(user_message)
+    except requests.RequestException as e:
+        logging.error(f"Error calling OpenAI API: {e}")
+        return fallback_response(user_message)
 
     if response.status_code == 200:
         try:
             reply = response.json()['choices'][0]['message']['content']
             # Add the bot's reply to the conversation history
-            conversation_history[session_id].append({'role': 'assistant', 'content': reply})
+            history.append(MessageRecord(ROLE_ASSISTANT, reply))
+            conversation_history[session_id] = history
             return reply
         except (KeyError, IndexError, ValueError) as e:
             logging.error(f"Error parsing OpenAI response: {e}")
@@ -278,6 +304,8 @@ def fallback_response(message):
 
 @app.route('/chat', methods=['POST'])
 def chat():
+    # The reply has to be ready within the deadline, counting from when the request arrived
+    deadline = chat_deadline()
     try:
         # Log request details for debugging
         logging.info(f"Received request: {request.method} {request.path}")
@@ -300,8 +328,10 @@ def chat():
         else:
             logging.info(f"Using existing session ID: {session_id}")
 
-        # Call the OpenAI API
-        reply = get_chatgpt_response(user_message)
+        # Call the OpenAI API. Requests of the same session run one at a time,
+        # so none of them overwrites the state another one has just saved
+        with session_lock(session_id):
+            reply = get_chatgpt_response(user_message, session_id, deadline)
         logging.info(f"Generated reply: {reply}")
 
         # Create response with session cookie
@@ -328,6 +358,21 @@ def chat():
 
         return error_response, 400
 
+# Report how much memory session state uses and how many sessions were evicted
+@app.route('/stats/sessions', methods=['GET'])
+def session_stats():
+    return jsonify(get_session_store().stats())
+
+# Report the state of the LLM API's circuit breaker
+@app.route('/stats/circuits', methods=['GET'])
+def circuit_stats():
+    return jsonify(circuit_breaker_stats())
+
+# Report how often connections to the LLM API were reused instead of opened
+@app.route('/stats/llm', methods=['GET'])
+def llm_stats():
+    return jsonify(get_llm_client().stats())
+
 # Add OPTIONS method handler for CORS preflight requests
 @app.route('/chat', methods=['OPTIONS'])
 def handle_options():
@@ -0,0 +1,39 @@
+"""
+Gunicorn configuration for serving any of the Flask backends with several workers.
+
+Usage (from the project root, where gunicorn picks this file up automatically):
+    gunicorn app:app
+    gunicorn gpti:app
+    gunicorn llama_api:app
+
+Settings can be overridden with environment variables:
+- PORT: Port to listen on (default 5000)
+- WEB_CONCURRENCY: Number of worker processes (default 2 per CPU, plus 1)
+- GUNICORN_THREADS: Threads per worker, for requests waiting on the LLM APIs (default 4)
+- GUNICORN_TIMEOUT: Seconds before a silent worker is restarted (default 120)
+
+Session state has to be visible to every worker, so that any worker can serve any
+session_id cookie without sticky routing. With more than one worker the SQLite session
+store is always used (SESSION_DB_PATH, default "sessions.db"); the in-memory store is
+only kept for a single worker.
+"""
+
+import logging
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+accesslog = "-"
+
+def on_starting(server):
+    # Runs in the master before any worker is forked, after command line options such
+    # as -w have been applied, so the workers inherit the store setting
+    if server.cfg.workers > 1 and os.getenv("SESSION_STORE", "memory").lower() != "sqlite":
+        os.environ["SESSION_STORE"] = "sqlite"
+        logging.getLogger("gunicorn.error").info(
+            "Using the SQLite session store so all %d workers share sessions", server.cfg.workers
+        )
@@ -0,0 +1,320 @@
+"""
+Micro-batching of concurrent calls to the HuggingFace Inference API.
+
+Under load many messages wait for the Llama API at the same time, each in its own
+request, and an inference server spends much of every request on overhead that a batch
+of prompts shares. A batcher holds the first prompt that arrives for a short window
+(a few milliseconds) and sends every prompt that arrived in the meantime, up to a
+maximum, as one request with a list of inputs. The answer is split again, so each
+waiting call gets a status code and body in the same format as if it had made its own
+request; the reply handlers and the completion cache don't know batching happened.
+
+Only payloads with the same generation parameters are batched together. A batch of one
+is sent as the original payload. One batch is one call for the circuit breaker, and a
+failed batch fails every call in it.
+
+Configured with environment variables:
+
+- LLM_BATCH_MAX_SIZE: Most prompts sent in one request (default 1, which disables batching)
+- LLM_BATCH_WINDOW_MS: Milliseconds the first prompt of a batch waits for others (default 5)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+
+DEFAULT_MAX_BATCH_SIZE = 1
+DEFAULT_BATCH_WINDOW_MS = 5
+
+# Fields of a payload that hold its prompt, and differ between the payloads of a batch
+PROMPT_FIELDS = ("inputs", "messages")
+
+def batch_key(payload):
+    """
+    Get the key of the batches a payload can join.
+
+    Args:
+        payload (dict): Request for the inference API
+
+    Returns:
+        str: Everything in the payload but the prompt, or None if it can't be batched
+    """
+    if not isinstance(payload.get("inputs"), str):
+        return None
+    return json.dumps({key: value for key, value in payload.items() if key not in PROMPT_FIELDS}, sort_keys=True)
+
+def merge_payloads(payloads):
+    """
+    Combine payloads with the same batch key into one request.
+
+    Args:
+        payloads (list): Requests for the inference API
+
+    Returns:
+        dict: Request with the prompts as a list of inputs
+    """
+    merged = {key: value for key, value in payloads[0].items() if key not in PROMPT_FIELDS}
+    merged["inputs"] = [payload["inputs"] for payload in payloads]
+    return merged
+
+def split_batch_response(status_code, body, count):
+    """
+    Split the answer to a batched request into one answer per prompt.
+
+    Args:
+        status_code (int): Status code of the batched request, or None if it failed
+        body (str): Its response body
+        count (int): Number of prompts in the batch
+
+    Returns:
+        list: (status code, body) per prompt, each body as the API answers a single
+            prompt. An error is every prompt's answer; an answer that can't be split
+            is (None, None) for every prompt.
+    """
+    if status_code != 200:
+        return [(status_code, body)] * count
+    try:
+        results = json.loads(body)
+        if not isinstance(results, list) or len(results) != count:
+            raise ValueError(f"expected a list of {count} results")
+    except ValueError as e:
+        logging.error(f"Could not split batched API answer: {e}")
+        return [(None, None)] * count
+    # Each prompt's result is either its list of generations or a single generation
+    return [(200, json.dumps(result if isinstance(result, list) else [result])) for result in results]
+
+class _Batch:
+    def __init__(self):
+        self.payloads = []
+        self.results = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+class InferenceBatcher:
+    """
+    Batches calls to the inference API made from several threads.
+
+    The thread whose prompt opens a batch waits for the window to pass or the batch to
+    fill up, then sends it; the other threads wait for its answer.
+
+    Args:
+        send: Function making one API request; takes a payload, returns (status code, body)
+        max_batch_size (int): Most prompts sent in one request
+        window (float): Seconds the first prompt of a batch waits for others
+    """
+
+    def __init__(self, send, max_batch_size, window):
+        self.send = send
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._open = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    def submit(self, payload):
+        """
+        Call the inference API for one payload, as part of a batch if others arrive.
+
+        Args:
+            payload (dict): Request for the inference API
+
+        Returns:
+            tuple: (status code, response body) for this payload
+
+        Raises:
+            Whatever `send` raised for the batch
+        """
+        key = batch_key(payload)
+        if key is None:
+            return self.send(payload)
+
+        with self._lock:
+            self.calls += 1
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            index = len(batch.payloads)
+            batch.payloads.append(payload)
+            if len(batch.payloads) >= self.max_batch_size:
+                # Full; later prompts start the next batch
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                self.batches += 1
+                self.largest_batch = max(self.largest_batch, len(batch.payloads))
+            self._dispatch(batch)
+        else:
+            batch.done.wait()
+
+        result = batch.results[index]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def _dispatch(self, batch):
+        count = len(batch.payloads)
+        try:
+            if count == 1:
+                batch.results = [self.send(batch.payloads[0])]
+            else:
+                batch.results = split_batch_response(*self.send(merge_payloads(batch.payloads)), count)
+        except Exception as e:
+            batch.results = [e] * count
+        finally:
+            batch.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "batches": self.batches,
+                "average_batch_size": self.calls / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "max_batch_size": self.max_batch_size,
+                "window_ms": self.window * 1e3,
+            }
+
+class _AsyncBatch:
+    def __init__(self):
+        self.entries = []
+        self.timer = None
+
+class AsyncInferenceBatcher:
+    """
+    Batches calls to the inference API made from coroutines on one event loop.
+
+    Args:
+        send: Coroutine function making one API request; takes a payload, returns
+            (status code, body)
+        max_batch_size (int): Most prompts sent in one request
+        window (float): Seconds the first prompt of a batch waits for others
+    """
+
+    def __init__(self, send, max_batch_size, window):
+        self.send = send
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._open = {}
+        # Batches being sent, kept referenced until they are done
+        self._sending = set()
+        self.calls = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    async def submit(self, payload):
+        """
+        Async counterpart of `InferenceBatcher.submit`.
+
+        Args:
+            payload (dict): Request for the inference API
+
+        Returns:
+            tuple: (status code, response body) for this payload
+        """
+        key = batch_key(payload)
+        if key is None:
+            return await self.send(payload)
+
+        loop = asyncio.get_running_loop()
+        self.calls += 1
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = _AsyncBatch()
+            batch.timer = loop.call_later(self.window, self._flush, key, batch)
+        future = loop.create_future()
+        batch.entries.append((payload, future))
+        if len(batch.entries) >= self.max_batch_size:
+            batch.timer.cancel()
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key, batch):
+        del self._open[key]
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch.entries))
+        task = asyncio.ensure_future(self._dispatch(batch.entries))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _dispatch(self, entries):
+        # Prompts whose callers stopped waiting are left out
+        entries = [(payload, future) for payload, future in entries if not future.done()]
+        if not entries:
+            return
+        try:
+            if len(entries) == 1:
+                results = [await self.send(entries[0][0])]
+            else:
+                status_code, body = await self.send(merge_payloads([payload for payload, _ in entries]))
+                results = split_batch_response(status_code, body, len(entries))
+        except asyncio.CancelledError:
+            for _, future in entries:
+                future.cancel()
+            raise
+        except Exception as e:
+            results = [e] * len(entries)
+        for (_, future), result in zip(entries, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        """Cancel the batches being sent."""
+        tasks = list(self._sending)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "batches": self.batches,
+            "average_batch_size": self.calls / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window * 1e3,
+        }
+
+def _batching_settings():
+    max_batch_size = int(os.getenv("LLM_BATCH_MAX_SIZE", DEFAULT_MAX_BATCH_SIZE))
+    window = float(os.getenv("LLM_BATCH_WINDOW_MS", DEFAULT_BATCH_WINDOW_MS)) / 1e3
+    return max_batch_size, window
+
+def create_inference_batcher(send):
+    """
+    Create a batcher for threads from LLM_BATCH_MAX_SIZE and LLM_BATCH_WINDOW_MS.
+
+    Args:
+        send: Function making one API request, see `InferenceBatcher`
+
+    Returns:
+        InferenceBatcher: The batcher, or None if batching is disabled
+    """
+    max_batch_size, window = _batching_settings()
+    return InferenceBatcher(send, max_batch_size, window) if max_batch_size > 1 else None
+
+def create_async_inference_batcher(send):
+    """
+    Create a batcher for coroutines from LLM_BATCH_MAX_SIZE and LLM_BATCH_WINDOW_MS.
+
+    Args:
+        send: Coroutine function making one API request, see `AsyncInferenceBatcher`
+
+    Returns:
+        AsyncInferenceBatcher: The batcher, or None if batching is disabled
+    """
+    max_batch_size, window = _batching_settings()
+    return AsyncInferenceBatcher(send, max_batch_size, window) if max_batch_size > 1 else None
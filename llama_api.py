@@ -1,20 +1,31 @@
 import logging
-from flask import Flask, jsonify, request
-import requests
+import json
+from flask import Flask, Response, jsonify, request
 import os
 import uuid
 import random
 import re
-from datetime import datetime
+from contextlib import closing
 from flask_cors import CORS
 from dotenv import load_dotenv
 from songs_data import get_song_recommendations
-from mental_health_analysis import analyze_text, get_mental_health_trend, format_analysis_response
+from detection_engine import detect, register_table
+from mental_health_analysis import track_mental_health, suggest_coping_strategies, get_mental_health_trend, format_analysis_response
 from deep_listening import process_deep_thought
-from mood_encouragement import process_mood
+from mood_encouragement import detect_negative_mood, get_encouragement, format_encouragement_response
 from positive_responses import process_positive_mood
 from wellness_routines import process_wellness_routine_request
 from therapist_contacts import process_therapist_request
+from session_store import session_namespace, get_session_store, session_lock
+from llm_client import get_llm_client
+from llm_providers import create_llm_provider
+from completion_cache import get_completion_cache
+from circuit_breaker import CircuitOpenError, circuit_breaker_stats
+from deadline import DeadlineExceeded, chat_deadline, run_within
+from inference_batcher import create_inference_batcher
+from records import MessageRecord, ROLE_SYSTEM, ROLE_USER, ROLE_ASSISTANT
+from conversation import ConversationHistory, register_system_message
+from prompt_builder import create_prompt_builder, llama_prompt
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -34,247 +45,427 @@ CORS(app,
      methods=["GET", "POST", "OPTIONS"]
 )
 
-# Store conversation history
-conversation_history = {}
+# Store conversation history in the shared session store; a history read from it has to
+# be assigned back after it is changed. Idle sessions are expired by the store in the
+# background, so requests never scan the stored conversations.
+conversation_history = session_namespace("llama_conversation")
+
+# Each history keeps the system message plus the last 9 turns to stay within token limits
+HISTORY_TURNS = 9
+register_system_message(
+    "llama",
+    'You are a supportive mental health chatbot. Respond with empathy and care. ' +
+    'Provide helpful suggestions but make it clear you are not a replacement for professional help. ' +
+    'Keep responses concise and focused on the user\'s well-being.'
+)
+# The general handler's system prompt also offers song suggestions
+GENERAL_SYSTEM_MESSAGE = register_system_message(
+    "llama_general",
+    'You are a supportive mental health chatbot. Respond with empathy and care. ' +
+    'Provide helpful suggestions but make it clear you are not a replacement for professional help. ' +
+    'Keep responses concise and focused on the user\'s well-being. ' +
+    'You can also suggest songs to match the user\'s mood if they ask for music recommendations.'
+)
 
-# Function to call Llama API (using a free API endpoint)
-def get_llama_response(user_message, session_id):
+# Prompts carry as many recent turns as fit within PROMPT_TOKEN_BUDGET
+llama_prompt_builder = create_prompt_builder()
+
+# Keywords that mark a message as a music recommendation request
+MUSIC_KEYWORDS = ['song', 'music', 'playlist', 'recommend', 'listen']
+register_table("music_request", [(keyword, keyword) for keyword in MUSIC_KEYWORDS], literal=True)
+
+# API the generated replies come from, the Llama model on the HuggingFace Inference API
+# unless LLM_PROVIDER says otherwise (see llm_providers.py)
+LLAMA_PROVIDER = create_llm_provider()
+
+# A reply that still needs text generated by the Llama API. `payload` is the request for
+# the inference API and `finish(status_code, body)` turns its answer into the reply; it
+# gets (None, None) when the API could not be reached. The Flask route makes the call
+# right away, while async_api.py awaits it without holding a thread. When the generated
+# text is streamed instead, `suffix` is what `finish` would have added after it.
+class PendingReply:
+    def __init__(self, payload, finish, suffix=""):
+        self.payload = payload
+        self.finish = finish
+        self.suffix = suffix
+
+# Function to call Llama API (using a free API endpoint). With a deadline, the API call
+# only gets the time the deadline has left, and the fallback reply is used once it passes.
+def get_llama_response(user_message, session_id, deadline=None):
+    history, reply = prepare_llama_response(user_message, session_id)
+    if isinstance(reply, PendingReply):
+        reply = reply.finish(*call_llama_api_within(reply.payload, deadline))
+    return finish_llama_response(history, session_id, reply)
+
+# Run a message through the detectors and the response handlers. Returns the updated
+# conversation history and the reply, a PendingReply if it needs the Llama API.
+def prepare_llama_response(user_message, session_id):
     # Get or initialize conversation history for this session
-    if session_id not in conversation_history:
-        conversation_history[session_id] = []
-        # Add system message to set the context
-        conversation_history[session_id].append({
-            'role': 'system',
-            'content': 'You are a supportive mental health chatbot. Respond with empathy and care. ' +
-                      'Provide helpful suggestions but make it clear you are not a replacement for professional help. ' +
-                      'Keep responses concise and focused on the user\'s well-being.'
-        })
-
-    # Add the new user message to history
-    conversation_history[session_id].append({
-        'role': 'user',
-        'content': user_message,
-        'timestamp': datetime.now().isoformat()
-    })
-
-    # Limit history to last 10 messages to prevent token limits
-    if len(conversation_history[session_id]) > 10:
-        # Keep the system message and the most recent messages
-        conversation_history[session_id] = [conversation_history[session_id][0]] + conversation_history[session_id][-9:]
-
-    # Check if this is a music recommendation request
-    music_keywords = ['song', 'music', 'playlist', 'recommend', 'listen']
-    is_music_request = any(keyword in user_message.lower() for keyword in music_keywords)
-
-    # Analyze message for mental health concerns
-    mental_health_analysis = analyze_text(user_message, session_id)
-    mental_health_trend = get_mental_health_trend(session_id)
-    mental_health_response = format_analysis_response(mental_health_analysis, mental_health_trend)
-
-    # Process message for deep thoughts and generate encouraging response
-    deep_thought_result = process_deep_thought(user_message)
+    # (pinned to the shared system message that sets the context)
+    history = conversation_history.get(session_id)
+    if history is None:
+        history = ConversationHistory(HISTORY_TURNS, "llama")
 
-    # Process message for negative moods and generate encouragement
-    mood_result = process_mood(user_message, session_id)
+    # Add the new user message to history; the oldest turn is dropped once it is full
+    history.append(MessageRecord.now(ROLE_USER, user_message))
 
-    # Process message for positive moods and generate enthusiastic responses
-    positive_mood_result = process_positive_mood(user_message)
+    # Scan the message against every detector table once
+    detection = detect(user_message)
 
-    # Process message for wellness routine requests
-    wellness_routine_result = process_wellness_routine_request(user_message)
+    # Trend tracking has to see every message, whichever handler ends up replying
+    state = track_user_state(user_message, session_id, detection)
 
-    # Process message for therapist contact requests
-    therapist_request_result = process_therapist_request(user_message)
+    # The handlers that ask the Llama API send it the recent conversation
+    state["history"] = history
 
-    # Format conversation history for the API
-    messages = []
-    for msg in conversation_history[session_id]:
-        if 'role' in msg and 'content' in msg:
-            messages.append({"role": msg['role'], "content": msg['content']})
+    # Ask each handler in priority order; the first one that replies wins
+    reply = None
+    for handler_name, handler in RESPONSE_HANDLERS:
+        reply = handler(state)
+        if reply is not None:
+            logging.info(f"Reply produced by the {handler_name} handler")
+            break
 
-    # If this is a music request, handle it directly
-    if is_music_request:
-        reply = get_song_recommendation_response(user_message)
-        # Add the bot's reply to the conversation history
-        conversation_history[session_id].append({
-            'role': 'assistant',
-            'content': reply,
-            'timestamp': datetime.now().isoformat()
-        })
-        return reply
+    # A first message the Llama API has answered before is answered from the cache
+    if isinstance(reply, PendingReply):
+        body = cached_llama_response(reply.payload)
+        if body is not None:
+            reply = reply.finish(200, body)
 
-    # If therapist contact was requested, prioritize the therapist recommendations
-    if therapist_request_result.get("is_therapist_request", False) and therapist_request_result.get("response"):
-        therapist_response = therapist_request_result.get("response", "")
+    return history, reply
 
-        # Add the bot's reply to the conversation history
-        conversation_history[session_id].append({
-            'role': 'assistant',
-            'content': therapist_response,
-            'timestamp': datetime.now().isoformat()
-        })
+# Add the bot's reply to the conversation history and save it
+def finish_llama_response(history, session_id, reply):
+    history.append(MessageRecord.now(ROLE_ASSISTANT, reply))
+    conversation_history[session_id] = history
 
-        return therapist_response
+    return reply
 
-    # If wellness routine was requested, prioritize the routine response
-    elif wellness_routine_result.get("is_routine_request", False) and wellness_routine_result.get("response"):
-        routine_response = wellness_routine_result.get("response", "")
+# Send one request to the Llama API; returns the status code and response body, in the
+# HuggingFace format whichever provider answered
+def post_llama_api(payload):
+    provider = LLAMA_PROVIDER
+    response = get_llm_client().post(provider.backend, provider.url, headers=provider.headers(), json=provider.request(payload))
+    return provider.read_answer(payload, response.status_code, response.text)
 
-        # Add the bot's reply to the conversation history
-        conversation_history[session_id].append({
-            'role': 'assistant',
-            'content': routine_response,
-            'timestamp': datetime.now().isoformat()
-        })
+# Concurrent calls to the Llama API are sent together in batches when LLM_BATCH_MAX_SIZE
+# is above 1 and the provider takes batches (see inference_batcher.py)
+llama_batcher = create_inference_batcher(post_llama_api) if LLAMA_PROVIDER.supports_batching else None
 
-        return routine_response
+# Call the Llama API. Returns the status code and response body, or (None, None) if the
+# API could not be reached or its circuit breaker is open.
+def call_llama_api(payload):
+    try:
+        if llama_batcher is not None:
+            status_code, body = llama_batcher.submit(payload)
+        else:
+            status_code, body = post_llama_api(payload)
+        cache_llama_response(payload, status_code, body)
+        return status_code, body
+    except CircuitOpenError:
+        # The API has been failing, so the handler's fallback replies right away
+        return None, None
+    except Exception as e:
+        logging.error(f"Error calling API: {str(e)}")
+        return None, None
 
-    # If positive mood was detected, prioritize the enthusiastic response
-    elif positive_mood_result.get("has_positive_mood", False) and positive_mood_result.get("response"):
-        positive_response = positive_mood_result.get("response", "")
+# Call the Llama API within a request's deadline. A call that misses the deadline still
+# runs to completion in the background; if it answers a session's first message, its
+# answer is cached for the next time that message opens a session.
+def call_llama_api_within(payload, deadline):
+    try:
+        return run_within(deadline, call_llama_api, payload)
+    except DeadlineExceeded:
+        logging.warning(f"Llama API did not answer within the {deadline.seconds}s deadline, using the fallback")
+        return None, None
+
+# Whether the Llama API's answer to a request is worth caching. Only a prompt with a
+# single message after the system text, as for a session's first message, is sent again
+# and again; later prompts carry the conversation, so their answers would never be reused
+# and would only push the reusable ones out of the cache.
+def is_cacheable(payload):
+    return sum(1 for message in payload["messages"] if message["role"] != ROLE_SYSTEM) == 1
+
+# Look up the Llama API's cached answer to a request; returns the body or None
+def cached_llama_response(payload):
+    cache = get_completion_cache()
+    if cache is None or not is_cacheable(payload):
+        return None
+    return cache.get(LLAMA_PROVIDER.backend, payload)
+
+# Cache a successful answer of the Llama API, if the reply can be read from it
+def cache_llama_response(payload, status_code, body):
+    cache = get_completion_cache()
+    if cache is None or status_code != 200 or not is_cacheable(payload):
+        return
+    try:
+        parse_generated_text(body)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return
+    cache.set(LLAMA_PROVIDER.backend, payload, body)
+
+# Extract just the assistant's reply (after the prompt) from a Llama API response body.
+# The prompt can hold earlier turns, so the reply is what follows the last [/INST].
+def parse_generated_text(body):
+    reply = json.loads(body)[0]["generated_text"]
+    return reply.rsplit("[/INST]", 1)[1].strip()
+
+# A reply whose generated text is streamed from the Llama API. `feed` takes the API's
+# server-sent event lines one at a time and returns the new text to pass on, if any;
+# `close` returns the text still to send and the complete reply once the stream ended.
+# If the API produced no text, the reply is the handler's fallback.
+class StreamedReply:
+    def __init__(self, pending):
+        self.pending = pending
+        self.payload = dict(pending.payload, stream=True)
+        self.parts = []
+        self.complete = False
+        self.status_code = None
+        self.body = None
+
+    def feed(self, line):
+        if not line.startswith("data:"):
+            return None
+        try:
+            event = json.loads(line[len("data:"):])
+        except ValueError:
+            return None
+        if "error" in event:
+            logging.error(f"API error while streaming: {event['error']}")
+            return None
+
+        # The last event carries the whole generated text
+        if event.get("generated_text") is not None:
+            self.complete = True
+        token = event.get("token") or {}
+        if token.get("special", False):
+            return None
+        text = token.get("text", "")
+        if not self.parts:
+            # The reply is stripped like a complete one, so it can't start with whitespace
+            text = text.lstrip()
+        if not text:
+            return None
+        self.parts.append(text)
+        return text
+
+    def fail(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    # The streamed text as the answer the API gives without streaming, for the cache
+    def answer_body(self):
+        return json.dumps([{"generated_text": f"{self.pending.payload['inputs']} {''.join(self.parts).strip()}"}])
+
+    def close(self):
+        if self.parts:
+            return self.pending.suffix, "".join(self.parts).strip() + self.pending.suffix
+        reply = self.pending.finish(self.status_code, self.body)
+        return reply, reply
+
+# Stream a reply's generated text from the Llama API, chunk by chunk
+def read_llama_stream(stream):
+    try:
+        provider = LLAMA_PROVIDER
+        with get_llm_client().post(provider.backend, provider.url, headers=provider.headers(), json=provider.request(stream.payload), stream=True) as response:
+            if response.status_code != 200:
+                stream.fail(response.status_code, response.text)
+                return
+            for line in response.iter_lines():
+                text = stream.feed(provider.stream_line(line.decode("utf-8")))
+                if text:
+                    yield text
+    except CircuitOpenError:
+        # The API has been failing, so the handler's fallback replies right away
+        return
+    except Exception as e:
+        logging.error(f"Error calling API: {str(e)}")
 
-        # Add the bot's reply to the conversation history
-        conversation_history[session_id].append({
-            'role': 'assistant',
-            'content': positive_response,
-            'timestamp': datetime.now().isoformat()
-        })
+# Produce a reply as ("chunk", text) events followed by a ("done", reply) event. A canned
+# reply is sent as soon as the detectors have run, a reply from the Llama API as its text
+# arrives; either way the complete reply is recorded in the conversation history, even if
+# the client goes away part way through.
+def stream_llama_response(user_message, session_id):
+    # The events are produced after the route has returned, so the generator holds the
+    # session lock itself
+    with session_lock(session_id):
+        history, reply = prepare_llama_response(user_message, session_id)
+        if not isinstance(reply, PendingReply):
+            finish_llama_response(history, session_id, reply)
+            yield "chunk", reply
+            yield "done", reply
+            return
+
+        stream = StreamedReply(reply)
+        try:
+            for text in read_llama_stream(stream):
+                yield "chunk", text
+        finally:
+            rest, reply = finish_streamed_reply(history, session_id, stream)
+        if rest:
+            yield "chunk", rest
+        yield "done", reply
+
+# Record a streamed reply once its stream has ended, and cache the API's answer if it was
+# received in full. Returns the text still to send and the complete reply.
+def finish_streamed_reply(history, session_id, stream):
+    rest, reply = stream.close()
+    if stream.complete and stream.parts:
+        cache_llama_response(stream.pending.payload, 200, stream.answer_body())
+    finish_llama_response(history, session_id, reply)
+    return rest, reply
+
+# Format a server-sent event with a JSON payload
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Record the message in the per-user mood and mental health histories. This runs for
+# every message so the trends stay accurate; everything that only shapes the reply is
+# left to the response handlers. Returns the request state the handlers read from.
+def track_user_state(user_message, session_id, detection):
+    return {
+        "user_message": user_message,
+        "session_id": session_id,
+        "detection": detection,
+        "mental_health_concerns": track_mental_health(user_message, session_id, detection),
+        "mood_info": detect_negative_mood(user_message, session_id, detection)
+    }
+
+def handle_music_request(state):
+    # If this is a music request, handle it directly
+    if state["detection"].matched("music_request"):
+        return get_song_recommendation_response(state["user_message"])
+    return None
 
-        return positive_response
+def handle_therapist_request(state):
+    # If therapist contact was requested, prioritize the therapist recommendations
+    result = process_therapist_request(state["user_message"], state["detection"])
+    if result.get("is_therapist_request", False) and result.get("response"):
+        return result.get("response", "")
+    return None
 
-    # If negative mood was detected, prioritize the mood encouragement
-    elif mood_result.get("has_negative_mood", False) and mood_result.get("response"):
-        mood_response = mood_result.get("response", "")
+def handle_wellness_routine_request(state):
+    # If wellness routine was requested, prioritize the routine response
+    result = process_wellness_routine_request(state["user_message"], state["detection"])
+    if result.get("is_routine_request", False) and result.get("response"):
+        return result.get("response", "")
+    return None
 
-        # Add the bot's reply to the conversation history
-        conversation_history[session_id].append({
-            'role': 'assistant',
-            'content': mood_response,
-            'timestamp': datetime.now().isoformat()
-        })
+def handle_positive_mood(state):
+    # If positive mood was detected, prioritize the enthusiastic response
+    result = process_positive_mood(state["user_message"], state["detection"])
+    if result.get("has_positive_mood", False) and result.get("response"):
+        return result.get("response", "")
+    return None
 
-        return mood_response
+def handle_negative_mood(state):
+    # If negative mood was detected, prioritize the mood encouragement
+    mood_info = state["mood_info"]
+    if not mood_info.get("has_negative_mood", False):
+        return None
+    encouragement = get_encouragement(mood_info, state["session_id"])
+    return format_encouragement_response(encouragement)
 
+def handle_deep_thought(state):
     # If deep thought was detected, prioritize the encouraging response
-    elif deep_thought_result.get("is_deep_thought", False):
-        deep_thought_response = deep_thought_result.get("response", "")
+    result = process_deep_thought(state["user_message"], state["detection"])
+    if result.get("is_deep_thought", False):
+        return result.get("response", "")
+    return None
 
-        # Add the bot's reply to the conversation history
-        conversation_history[session_id].append({
-            'role': 'assistant',
-            'content': deep_thought_response,
-            'timestamp': datetime.now().isoformat()
-        })
+def handle_mental_health_concerns(state):
+    # If mental health concerns were detected, provide coping strategies
+    user_message = state["user_message"]
+    session_id = state["session_id"]
 
-        return deep_thought_response
+    mental_health_analysis = suggest_coping_strategies(state["mental_health_concerns"], session_id)
+    mental_health_trend = get_mental_health_trend(session_id)
+    mental_health_response = format_analysis_response(mental_health_analysis, mental_health_trend)
 
-    # If mental health concerns were detected, provide coping strategies
-    elif mental_health_response:
-        # Get a regular response first
-        regular_reply = None
-        try:
-            # Try to use the API for a regular response
-            api_url = "https://api-inference.huggingface.co/models/meta-llama/Llama-2-7b-chat-hf"
-            headers = {
-                "Authorization": f"Bearer {os.getenv('HUGGINGFACE_API_KEY', 'hf_dummy_key')}",
-                "Content-Type": "application/json"
-            }
-
-            # Format the prompt for Llama
-            prompt = f"<s>[INST] <<SYS>>\nYou are a supportive mental health chatbot. Respond with empathy and care. Provide helpful suggestions but make it clear you are not a replacement for professional help. Keep responses concise and focused on the user's well-being.\n<</SYS>>\n\n{user_message} [/INST]"
-
-            payload = {
-                "inputs": prompt,
-                "parameters": {
-                    "max_new_tokens": 100,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "do_sample": True
-                }
-            }
-
-            response = requests.post(api_url, headers=headers, json=payload, timeout=10)
-
-            if response.status_code == 200:
-                try:
-                    regular_reply = response.json()[0]["generated_text"]
-                    regular_reply = regular_reply.split("[/INST]")[1].strip()
-                except (KeyError, IndexError, ValueError):
-                    regular_reply = fallback_response(user_message)
-            else:
+    if not mental_health_response:
+        return None
+    suffix = f"\n\n{mental_health_response}"
+
+    # Get a regular response first, from the API if it answers
+    def finish(status_code, body):
+        if status_code == 200:
+            try:
+                regular_reply = parse_generated_text(body)
+            except (KeyError, IndexError, ValueError):
                 regular_reply = fallback_response(user_message)
-        except Exception as e:
-            logging.error(f"Error calling API: {str(e)}")
+        else:
             regular_reply = fallback_response(user_message)
 
         # Combine the regular reply with mental health coping strategies
-        combined_reply = f"{regular_reply}\n\n{mental_health_response}"
-
-        # Add the bot's reply to the conversation history
-        conversation_history[session_id].append({
-            'role': 'assistant',
-            'content': combined_reply,
-            'timestamp': datetime.now().isoformat()
-        })
-
-        return combined_reply
-
-    # Using HuggingFace Inference API (free tier)
-    # You'll need to replace this with an actual free API endpoint
-    try:
-        # Try to use a free API service
-        # This is a placeholder - you'll need to replace with an actual working API
-        api_url = "https://api-inference.huggingface.co/models/meta-llama/Llama-2-7b-chat-hf"
-        headers = {
-            "Authorization": f"Bearer {os.getenv('HUGGINGFACE_API_KEY', 'hf_dummy_key')}",
-            "Content-Type": "application/json"
+        return f"{regular_reply}{suffix}"
+
+    # Format the prompt for Llama, with as much of the conversation as fits
+    messages = llama_prompt_builder.chat_messages(state["history"])
+
+    payload = {
+        "inputs": llama_prompt(messages),
+        "messages": messages,
+        "parameters": {
+            "max_new_tokens": 100,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "do_sample": True
         }
+    }
+    return PendingReply(payload, finish, suffix=suffix)
 
-        # Format the prompt for Llama
-        prompt = f"<s>[INST] <<SYS>>\nYou are a supportive mental health chatbot. Respond with empathy and care. Provide helpful suggestions but make it clear you are not a replacement for professional help. Keep responses concise and focused on the user's well-being. You can also suggest songs to match the user's mood if they ask for music recommendations.\n<</SYS>>\n\n{user_message} [/INST]"
-
-        payload = {
-            "inputs": prompt,
-            "parameters": {
-                "max_new_tokens": 150,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "do_sample": True
-            }
-        }
+def handle_general_message(state):
+    user_message = state["user_message"]
 
-        response = requests.post(api_url, headers=headers, json=payload)
+    def finish(status_code, body):
+        if status_code is None:
+            return fallback_response(user_message)
+        if status_code != 200:
+            # If the API call fails, fall back to the rule-based responses
+            logging.error(f"API error: {status_code} - {body}")
+            return fallback_response(user_message)
 
-        if response.status_code == 200:
-            # Parse the response based on the API's format
+        # Parse the response based on the API's format
+        try:
+            return parse_generated_text(body)
+        except (KeyError, IndexError, ValueError):
+            # If we can't parse the response properly, use the full text
             try:
-                reply = response.json()[0]["generated_text"]
-                # Extract just the assistant's reply (after the prompt)
-                reply = reply.split("[/INST]")[1].strip()
-            except (KeyError, IndexError, ValueError):
-                # If we can't parse the response properly, use the full text
-                reply = response.json()
+                reply = json.loads(body)
                 if isinstance(reply, list) and len(reply) > 0:
-                    reply = reply[0].get("generated_text", "I'm having trouble understanding. Could you try again?")
-                else:
-                    reply = "I'm having trouble understanding. Could you try again?"
-        else:
-            # If the API call fails, fall back to the rule-based responses
-            logging.error(f"API error: {response.status_code} - {response.text}")
-            reply = fallback_response(user_message)
-
-    except Exception as e:
-        logging.error(f"Error calling API: {str(e)}")
-        reply = fallback_response(user_message)
-
-    # Add bot response to history
-    conversation_history[session_id].append({
-        'role': 'assistant',
-        'content': reply,
-        'timestamp': datetime.now().isoformat()
-    })
-
-    return reply
+                    return reply[0].get("generated_text", "I'm having trouble understanding. Could you try again?")
+                return "I'm having trouble understanding. Could you try again?"
+            except Exception as e:
+                logging.error(f"Error calling API: {str(e)}")
+                return fallback_response(user_message)
+
+    # Format the prompt for Llama, with as much of the conversation as fits
+    messages = llama_prompt_builder.chat_messages(state["history"], GENERAL_SYSTEM_MESSAGE)
+
+    payload = {
+        "inputs": llama_prompt(messages),
+        "messages": messages,
+        "parameters": {
+            "max_new_tokens": 150,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "do_sample": True
+        }
+    }
+    return PendingReply(payload, finish)
+
+# Response handlers in priority order. Each one returns a reply, or None to let the
+# next handler try; a handler only runs once every handler above it has declined.
+RESPONSE_HANDLERS = [
+    ("music", handle_music_request),
+    ("therapist", handle_therapist_request),
+    ("wellness_routine", handle_wellness_routine_request),
+    ("positive_mood", handle_positive_mood),
+    ("negative_mood", handle_negative_mood),
+    ("deep_thought", handle_deep_thought),
+    ("mental_health", handle_mental_health_concerns),
+    ("general", handle_general_message)
+]
 
 # Fallback response generator when API is unavailable
 def fallback_response(message):
@@ -320,11 +511,12 @@ def fallback_response(message):
             songs = get_song_recommendations(feeling, count=2)
             if songs:
                 song_text = format_song_recommendations(songs, feeling)
-                return f"I notice you're feeling {feeling}. {random.choice([
+                music_note = random.choice([
                     'Music can help with your mood.',
                     'Sometimes music can be therapeutic.',
                     'The right song might help you process these feelings.'
-                ])} {song_text}"
+                ])
+                return f"I notice you're feeling {feeling}. {music_note} {song_text}"
 
     if any(word in message for word in feelings):
         return random.choice([
@@ -409,6 +601,8 @@ def format_song_recommendations(songs, mood):
 
 @app.route('/chat', methods=['POST'])
 def chat():
+    # The reply has to be ready within the deadline, counting from when the request arrived
+    deadline = chat_deadline()
     try:
         # Log request details for debugging
         logging.info(f"Received request: {request.method} {request.path}")
@@ -431,8 +625,10 @@ def chat():
         else:
             logging.info(f"Using existing session ID: {session_id}")
 
-        # Call the Llama API
-        reply = get_llama_response(user_message, session_id)
+        # Call the Llama API. Requests of the same session run one at a time,
+        # so none of them overwrites the state another one has just saved
+        with session_lock(session_id):
+            reply = get_llama_response(user_message, session_id, deadline)
         logging.info(f"Generated reply: {reply}")
 
         # Create response with session cookie
@@ -459,8 +655,85 @@ def chat():
 
         return error_response, 400
 
+# Stream the reply as server-sent events: "chunk" events carry the reply's text as it is
+# produced and a final "done" event the complete reply
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    try:
+        data = request.get_json()
+        user_message = data.get('message', '').strip()
+
+        if not user_message:
+            return jsonify({'reply': "Please provide a message."}), 400
+
+        # Get or create session ID
+        session_id = request.cookies.get('session_id')
+        if not session_id:
+            session_id = str(uuid.uuid4())
+            logging.info(f"Created new session ID: {session_id}")
+
+        # Closing the events explicitly records the reply before the session lock is
+        # released, also when the client goes away part way through
+        def events():
+            try:
+                with closing(stream_llama_response(user_message, session_id)) as reply_events:
+                    for event, data in reply_events:
+                        yield sse_event(event, {'text': data} if event == 'chunk' else {'reply': data})
+            except Exception as e:
+                # The status line has already been sent, so the error becomes an event
+                logging.error(f"Error streaming reply: {e}", exc_info=True)
+                yield sse_event('error', {'reply': f"Sorry, I couldn't process your request. Error: {str(e)}"})
+
+        response = Response(events(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # Don't let a proxy hold the events back
+        response.set_cookie('session_id', session_id, max_age=86400)  # 24 hour expiry
+
+        # Add CORS headers explicitly
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+        response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    except Exception as e:
+        logging.error(f"Error processing request: {e}", exc_info=True)
+        error_response = jsonify({'reply': f"Sorry, I couldn't process your request. Error: {str(e)}"})
+
+        # Add CORS headers to error response too
+        error_response.headers.add('Access-Control-Allow-Origin', '*')
+        error_response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+        error_response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
+        error_response.headers.add('Access-Control-Allow-Credentials', 'true')
+
+        return error_response, 400
+
+# Report how much memory session state uses and how many sessions were evicted
+@app.route('/stats/sessions', methods=['GET'])
+def session_stats():
+    return jsonify(get_session_store().stats())
+
+# Report how often replies were answered from the completion cache
+@app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    cache = get_completion_cache()
+    return jsonify(cache.stats() if cache is not None else {'enabled': False})
+
+# Report the state of the LLM API's circuit breaker
+@app.route('/stats/circuits', methods=['GET'])
+def circuit_stats():
+    return jsonify(circuit_breaker_stats())
+
+# Report how often connections to the LLM API were reused instead of opened
+@app.route('/stats/llm', methods=['GET'])
+def llm_stats():
+    stats = get_llm_client().stats()
+    if llama_batcher is not None:
+        stats['batching'] = llama_batcher.stats()
+    return jsonify(stats)
+
 # Add OPTIONS method handler for CORS preflight requests
 @app.route('/chat', methods=['OPTIONS'])
+@app.route('/chat/stream', methods=['OPTIONS'])
 def handle_options():
     response = app.make_default_options_response()
     response.headers.add('Access-Control-Allow-Origin', '*')
@@ -469,24 +742,6 @@ def handle_options():
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
-# Clean up old conversations periodically
-@app.before_request
-def cleanup_old_sessions():
-    # This is a simple cleanup that runs before each request
-    # In a production app, you'd want to do this in a background task
-    current_time = datetime.now()
-    sessions_to_remove = []
-
-    for session_id, history in conversation_history.items():
-        if history:
-            last_message_time = datetime.fromisoformat(history[-1]['timestamp'])
-            # Remove sessions older than 24 hours
-            if (current_time - last_message_time).total_seconds() > 86400:
-                sessions_to_remove.append(session_id)
-
-    for session_id in sessions_to_remove:
-        del conversation_history[session_id]
-
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)  # Set up logging
     app.run(host="0.0.0.0", port=5000)  # Run the app
@@ -0,0 +1,182 @@
+"""
+Shared HTTP client for the LLM backends.
+
+All calls to the LLM APIs go through one `requests.Session` per
+process, whose connection pools keep connections alive between messages, so a reply
+only pays for the TCP and TLS handshakes when no idle connection to the API is left.
+Every backend has its own connect and read timeouts, so a stalled API can't hold a
+request (and its session lock) forever, and its own circuit breaker, so an API that keeps
+failing isn't called at all for a while (see circuit_breaker.py).
+
+The client is configured with environment variables:
+
+- LLM_POOL_CONNECTIONS: Number of hosts to keep connection pools for (default 4)
+- LLM_POOL_MAXSIZE: Connections kept alive per host (default 10); match it to the number
+  of threads serving requests
+- <BACKEND>_CONNECT_TIMEOUT: Seconds to wait for a connection, e.g. OPENAI_CONNECT_TIMEOUT
+- <BACKEND>_READ_TIMEOUT: Seconds to wait for the reply, e.g. HUGGINGFACE_READ_TIMEOUT
+"""
+
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitOpenError, get_circuit_breaker, is_failure_status
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+
+# Default (connect, read) timeouts in seconds for each backend; the HuggingFace API has
+# always been given 10 seconds to answer
+BACKEND_TIMEOUTS = {
+    "huggingface": (3.05, 10),
+    "openai": (3.05, 30),
+    "local": (3.05, 30),
+}
+
+class LLMClient:
+    """
+    Pooled keep-alive HTTP client with per-backend timeouts and connection statistics.
+
+    Safe to share between threads: the API responses' cookies are never stored, so
+    nothing carries over from one user's request to another's.
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, timeouts=None):
+        self.timeouts = dict(BACKEND_TIMEOUTS if timeouts is None else timeouts)
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._adapter = adapter
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._errors = {}
+        self._hosts = {}
+
+    def post(self, backend, url, headers=None, json=None, stream=False):
+        """
+        POST to an LLM API with the backend's timeouts.
+
+        Args:
+            backend (str): Backend name, a key of `timeouts`
+            url (str): API endpoint
+            headers (dict): Request headers
+            json: JSON body
+            stream (bool): Return before the body is read, to read it as it arrives; the
+                connection goes back to the pool once the response is closed
+
+        Returns:
+            requests.Response: The API's response
+
+        Raises:
+            CircuitOpenError: If the backend's circuit breaker is open; no request is sent
+            requests.RequestException: If the API can't be reached or times out
+        """
+        breaker = get_circuit_breaker(backend)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit for {backend} is open")
+
+        with self._lock:
+            self._requests[backend] = self._requests.get(backend, 0) + 1
+            self._hosts.setdefault(backend, set()).add(requests.utils.urlparse(url).netloc)
+        succeeded = False
+        try:
+            response = self.session.post(url, headers=headers, json=json, timeout=self.timeouts[backend], stream=stream)
+            succeeded = not is_failure_status(response.status_code)
+            return response
+        except requests.RequestException:
+            with self._lock:
+                self._errors[backend] = self._errors.get(backend, 0) + 1
+            raise
+        finally:
+            breaker.record(succeeded)
+
+    def stats(self):
+        """
+        Report requests, errors, and connections opened and reused per backend.
+
+        Returns:
+            dict: Statistics per backend, safe to serialize as JSON
+        """
+        # urllib3 counts the connections each host's pool opened and the requests it sent
+        pools = {}
+        for key in self._adapter.poolmanager.pools.keys():
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                pools[pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"] = pool
+
+        with self._lock:
+            stats = {}
+            for backend, count in self._requests.items():
+                host_pools = [pools[host] for host in self._hosts[backend] if host in pools]
+                opened = sum(pool.num_connections for pool in host_pools)
+                sent = sum(pool.num_requests for pool in host_pools)
+                stats[backend] = {
+                    "requests": count,
+                    "errors": self._errors.get(backend, 0),
+                    "connections_opened": opened,
+                    "connections_reused": max(sent - opened, 0),
+                    "connect_timeout": self.timeouts[backend][0],
+                    "read_timeout": self.timeouts[backend][1],
+                }
+            return stats
+
+    def close(self):
+        self.session.close()
+
+def backend_timeouts():
+    """
+    Get each backend's timeouts, with the <BACKEND>_*_TIMEOUT environment variables applied.
+
+    Returns:
+        dict: Backend name -> (connect timeout, read timeout) in seconds
+    """
+    timeouts = {}
+    for backend, (connect_timeout, read_timeout) in BACKEND_TIMEOUTS.items():
+        prefix = backend.upper()
+        timeouts[backend] = (
+            float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", connect_timeout)),
+            float(os.getenv(f"{prefix}_READ_TIMEOUT", read_timeout)),
+        )
+    return timeouts
+
+def create_llm_client():
+    """
+    Create an LLM client from the LLM_* and <BACKEND>_*_TIMEOUT environment variables.
+
+    Returns:
+        LLMClient: The configured client
+    """
+    return LLMClient(
+        pool_connections=int(os.getenv("LLM_POOL_CONNECTIONS", DEFAULT_POOL_CONNECTIONS)),
+        pool_maxsize=int(os.getenv("LLM_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE)),
+        timeouts=backend_timeouts()
+    )
+
+_llm_client = None
+_llm_client_pid = None
+_llm_client_lock = threading.Lock()
+
+def get_llm_client():
+    """
+    Get the process's LLM client, creating it on first use.
+
+    Worker processes forked by gunicorn each create their own, since pooled
+    connections can't be shared across a fork.
+
+    Returns:
+        LLMClient: The shared client
+    """
+    global _llm_client, _llm_client_pid
+
+    if _llm_client_pid != os.getpid():
+        with _llm_client_lock:
+            if _llm_client_pid != os.getpid():
+                _llm_client = create_llm_client()
+                _llm_client_pid = os.getpid()
+    return _llm_client
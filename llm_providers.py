@@ -0,0 +1,200 @@
+"""
+LLM providers the Llama pipeline can get its generated text from.
+
+The reply handlers in llama_api.py describe a request the way the HuggingFace Inference
+API takes it, `{"inputs": prompt, "parameters": {...}}`, and read the answer as it gives
+it, `[{"generated_text": prompt + reply}]`. The request also holds the conversation the
+prompt was built from as chat messages, `"messages": [{"role", "content"}, ...]`, for the
+providers that take them. A provider translates both into its own wire format, so the
+handlers, the completion cache, the batcher and the streaming code work the same
+whichever API answers:
+
+- huggingface: The HuggingFace Inference API, or a text-generation-inference server
+- openai: Any OpenAI-compatible chat completions API
+- local: A self-hosted server in the HuggingFace format without authentication, such as
+  mock_llm_server.py for load tests that must not spend quota or touch the network
+
+Each provider is a separate backend for the LLM client's timeouts and circuit breakers
+and for the completion cache. Configured with environment variables:
+
+- LLM_PROVIDER: Provider the Llama pipeline uses (default huggingface)
+- HUGGINGFACE_API_URL, HUGGINGFACE_API_KEY: Model endpoint and token of the huggingface provider
+- OPENAI_BASE_URL: Base URL of the openai provider (default https://api.openai.com/v1)
+- OPENAI_API_KEY, OPENAI_MODEL: Its key and model (default gpt-3.5-turbo)
+- LOCAL_LLM_URL: Model endpoint of the local provider (default http://127.0.0.1:8080/models/llama)
+"""
+
+import json
+import logging
+import os
+
+# Llama model on the HuggingFace Inference API (free tier)
+DEFAULT_HUGGINGFACE_API_URL = "https://api-inference.huggingface.co/models/meta-llama/Llama-2-7b-chat-hf"
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_OPENAI_MODEL = "gpt-3.5-turbo"
+DEFAULT_LOCAL_LLM_URL = "http://127.0.0.1:8080/models/llama"
+
+# The HuggingFace stream event that stands for the end of an OpenAI stream
+STREAM_END_LINE = 'data: {"token": {"text": "", "special": true}, "generated_text": ""}'
+
+class HuggingFaceProvider:
+    """
+    The HuggingFace Inference API, whose format is the pipeline's own.
+
+    Args:
+        url (str): Model endpoint
+        api_key (str): API token sent as a bearer token, or None to send none
+    """
+
+    backend = "huggingface"
+    # Takes a list of prompts in one request (see inference_batcher.py)
+    supports_batching = True
+
+    def __init__(self, url, api_key=None):
+        self.url = url
+        self.api_key = api_key
+
+    def headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def request(self, payload):
+        """
+        Translate a request of the pipeline into the provider's format.
+
+        Args:
+            payload (dict): Request in the HuggingFace format
+
+        Returns:
+            dict: JSON body to send
+        """
+        # The prompt holds the conversation already
+        return {key: value for key, value in payload.items() if key != "messages"}
+
+    def read_answer(self, payload, status_code, body):
+        """
+        Translate the provider's answer into the HuggingFace format.
+
+        Args:
+            payload (dict): The request, in the HuggingFace format
+            status_code (int): Status code of the answer, or None if there was none
+            body (str): Response body
+
+        Returns:
+            tuple: (status code, body); only successful answers are translated
+        """
+        return status_code, body
+
+    def stream_line(self, line):
+        """
+        Translate a line of the provider's event stream into the HuggingFace format.
+
+        Args:
+            line (str): Line of the response, without its line break
+
+        Returns:
+            str: The line for `StreamedReply.feed`
+        """
+        return line
+
+class LocalProvider(HuggingFaceProvider):
+    """A self-hosted server in the HuggingFace format, such as mock_llm_server.py."""
+
+    backend = "local"
+
+class OpenAIProvider(HuggingFaceProvider):
+    """
+    An OpenAI-compatible chat completions API.
+
+    Args:
+        base_url (str): Base URL of the API, up to and including the version
+        api_key (str): API key
+        model (str): Model to ask
+    """
+
+    backend = "openai"
+    supports_batching = False
+
+    def __init__(self, base_url, api_key=None, model=DEFAULT_OPENAI_MODEL):
+        super().__init__(f"{base_url.rstrip('/')}/chat/completions", api_key)
+        self.model = model
+
+    def request(self, payload):
+        parameters = payload.get("parameters", {})
+        request = {"model": self.model, "messages": payload["messages"]}
+        if "max_new_tokens" in parameters:
+            request["max_tokens"] = parameters["max_new_tokens"]
+        for name in ("temperature", "top_p"):
+            if name in parameters:
+                request[name] = parameters[name]
+        if payload.get("stream"):
+            request["stream"] = True
+        return request
+
+    def read_answer(self, payload, status_code, body):
+        if status_code != 200:
+            return status_code, body
+        try:
+            reply = json.loads(body)["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logging.error(f"Could not read OpenAI answer: {e!r}")
+            return None, None
+        # The prompt comes first, as the HuggingFace API returns the full text
+        return status_code, json.dumps([{"generated_text": f"{payload['inputs']} {reply}"}])
+
+    def stream_line(self, line):
+        if not line.startswith("data:"):
+            return line
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return STREAM_END_LINE
+        try:
+            event = json.loads(data)
+            text = event["choices"][0].get("delta", {}).get("content")
+        except (KeyError, IndexError, TypeError, ValueError):
+            return line
+        return f"data: {json.dumps({'token': {'text': text or ''}})}"
+
+def _huggingface_provider():
+    return HuggingFaceProvider(
+        os.getenv("HUGGINGFACE_API_URL", DEFAULT_HUGGINGFACE_API_URL),
+        os.getenv("HUGGINGFACE_API_KEY", "hf_dummy_key")
+    )
+
+def _openai_provider():
+    return OpenAIProvider(
+        os.getenv("OPENAI_BASE_URL", DEFAULT_OPENAI_BASE_URL),
+        os.getenv("OPENAI_API_KEY"),
+        os.getenv("OPENAI_MODEL", DEFAULT_OPENAI_MODEL)
+    )
+
+def _local_provider():
+    return LocalProvider(os.getenv("LOCAL_LLM_URL", DEFAULT_LOCAL_LLM_URL))
+
+LLM_PROVIDERS = {
+    "huggingface": _huggingface_provider,
+    "openai": _openai_provider,
+    "local": _local_provider,
+}
+
+def create_llm_provider(name=None):
+    """
+    Create a provider from its environment variables.
+
+    Args:
+        name (str): Provider name (default LLM_PROVIDER, or huggingface)
+
+    Returns:
+        The provider
+
+    Raises:
+        ValueError: If there is no provider of that name
+    """
+    if name is None:
+        name = os.getenv("LLM_PROVIDER", "huggingface")
+    factory = LLM_PROVIDERS.get(name.lower())
+    if factory is None:
+        raise ValueError(f"Unknown LLM provider {name!r}; expected one of {', '.join(LLM_PROVIDERS)}")
+    return factory()
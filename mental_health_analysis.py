@@ -3,9 +3,11 @@ Mental health analysis module for detecting potential mental health concerns
 and providing appropriate coping strategies.
 """
 
-import re
 import random
-from datetime import datetime, timedelta
+import time
+from detection_engine import detect, register_table
+from session_store import session_namespace
+from records import seconds_since
 
 # Dictionary of mental health indicators and their severity levels
 MENTAL_HEALTH_INDICATORS = {
@@ -174,31 +176,87 @@ CRISIS_RESOURCES = {
     }
 }
 
-# User mental health tracking
-user_mental_health_history = {}
+# Severity levels from least to most severe
+SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2}
 
-def analyze_text(text, user_id):
+def build_keyword_index(indicators):
+    """
+    Map every indicator keyword to the concern it belongs to and the severity it signals.
+
+    A keyword takes the most severe level that lists it; keywords not listed under any
+    level count as low severity.
+
+    Args:
+        indicators (dict): Indicator definitions in the MENTAL_HEALTH_INDICATORS format
+
+    Returns:
+        list: (keyword, (concern, keyword, severity)) entries in indicator order
+    """
+    index = []
+    for concern, data in indicators.items():
+        for keyword in data["keywords"]:
+            severity = "low"
+            for level in ["high", "medium", "low"]:
+                if keyword in data["severity_levels"].get(level, []):
+                    severity = level
+                    break
+            index.append((keyword, (concern, keyword, severity)))
+    return index
+
+MENTAL_HEALTH_KEYWORD_INDEX = build_keyword_index(MENTAL_HEALTH_INDICATORS)
+
+# Register the keyword index with the shared detection engine
+register_table("mental_health", MENTAL_HEALTH_KEYWORD_INDEX, literal=True)
+
+# Minimum time between two coping strategies for the same concern
+STRATEGY_COOLDOWN_SECONDS = 60 * 60
+
+# User mental health tracking, kept in the shared session store; values read from it
+# have to be assigned back after they are changed
+user_mental_health_history = session_namespace("mental_health")
+
+def analyze_text(text, user_id, detection=None):
     """
     Analyze text for mental health indicators and track changes over time.
     
     Args:
         text (str): The user's message text
         user_id (str): Unique identifier for the user
+        detection (Detection, optional): Result of detection_engine.detect for the message
         
     Returns:
         dict: Analysis results including concerns, severity, and coping strategies
     """
-    text = text.lower()
+    detected_concerns = track_mental_health(text, user_id, detection)
+    return suggest_coping_strategies(detected_concerns, user_id)
+
+def track_mental_health(text, user_id, detection=None):
+    """
+    Detect mental health concerns in a message and record them in the user's history.
+    
+    This is the part of the analysis that feeds the trend, so it should run for every
+    message even when the coping strategies are not going to be used.
+    
+    Args:
+        text (str): The user's message text
+        user_id (str): Unique identifier for the user
+        detection (Detection, optional): Result of detection_engine.detect for the message
+        
+    Returns:
+        dict: Detected concerns with their severity and matched keywords
+    """
+    detection = detection or detect(text)
     
     # Initialize or get user history
-    if user_id not in user_mental_health_history:
-        user_mental_health_history[user_id] = {
-            "messages": [],
+    history = user_mental_health_history.get(user_id)
+    if history is None:
+        history = {
+            "message_count": 0,
             "concerns": {
-                "depression": {"count": 0, "severity": "none", "first_detected": None, "last_detected": None},
-                "anxiety": {"count": 0, "severity": "none", "first_detected": None, "last_detected": None},
-                "anger": {"count": 0, "severity": "none", "first_detected": None, "last_detected": None},
-                "self_harm": {"count": 0, "severity": "none", "first_detected": None, "last_detected": None}
+                "depression": {"count": 0, "severity": "none", "first_detected": None, "last_detected": None, "last_message": None},
+                "anxiety": {"count": 0, "severity": "none", "first_detected": None, "last_detected": None, "last_message": None},
+                "anger": {"count": 0, "severity": "none", "first_detected": None, "last_detected": None, "last_message": None},
+                "self_harm": {"count": 0, "severity": "none", "first_detected": None, "last_detected": None, "last_message": None}
             },
             "last_strategy_provided": {
                 "depression": None,
@@ -208,45 +266,46 @@ def analyze_text(text, user_id):
             }
         }
     
-    # Add message to history
-    user_mental_health_history[user_id]["messages"].append({
-        "text": text,
-        "timestamp": datetime.now().isoformat()
-    })
+    # Count the message; the trend only needs to know how recently each concern was seen
+    history["message_count"] += 1
+    message_number = history["message_count"]
     
-    # Limit history to last 20 messages
-    if len(user_mental_health_history[user_id]["messages"]) > 20:
-        user_mental_health_history[user_id]["messages"] = user_mental_health_history[user_id]["messages"][-20:]
-    
-    # Detect concerns and their severity
+    # Detect concerns and their severity; a concern takes the most severe keyword found
     detected_concerns = {}
     
-    for concern, data in MENTAL_HEALTH_INDICATORS.items():
-        # Check for keywords
-        found_keywords = [keyword for keyword in data["keywords"] if keyword in text or re.search(r'\b' + re.escape(keyword) + r'\b', text)]
+    for concern, keyword, severity in detection.hits("mental_health"):
+        if concern not in detected_concerns:
+            detected_concerns[concern] = {"severity": severity, "keywords": []}
+        elif SEVERITY_RANK[severity] > SEVERITY_RANK[detected_concerns[concern]["severity"]]:
+            detected_concerns[concern]["severity"] = severity
+        detected_concerns[concern]["keywords"].append(keyword)
+    
+    # Update user history
+    now = time.time()
+    for concern, data in detected_concerns.items():
+        history["concerns"][concern]["count"] += 1
+        history["concerns"][concern]["severity"] = data["severity"]
+        history["concerns"][concern]["last_detected"] = now
+        history["concerns"][concern]["last_message"] = message_number
         
-        if found_keywords:
-            # Determine severity
-            severity = "low"
-            for level in ["high", "medium", "low"]:
-                if any(keyword in found_keywords for keyword in data["severity_levels"].get(level, [])):
-                    severity = level
-                    break
-            
-            # Update user history
-            user_mental_health_history[user_id]["concerns"][concern]["count"] += 1
-            user_mental_health_history[user_id]["concerns"][concern]["severity"] = severity
-            user_mental_health_history[user_id]["concerns"][concern]["last_detected"] = datetime.now().isoformat()
-            
-            if not user_mental_health_history[user_id]["concerns"][concern]["first_detected"]:
-                user_mental_health_history[user_id]["concerns"][concern]["first_detected"] = datetime.now().isoformat()
-            
-            # Add to detected concerns
-            detected_concerns[concern] = {
-                "severity": severity,
-                "keywords": found_keywords
-            }
+        if not history["concerns"][concern]["first_detected"]:
+            history["concerns"][concern]["first_detected"] = now
+    
+    user_mental_health_history[user_id] = history
+    
+    return detected_concerns
+
+def suggest_coping_strategies(detected_concerns, user_id):
+    """
+    Pick coping strategies and crisis resources for the detected concerns.
     
+    Args:
+        detected_concerns (dict): Results from track_mental_health
+        user_id (str): Unique identifier for the user
+        
+    Returns:
+        dict: Analysis results including concerns, severity, and coping strategies
+    """
     # Prepare response with coping strategies
     response = {
         "detected_concerns": detected_concerns,
@@ -254,18 +313,19 @@ def analyze_text(text, user_id):
         "crisis_resources": None
     }
     
+    history = user_mental_health_history[user_id]
+    
     # Add coping strategies for detected concerns
     for concern, data in detected_concerns.items():
         severity = data["severity"]
         
         # Only provide strategies if we haven't recently provided them for this concern
-        last_provided = user_mental_health_history[user_id]["last_strategy_provided"][concern]
+        last_provided = history["last_strategy_provided"][concern]
         should_provide = True
         
         if last_provided:
-            last_time = datetime.fromisoformat(last_provided)
             # Don't provide strategies for the same concern more than once per hour
-            if datetime.now() - last_time < timedelta(hours=1):
+            if seconds_since(last_provided) < STRATEGY_COOLDOWN_SECONDS:
                 should_provide = False
         
         if should_provide and severity in COPING_STRATEGIES.get(concern, {}):
@@ -276,7 +336,10 @@ def analyze_text(text, user_id):
             response["coping_strategies"][concern] = selected_strategy
             
             # Update last provided timestamp
-            user_mental_health_history[user_id]["last_strategy_provided"][concern] = datetime.now().isoformat()
+            history["last_strategy_provided"][concern] = time.time()
+    
+    if response["coping_strategies"]:
+        user_mental_health_history[user_id] = history
     
     # Add crisis resources for high severity concerns
     high_severity_concerns = [concern for concern, data in detected_concerns.items() 
@@ -297,13 +360,12 @@ def get_mental_health_trend(user_id):
     Returns:
         dict: Trend analysis for each concern
     """
-    if user_id not in user_mental_health_history:
+    user_data = user_mental_health_history.get(user_id)
+    if user_data is None:
         return {"trend": "insufficient_data"}
     
-    user_data = user_mental_health_history[user_id]
-    
     # Need at least 5 messages for trend analysis
-    if len(user_data["messages"]) < 5:
+    if user_data["message_count"] < 5:
         return {"trend": "insufficient_data"}
     
     trends = {}
@@ -313,14 +375,8 @@ def get_mental_health_trend(user_id):
             trends[concern] = "not_detected"
             continue
         
-        # Check if concern was detected in recent messages
-        recent_messages = user_data["messages"][-3:]
-        recent_text = " ".join([msg["text"] for msg in recent_messages])
-        
-        concern_keywords = MENTAL_HEALTH_INDICATORS[concern]["keywords"]
-        recent_mentions = sum(1 for keyword in concern_keywords if keyword in recent_text.lower())
-        
-        if recent_mentions > 0:
+        # Check if concern was detected in the last 3 messages
+        if user_data["message_count"] - data["last_message"] < 3:
             if data["severity"] == "high":
                 trends[concern] = "active_high"
             elif data["severity"] == "medium":
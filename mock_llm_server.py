@@ -0,0 +1,306 @@
+"""
+Local stand-in for the LLM APIs, for load tests and benchmarks.
+
+Speaks both wire formats the backends use, so they can be measured offline without
+spending quota:
+
+- POST /models/<name>: The HuggingFace Inference API's text generation, with a prompt or
+  a batch of prompts as `inputs`, and `"stream": true` for server-sent events in the
+  text-generation-inference format
+- POST /v1/chat/completions: OpenAI-compatible chat completions, streamed or not
+- GET /stats: Requests answered so far, by format and status code
+
+Replies are canned, picked by the prompt, and arrive after a latency drawn from a
+configurable distribution; streamed replies then send a token at a time. A configurable
+share of requests fails with a 500, is rate limited with a 429, or gets the 503 that the
+HuggingFace API answers while a model is loading. With a seed, a run can be reproduced.
+
+Point the backends at it with LLM_PROVIDER=local (or HUGGINGFACE_API_URL) and
+OPENAI_BASE_URL=http://127.0.0.1:8080/v1; see llm_providers.py.
+
+Usage:
+    python mock_llm_server.py [--port 8080] [--latency lognormal:0.8,0.5] [--token-delay S]
+        [--error-rate P] [--rate-limit-rate P] [--loading-rate P] [--seed N]
+"""
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLIES = [
+    "I hear you. That sounds like a lot to carry, and it makes sense that you feel this way.",
+    "Thank you for sharing that with me. Would you like to talk more about what's on your mind?",
+    "It's okay to feel overwhelmed sometimes. Taking a few slow, deep breaths can help right now.",
+    "That sounds really hard. Remember that reaching out to someone you trust can make a difference.",
+    "I'm glad you told me. Small steps still count, and you don't have to figure it all out today.",
+]
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution.
+
+    Args:
+        spec (str): `fixed:S`, `uniform:LOW,HIGH`, `normal:MEAN,SD`, `exponential:MEAN`
+            or `lognormal:MEDIAN,SIGMA`, in seconds
+
+    Returns:
+        Function taking a random.Random and returning a latency in seconds
+
+    Raises:
+        ValueError: If the spec can't be parsed
+    """
+    name, _, arguments = spec.partition(":")
+    values = [float(value) for value in arguments.split(",")] if arguments else []
+    distributions = {
+        "fixed": (1, lambda rng, seconds: seconds),
+        "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+        "normal": (2, lambda rng, mean, sd: rng.gauss(mean, sd)),
+        "exponential": (1, lambda rng, mean: rng.expovariate(1 / mean) if mean > 0 else 0.0),
+        "lognormal": (2, lambda rng, median, sigma: median * rng.lognormvariate(0, sigma)),
+    }
+    if name not in distributions or len(values) != distributions[name][0]:
+        raise ValueError(f"Invalid latency distribution {spec!r}")
+    draw = distributions[name][1]
+    return lambda rng: max(draw(rng, *values), 0.0)
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    The stand-in server. Serves each request on its own thread.
+
+    Args:
+        address (tuple): (host, port) to listen on; port 0 picks a free one
+        latency (str): Distribution of the time until the reply, or its first token when
+            streaming, see `parse_latency`
+        token_delay (float): Seconds between the tokens of a streamed reply
+        error_rate (float): Share of requests answered with a 500, after the latency
+        rate_limit_rate (float): Share of requests answered with a 429 right away
+        loading_rate (float): Share of requests answered with a 503 "model loading" right away
+        seed (int): Seed for the latencies and errors, or None for a different run each time
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency="fixed:0", token_delay=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 loading_rate=0.0, seed=None):
+        super().__init__(address, MockLLMHandler)
+        self.latency = parse_latency(latency)
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.loading_rate = loading_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def draw(self):
+        """
+        Decide how a request is answered.
+
+        Returns:
+            tuple: (status code, latency in seconds)
+        """
+        with self._lock:
+            roll = self._random.random()
+            latency = self.latency(self._random)
+        if roll < self.rate_limit_rate:
+            return 429, 0.0
+        if roll < self.rate_limit_rate + self.loading_rate:
+            return 503, 0.0
+        if roll < self.rate_limit_rate + self.loading_rate + self.error_rate:
+            return 500, latency
+        return 200, latency
+
+    def count(self, api, status_code):
+        with self._lock:
+            counts = self.counts.setdefault(api, {})
+            counts[str(status_code)] = counts.get(str(status_code), 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {api: dict(counts) for api, counts in self.counts.items()}
+
+def canned_reply(prompt):
+    # The same prompt always gets the same reply, so runs can be compared
+    return REPLIES[zlib.crc32(prompt.encode("utf-8")) % len(REPLIES)]
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path != "/stats":
+            return self.send_json(404, {"error": "Not found"})
+        self.send_json(200, self.server.stats())
+
+    def do_POST(self):
+        if self.path.startswith("/models/"):
+            api = "huggingface"
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            api = "openai"
+        else:
+            return self.send_json(404, {"error": "Not found"})
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            self.server.count(api, 400)
+            return self.send_json(400, {"error": "Invalid JSON"})
+
+        status_code, latency = self.server.draw()
+        self.server.count(api, status_code)
+        time.sleep(latency)
+        try:
+            if status_code != 200:
+                self.send_error_answer(api, status_code)
+            elif api == "huggingface":
+                self.answer_huggingface(payload)
+            else:
+                self.answer_openai(payload)
+        except OSError:
+            # The client gave up waiting
+            pass
+
+    def answer_huggingface(self, payload):
+        inputs = payload.get("inputs", "")
+        if payload.get("stream"):
+            reply = canned_reply(inputs)
+            tokens = self.stream_tokens(
+                reply, lambda index, text: {"token": {"id": index, "text": text, "special": False}, "generated_text": None}
+            )
+            # The last event ends the text and carries all of it
+            end = {"token": {"id": tokens, "text": "</s>", "special": True}, "generated_text": reply}
+            return self.finish_stream(f"data:{json.dumps(end)}\n\n")
+
+        # The full text is returned, prompt first, as the Inference API does by default
+        if isinstance(inputs, list):
+            return self.send_json(200, [[{"generated_text": f"{prompt} {canned_reply(prompt)}"}] for prompt in inputs])
+        self.send_json(200, [{"generated_text": f"{inputs} {canned_reply(inputs)}"}])
+
+    def answer_openai(self, payload):
+        messages = payload.get("messages") or [{"content": ""}]
+        reply = canned_reply(messages[-1].get("content", ""))
+        model = payload.get("model", "mock")
+        created = int(time.time())
+        if payload.get("stream"):
+            def chunk(delta, finish_reason=None):
+                return {
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+            self.start_stream()
+            self.write_chunk(f"data: {json.dumps(chunk({'role': 'assistant'}))}\n\n")
+            self.stream_tokens(reply, lambda index, text: chunk({"content": text}), start=False)
+            return self.finish_stream(f"data: {json.dumps(chunk({}, 'stop'))}\n\ndata: [DONE]\n\n")
+
+        self.send_json(200, {
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(reply.split()), "total_tokens": len(reply.split())},
+        })
+
+    def send_error_answer(self, api, status_code):
+        messages = {
+            429: "Rate limit reached. Please retry later.",
+            503: "Model is currently loading",
+            500: "Internal server error",
+        }
+        if api == "openai":
+            body = {"error": {"message": messages[status_code], "type": "server_error" if status_code >= 500 else "requests"}}
+        else:
+            body = {"error": messages[status_code]}
+            if status_code == 503:
+                body["estimated_time"] = 20.0
+        headers = {"Retry-After": "1"} if status_code == 429 else {}
+        self.send_json(status_code, body, headers)
+
+    def send_json(self, status_code, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Streams are sent with chunked encoding, so every event reaches the client at once
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def stream_tokens(self, reply, event, start=True):
+        # Sends the reply a word at a time; returns the number of tokens sent
+        if start:
+            self.start_stream()
+        words = reply.split(" ")
+        for index, word in enumerate(words):
+            if index:
+                time.sleep(self.server.token_delay)
+            self.write_chunk(f"data: {json.dumps(event(index, word if index == 0 else f' {word}'))}\n\n")
+        return len(words)
+
+    def finish_stream(self, text):
+        self.write_chunk(text)
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def start_mock_llm_server(host="127.0.0.1", port=0, **settings):
+    """
+    Start the stand-in server on a background thread.
+
+    Args:
+        host (str): Address to listen on
+        port (int): Port to listen on; 0 picks a free one
+        **settings: The server's settings, see `MockLLMServer`
+
+    Returns:
+        MockLLMServer: The running server; `shutdown()` stops it
+    """
+    server = MockLLMServer((host, port), **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", default="lognormal:0.8,0.5", help="distribution of the reply latency, see parse_latency")
+    parser.add_argument("--token-delay", type=float, default=0.03, help="seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--loading-rate", type=float, default=0.0, help="share of requests answered with a 503 while loading")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = MockLLMServer(
+        (args.host, args.port), latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, loading_rate=args.loading_rate, seed=args.seed
+    )
+    logging.info(f"Stand-in LLM API on {server.url} (HuggingFace: /models/<name>, OpenAI: /v1/chat/completions)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -3,210 +3,150 @@ Mood encouragement module for detecting negative moods and providing
 encouraging quotes and lovable lines to uplift the user.
 """
 
-import re
 import random
-from datetime import datetime, timedelta
+import time
+from detection_engine import detect, register_table
+from phrase_matcher import FrameMatcher
+from session_store import session_namespace
+from records import MoodEvent, seconds_since
+
+# Frames that introduce a mood word: "i'm (feeling) X" and "i feel (so|really|very|extremely) X"
+NEGATIVE_MOOD_FRAMES = [
+    r"i(?:'m| am) (?:feeling )?",
+    r"i feel (?:so |really |very |extremely )?"
+]
+
+# Mood words that complete every frame, grouped by mood type
+NEGATIVE_MOOD_WORDS = {
+    "sadness": [
+        "sad",
+        "down",
+        "blue",
+        "unhappy",
+        "miserable",
+        "heartbroken",
+        "low",
+        "gloomy",
+        "melancholy",
+        "sorrowful",
+        "grief",
+        "distressed",
+        "disheartened",
+        "despondent",
+        "dejected",
+        "downcast",
+        "downhearted",
+        "dismal",
+        "dreary",
+        "weepy",
+        "upset"
+    ],
+    "depression": [
+        "depressed",
+        "hopeless",
+        "worthless",
+        "empty",
+        "numb",
+        "nothing",
+        "suicidal",
+        "like ending it all",
+        "like giving up",
+        "like i can't go on",
+        "like i can't take it anymore",
+        "like i'm a burden",
+        "like i'm worthless",
+        "like i'm a failure",
+        "like i'm not good enough",
+        "like i'm not worthy",
+        "like i'm not deserving",
+        "like i'm not lovable"
+    ],
+    "anxiety": [
+        "anxious",
+        "worried",
+        "scared",
+        "fearful",
+        "nervous",
+        "tense",
+        "uneasy",
+        "apprehensive",
+        "restless",
+        "jittery",
+        "panicky",
+        "on edge",
+        "stressed",
+        "overwhelmed",
+        "freaking out",
+        "having a panic attack",
+        "having anxiety",
+        "having an anxiety attack",
+        "having a nervous breakdown"
+    ],
+    "loneliness": [
+        "lonely",
+        "alone",
+        "isolated",
+        "abandoned",
+        "rejected",
+        "unwanted",
+        "unloved",
+        "disconnected",
+        "left out",
+        "excluded",
+        "forgotten",
+        "invisible",
+        "like no one cares",
+        "like no one understands",
+        "like i have no friends",
+        "like i have no one to talk to",
+        "like i'm all alone"
+    ],
+    "bad_mood": [
+        "angry",
+        "frustrated",
+        "irritated",
+        "annoyed",
+        "upset",
+        "tired",
+        "exhausted",
+        "drained",
+        "like a failure",
+        "useless",
+        "inadequate",
+        "not good enough",
+        "a disappointment",
+        "a burden"
+    ]
+}
 
-# Patterns to identify negative moods
-NEGATIVE_MOOD_PATTERNS = {
+# Free-form phrases that indicate a mood on their own
+NEGATIVE_MOOD_PHRASES = {
     "sadness": [
-        r"i(?:'m| am) (?:feeling )?sad",
-        r"i feel (?:so |really |very |extremely )?sad",
-        r"i(?:'m| am) (?:feeling )?down",
-        r"i feel (?:so |really |very |extremely )?down",
-        r"i(?:'m| am) (?:feeling )?blue",
-        r"i feel (?:so |really |very |extremely )?blue",
-        r"i(?:'m| am) (?:feeling )?unhappy",
-        r"i feel (?:so |really |very |extremely )?unhappy",
-        r"i(?:'m| am) (?:feeling )?miserable",
-        r"i feel (?:so |really |very |extremely )?miserable",
-        r"i(?:'m| am) (?:feeling )?heartbroken",
-        r"i feel (?:so |really |very |extremely )?heartbroken",
-        r"i want to cry",
+        "i want to cry",
         r"i(?:'ve| have) been crying",
-        r"i feel like crying",
+        "i feel like crying",
         r"i(?:'m| am) tearful",
         r"everything is (?:so |really |very |extremely )?sad",
         r"life is (?:so |really |very |extremely )?sad",
-        r"nothing makes me happy",
-        r"i can't feel happy",
-        r"i don't feel joy",
-        r"i(?:'m| am) (?:feeling )?low",
-        r"i feel (?:so |really |very |extremely )?low",
-        r"i(?:'m| am) (?:feeling )?gloomy",
-        r"i feel (?:so |really |very |extremely )?gloomy",
-        r"i(?:'m| am) (?:feeling )?melancholy",
-        r"i feel (?:so |really |very |extremely )?melancholy",
-        r"i(?:'m| am) (?:feeling )?sorrowful",
-        r"i feel (?:so |really |very |extremely )?sorrowful",
-        r"i(?:'m| am) (?:feeling )?grief",
-        r"i feel (?:so |really |very |extremely )?grief",
-        r"i(?:'m| am) (?:feeling )?distressed",
-        r"i feel (?:so |really |very |extremely )?distressed",
-        r"i(?:'m| am) (?:feeling )?disheartened",
-        r"i feel (?:so |really |very |extremely )?disheartened",
-        r"i(?:'m| am) (?:feeling )?despondent",
-        r"i feel (?:so |really |very |extremely )?despondent",
-        r"i(?:'m| am) (?:feeling )?dejected",
-        r"i feel (?:so |really |very |extremely )?dejected",
-        r"i(?:'m| am) (?:feeling )?downcast",
-        r"i feel (?:so |really |very |extremely )?downcast",
-        r"i(?:'m| am) (?:feeling )?downhearted",
-        r"i feel (?:so |really |very |extremely )?downhearted",
-        r"i(?:'m| am) (?:feeling )?dismal",
-        r"i feel (?:so |really |very |extremely )?dismal",
-        r"i(?:'m| am) (?:feeling )?dreary",
-        r"i feel (?:so |really |very |extremely )?dreary",
-        r"i(?:'m| am) (?:feeling )?weepy",
-        r"i feel (?:so |really |very |extremely )?weepy",
-        r"i(?:'m| am) (?:feeling )?upset",
-        r"i feel (?:so |really |very |extremely )?upset"
+        "nothing makes me happy",
+        "i can't feel happy",
+        "i don't feel joy"
     ],
     "depression": [
-        r"i(?:'m| am) (?:feeling )?depressed",
-        r"i feel (?:so |really |very |extremely )?depressed",
-        r"i(?:'m| am) (?:feeling )?hopeless",
-        r"i feel (?:so |really |very |extremely )?hopeless",
-        r"i(?:'m| am) (?:feeling )?worthless",
-        r"i feel (?:so |really |very |extremely )?worthless",
-        r"i(?:'m| am) (?:feeling )?empty",
-        r"i feel (?:so |really |very |extremely )?empty",
-        r"i(?:'m| am) (?:feeling )?numb",
-        r"i feel (?:so |really |very |extremely )?numb",
-        r"i(?:'m| am) (?:feeling )?nothing",
-        r"i feel (?:so |really |very |extremely )?nothing",
-        r"i don't care anymore",
-        r"i don't see the point",
-        r"what's the point",
+        "i don't care anymore",
+        "i don't see the point",
+        "what's the point",
         r"life is (?:so |really |very |extremely )?meaningless",
-        r"i can't see a future",
-        r"i have no energy",
-        r"i can't get out of bed",
-        r"everything feels like a struggle",
+        "i can't see a future",
+        "i have no energy",
+        "i can't get out of bed",
+        "everything feels like a struggle",
         r"i(?:'m| am) struggling to function",
         r"i(?:'m| am) in a dark place",
         r"i(?:'m| am) in a black hole",
-        r"i(?:'m| am) at rock bottom",
-        r"i(?:'m| am) (?:feeling )?suicidal",
-        r"i feel (?:so |really |very |extremely )?suicidal",
-        r"i(?:'m| am) (?:feeling )?like ending it all",
-        r"i feel (?:so |really |very |extremely )?like ending it all",
-        r"i(?:'m| am) (?:feeling )?like giving up",
-        r"i feel (?:so |really |very |extremely )?like giving up",
-        r"i(?:'m| am) (?:feeling )?like i can't go on",
-        r"i feel (?:so |really |very |extremely )?like i can't go on",
-        r"i(?:'m| am) (?:feeling )?like i can't take it anymore",
-        r"i feel (?:so |really |very |extremely )?like i can't take it anymore",
-        r"i(?:'m| am) (?:feeling )?like i'm a burden",
-        r"i feel (?:so |really |very |extremely )?like i'm a burden",
-        r"i(?:'m| am) (?:feeling )?like i'm worthless",
-        r"i feel (?:so |really |very |extremely )?like i'm worthless",
-        r"i(?:'m| am) (?:feeling )?like i'm a failure",
-        r"i feel (?:so |really |very |extremely )?like i'm a failure",
-        r"i(?:'m| am) (?:feeling )?like i'm not good enough",
-        r"i feel (?:so |really |very |extremely )?like i'm not good enough",
-        r"i(?:'m| am) (?:feeling )?like i'm not worthy",
-        r"i feel (?:so |really |very |extremely )?like i'm not worthy",
-        r"i(?:'m| am) (?:feeling )?like i'm not deserving",
-        r"i feel (?:so |really |very |extremely )?like i'm not deserving",
-        r"i(?:'m| am) (?:feeling )?like i'm not lovable",
-        r"i feel (?:so |really |very |extremely )?like i'm not lovable"
-    ],
-    "anxiety": [
-        r"i(?:'m| am) (?:feeling )?anxious",
-        r"i feel (?:so |really |very |extremely )?anxious",
-        r"i(?:'m| am) (?:feeling )?worried",
-        r"i feel (?:so |really |very |extremely )?worried",
-        r"i(?:'m| am) (?:feeling )?scared",
-        r"i feel (?:so |really |very |extremely )?scared",
-        r"i(?:'m| am) (?:feeling )?fearful",
-        r"i feel (?:so |really |very |extremely )?fearful",
-        r"i(?:'m| am) (?:feeling )?nervous",
-        r"i feel (?:so |really |very |extremely )?nervous",
-        r"i(?:'m| am) (?:feeling )?tense",
-        r"i feel (?:so |really |very |extremely )?tense",
-        r"i(?:'m| am) (?:feeling )?uneasy",
-        r"i feel (?:so |really |very |extremely )?uneasy",
-        r"i(?:'m| am) (?:feeling )?apprehensive",
-        r"i feel (?:so |really |very |extremely )?apprehensive",
-        r"i(?:'m| am) (?:feeling )?restless",
-        r"i feel (?:so |really |very |extremely )?restless",
-        r"i(?:'m| am) (?:feeling )?jittery",
-        r"i feel (?:so |really |very |extremely )?jittery",
-        r"i(?:'m| am) (?:feeling )?panicky",
-        r"i feel (?:so |really |very |extremely )?panicky",
-        r"i(?:'m| am) (?:feeling )?on edge",
-        r"i feel (?:so |really |very |extremely )?on edge",
-        r"i(?:'m| am) (?:feeling )?stressed",
-        r"i feel (?:so |really |very |extremely )?stressed",
-        r"i(?:'m| am) (?:feeling )?overwhelmed",
-        r"i feel (?:so |really |very |extremely )?overwhelmed",
-        r"i(?:'m| am) (?:feeling )?freaking out",
-        r"i feel (?:so |really |very |extremely )?freaking out",
-        r"i(?:'m| am) (?:feeling )?having a panic attack",
-        r"i feel (?:so |really |very |extremely )?having a panic attack",
-        r"i(?:'m| am) (?:feeling )?having anxiety",
-        r"i feel (?:so |really |very |extremely )?having anxiety",
-        r"i(?:'m| am) (?:feeling )?having a panic attack",
-        r"i feel (?:so |really |very |extremely )?having a panic attack",
-        r"i(?:'m| am) (?:feeling )?having an anxiety attack",
-        r"i feel (?:so |really |very |extremely )?having an anxiety attack",
-        r"i(?:'m| am) (?:feeling )?having a nervous breakdown",
-        r"i feel (?:so |really |very |extremely )?having a nervous breakdown"
-    ],
-    "loneliness": [
-        r"i(?:'m| am) (?:feeling )?lonely",
-        r"i feel (?:so |really |very |extremely )?lonely",
-        r"i(?:'m| am) (?:feeling )?alone",
-        r"i feel (?:so |really |very |extremely )?alone",
-        r"i(?:'m| am) (?:feeling )?isolated",
-        r"i feel (?:so |really |very |extremely )?isolated",
-        r"i(?:'m| am) (?:feeling )?abandoned",
-        r"i feel (?:so |really |very |extremely )?abandoned",
-        r"i(?:'m| am) (?:feeling )?rejected",
-        r"i feel (?:so |really |very |extremely )?rejected",
-        r"i(?:'m| am) (?:feeling )?unwanted",
-        r"i feel (?:so |really |very |extremely )?unwanted",
-        r"i(?:'m| am) (?:feeling )?unloved",
-        r"i feel (?:so |really |very |extremely )?unloved",
-        r"i(?:'m| am) (?:feeling )?disconnected",
-        r"i feel (?:so |really |very |extremely )?disconnected",
-        r"i(?:'m| am) (?:feeling )?left out",
-        r"i feel (?:so |really |very |extremely )?left out",
-        r"i(?:'m| am) (?:feeling )?excluded",
-        r"i feel (?:so |really |very |extremely )?excluded",
-        r"i(?:'m| am) (?:feeling )?forgotten",
-        r"i feel (?:so |really |very |extremely )?forgotten",
-        r"i(?:'m| am) (?:feeling )?invisible",
-        r"i feel (?:so |really |very |extremely )?invisible",
-        r"i(?:'m| am) (?:feeling )?like no one cares",
-        r"i feel (?:so |really |very |extremely )?like no one cares",
-        r"i(?:'m| am) (?:feeling )?like no one understands",
-        r"i feel (?:so |really |very |extremely )?like no one understands",
-        r"i(?:'m| am) (?:feeling )?like i have no friends",
-        r"i feel (?:so |really |very |extremely )?like i have no friends",
-        r"i(?:'m| am) (?:feeling )?like i have no one to talk to",
-        r"i feel (?:so |really |very |extremely )?like i have no one to talk to",
-        r"i(?:'m| am) (?:feeling )?like i'm all alone",
-        r"i feel (?:so |really |very |extremely )?like i'm all alone"
+        r"i(?:'m| am) at rock bottom"
     ],
     "bad_mood": [
-        r"i(?:'m| am) (?:feeling )?angry",
-        r"i feel (?:so |really |very |extremely )?angry",
-        r"i(?:'m| am) (?:feeling )?frustrated",
-        r"i feel (?:so |really |very |extremely )?frustrated",
-        r"i(?:'m| am) (?:feeling )?irritated",
-        r"i feel (?:so |really |very |extremely )?irritated",
-        r"i(?:'m| am) (?:feeling )?annoyed",
-        r"i feel (?:so |really |very |extremely )?annoyed",
-        r"i(?:'m| am) (?:feeling )?upset",
-        r"i feel (?:so |really |very |extremely )?upset",
-        r"i(?:'m| am) (?:feeling )?tired",
-        r"i feel (?:so |really |very |extremely )?tired",
-        r"i(?:'m| am) (?:feeling )?exhausted",
-        r"i feel (?:so |really |very |extremely )?exhausted",
-        r"i(?:'m| am) (?:feeling )?drained",
-        r"i feel (?:so |really |very |extremely )?drained",
         r"i(?:'m| am) (?:having|experiencing) a bad day",
         r"i(?:'m| am) (?:having|experiencing) a terrible day",
         r"i(?:'m| am) (?:having|experiencing) a horrible day",
@@ -214,26 +154,38 @@ NEGATIVE_MOOD_PATTERNS = {
         r"today is (?:so |really |very |extremely )?bad",
         r"today is (?:so |really |very |extremely )?terrible",
         r"today is (?:so |really |very |extremely )?horrible",
-        r"today is the worst",
-        r"everything is going wrong",
-        r"nothing is going right",
-        r"i hate everything",
-        r"i hate my life",
-        r"i(?:'m| am) (?:feeling )?like a failure",
-        r"i feel (?:so |really |very |extremely )?like a failure",
-        r"i(?:'m| am) (?:feeling )?useless",
-        r"i feel (?:so |really |very |extremely )?useless",
-        r"i(?:'m| am) (?:feeling )?inadequate",
-        r"i feel (?:so |really |very |extremely )?inadequate",
-        r"i(?:'m| am) (?:feeling )?not good enough",
-        r"i feel (?:so |really |very |extremely )?not good enough",
-        r"i(?:'m| am) (?:feeling )?a disappointment",
-        r"i feel (?:so |really |very |extremely )?a disappointment",
-        r"i(?:'m| am) (?:feeling )?a burden",
-        r"i feel (?:so |really |very |extremely )?a burden"
+        "today is the worst",
+        "everything is going wrong",
+        "nothing is going right",
+        "i hate everything",
+        "i hate my life"
     ]
 }
 
+# Lexicon of mood word -> mood types it signals
+NEGATIVE_MOOD_LEXICON = {}
+for mood_type, words in NEGATIVE_MOOD_WORDS.items():
+    for word in words:
+        NEGATIVE_MOOD_LEXICON.setdefault(word, []).append(mood_type)
+
+# Number of a mood type's words listed before its free-form phrases in the original table
+NEGATIVE_MOOD_PHRASE_POSITIONS = {
+    "sadness": 6,
+    "depression": 6,
+    "bad_mood": 8
+}
+
+# Full pattern list per mood type in the original table order, kept for compatibility with
+# code that reads the patterns; detect_negative_mood reports matches in this order
+NEGATIVE_MOOD_PATTERNS = {}
+for mood_type, words in NEGATIVE_MOOD_WORDS.items():
+    position = NEGATIVE_MOOD_PHRASE_POSITIONS.get(mood_type, len(words))
+    NEGATIVE_MOOD_PATTERNS[mood_type] = (
+        [frame + word for word in words[:position] for frame in NEGATIVE_MOOD_FRAMES]
+        + NEGATIVE_MOOD_PHRASES.get(mood_type, [])
+        + [frame + word for word in words[position:] for frame in NEGATIVE_MOOD_FRAMES]
+    )
+
 # Encouraging quotes for different moods
 ENCOURAGING_QUOTES = {
     "sadness": [
@@ -314,25 +266,76 @@ LOVABLE_LINES = {
     ]
 }
 
-# User mood tracking
-user_mood_history = {}
+# Position of every pattern in NEGATIVE_MOOD_PATTERNS, used to report matches in table order
+NEGATIVE_MOOD_PATTERN_ORDER = {}
+for mood_type, patterns in NEGATIVE_MOOD_PATTERNS.items():
+    for pattern in patterns:
+        NEGATIVE_MOOD_PATTERN_ORDER[(mood_type, pattern)] = len(NEGATIVE_MOOD_PATTERN_ORDER)
+
+# Frames and mood words are matched with one frame scan plus a lexicon lookup
+negative_mood_frames = FrameMatcher()
+for frame in NEGATIVE_MOOD_FRAMES:
+    negative_mood_frames.add_frame(frame)
+for word in NEGATIVE_MOOD_LEXICON:
+    negative_mood_frames.add_word(word, word)
+
+# Register the free-form phrases with the shared detection engine
+register_table("negative_mood", [(phrase, (mood_type, phrase)) for mood_type, phrases in NEGATIVE_MOOD_PHRASES.items() for phrase in phrases])
+
+def match_negative_mood_frames(text):
+    """
+    Find the frame and mood word combinations in a normalized message.
+
+    Args:
+        text (str): The normalized (lowercased) message
 
-def detect_negative_mood(text, user_id):
+    Returns:
+        list: (mood_type, pattern) pairs, one per matched pattern of NEGATIVE_MOOD_PATTERNS
+    """
+    matches = []
+    for frame, word in negative_mood_frames.matches(text):
+        pattern = NEGATIVE_MOOD_FRAMES[frame] + word
+        for mood_type in NEGATIVE_MOOD_LEXICON[word]:
+            matches.append((mood_type, pattern))
+    return matches
+
+# Minimum time between two encouragements for the same mood
+ENCOURAGEMENT_COOLDOWN_SECONDS = 60 * 60
+
+# User mood tracking, kept in the shared session store; values read from it have to be
+# assigned back after they are changed
+user_mood_history = session_namespace("mood")
+
+def detect_negative_mood(text, user_id, detection=None):
     """
     Detect negative moods in the user's message.
 
     Args:
         text (str): The user's message
         user_id (str): Unique identifier for the user
+        detection (Detection, optional): Result of detection_engine.detect for the message
 
     Returns:
         dict: Detection results including mood type and matched patterns
     """
-    text = text.lower()
+    detection = detection or detect(text)
+
+    # Check for mood patterns
+    detected_moods = {}
+
+    hits = match_negative_mood_frames(detection.text) + detection.hits("negative_mood")
+    for mood_type, pattern in sorted(hits, key=NEGATIVE_MOOD_PATTERN_ORDER.get):
+        if mood_type not in detected_moods:
+            detected_moods[mood_type] = []
+        detected_moods[mood_type].append(pattern)
+
+    if not detected_moods:
+        return {"has_negative_mood": False}
 
     # Initialize or get user history
-    if user_id not in user_mood_history:
-        user_mood_history[user_id] = {
+    history = user_mood_history.get(user_id)
+    if history is None:
+        history = {
             "moods": [],
             "last_encouragement": {
                 "sadness": None,
@@ -341,30 +344,16 @@ def detect_negative_mood(text, user_id):
             }
         }
 
-    # Check for mood patterns
-    detected_moods = {}
-
-    for mood_type, patterns in NEGATIVE_MOOD_PATTERNS.items():
-        for pattern in patterns:
-            if re.search(pattern, text):
-                if mood_type not in detected_moods:
-                    detected_moods[mood_type] = []
-                detected_moods[mood_type].append(pattern)
-
-    if not detected_moods:
-        return {"has_negative_mood": False}
-
     # Update user mood history
-    timestamp = datetime.now().isoformat()
+    timestamp = time.time()
     for mood_type in detected_moods:
-        user_mood_history[user_id]["moods"].append({
-            "type": mood_type,
-            "timestamp": timestamp
-        })
+        history["moods"].append(MoodEvent(mood_type, timestamp))
 
     # Limit history to last 20 mood entries
-    if len(user_mood_history[user_id]["moods"]) > 20:
-        user_mood_history[user_id]["moods"] = user_mood_history[user_id]["moods"][-20:]
+    if len(history["moods"]) > 20:
+        history["moods"] = history["moods"][-20:]
+
+    user_mood_history[user_id] = history
 
     return {
         "has_negative_mood": True,
@@ -398,13 +387,13 @@ def get_encouragement(mood_info, user_id):
         primary_mood = "depression"
 
     # Check if we've recently provided encouragement for this mood
-    last_encouragement = user_mood_history[user_id]["last_encouragement"].get(primary_mood)
+    history = user_mood_history[user_id]
+    last_encouragement = history["last_encouragement"].get(primary_mood)
     should_provide = True
 
     if last_encouragement:
-        last_time = datetime.fromisoformat(last_encouragement)
         # Don't provide encouragement for the same mood more than once per hour
-        if datetime.now() - last_time < timedelta(hours=1):
+        if seconds_since(last_encouragement) < ENCOURAGEMENT_COOLDOWN_SECONDS:
             should_provide = False
 
     if not should_provide:
@@ -415,7 +404,8 @@ def get_encouragement(mood_info, user_id):
     lovable_line = random.choice(LOVABLE_LINES.get(primary_mood, []))
 
     # Update last encouragement timestamp
-    user_mood_history[user_id]["last_encouragement"][primary_mood] = datetime.now().isoformat()
+    history["last_encouragement"][primary_mood] = time.time()
+    user_mood_history[user_id] = history
 
     return {
         "mood_type": primary_mood,
@@ -452,18 +442,19 @@ def format_encouragement_response(encouragement):
 
     return response
 
-def process_mood(text, user_id):
+def process_mood(text, user_id, detection=None):
     """
     Process text to detect negative moods and generate encouragement.
 
     Args:
         text (str): The user's message
         user_id (str): Unique identifier for the user
+        detection (Detection, optional): Result of detection_engine.detect for the message
 
     Returns:
         dict: Processing results including detection and encouragement
     """
-    mood_info = detect_negative_mood(text, user_id)
+    mood_info = detect_negative_mood(text, user_id, detection)
 
     if not mood_info.get("has_negative_mood", False):
         return {"has_negative_mood": False}
@@ -0,0 +1,290 @@
+"""
+Phrase matching utilities for scanning a message against many literal phrases at once.
+
+The detector modules keep large tables of phrases. Running each phrase through its own
+regular expression costs one scan of the message per phrase, so the literal phrases are
+compiled once into an Aho-Corasick automaton that reports every phrase in a single pass.
+"""
+
+
+def is_word_char(char):
+    """
+    Check whether a character counts as a word character, the same way `\\w` does in `re`.
+
+    Args:
+        char (str): A single character
+
+    Returns:
+        bool: True if the character is alphanumeric or an underscore
+    """
+    return char.isalnum() or char == "_"
+
+
+def is_word_boundary(text, index):
+    """
+    Check whether there is a word boundary at a position, the same way `\\b` does in `re`.
+
+    Args:
+        text (str): The text being scanned
+        index (int): Position between two characters (0 to len(text))
+
+    Returns:
+        bool: True if exactly one side of the position is a word character
+    """
+    before = index > 0 and is_word_char(text[index - 1])
+    after = index < len(text) and is_word_char(text[index])
+    return before != after
+
+
+def is_literal_pattern(pattern):
+    """
+    Check whether a regex pattern is a plain literal phrase with no special syntax.
+
+    Args:
+        pattern (str): The regex pattern
+
+    Returns:
+        bool: True if the pattern only matches its own text
+    """
+    return not any(char in pattern for char in "\\.^$*+?{}[]|()")
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton that finds every occurrence of a set of phrases in one scan.
+
+    Each phrase carries a value that is reported when the phrase is found. A phrase can be
+    marked as whole-word, in which case it only matches between word boundaries, like
+    wrapping it in `\\b...\\b`. Otherwise it matches anywhere, like `phrase in text`.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._phrases = [[]]
+        self._outputs = [[]]
+        self._built = False
+
+    def add(self, phrase, value, whole_word=False):
+        """
+        Add a phrase to the automaton.
+
+        Args:
+            phrase (str): The literal phrase to look for
+            value: The value reported when the phrase is found
+            whole_word (bool): Only match the phrase between word boundaries
+        """
+        if not phrase:
+            raise ValueError("Cannot add an empty phrase")
+
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._phrases.append([])
+                self._outputs.append([])
+            state = next_state
+
+        self._phrases[state].append((len(phrase), value, whole_word))
+        self._built = False
+
+    def build(self):
+        """
+        Compute the failure links. Called automatically on the first scan after an add.
+        """
+        self._fail = [0] * len(self._goto)
+        self._outputs = [list(phrases) for phrases in self._phrases]
+        queue = list(self._goto[0].values())
+
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                queue.append(next_state)
+
+        # States are visited shallowest first, so the failure state's outputs are
+        # already complete; longer phrases ending at a state are reported first.
+        for state in queue:
+            self._outputs[state] = self._outputs[state] + self._outputs[self._fail[state]]
+
+        self._built = True
+
+    def finditer(self, text):
+        """
+        Find every occurrence of every phrase in the text, including overlapping ones.
+
+        Args:
+            text (str): The text to scan
+
+        Yields:
+            tuple: (start, end, value) for each occurrence
+        """
+        if not self._built:
+            self.build()
+
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        state = 0
+
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            if outputs[state]:
+                end = index + 1
+                for length, value, whole_word in outputs[state]:
+                    start = end - length
+                    if whole_word and not (is_word_boundary(text, start) and is_word_boundary(text, end)):
+                        continue
+                    yield start, end, value
+
+    def matches(self, text):
+        """
+        Find which phrases occur in the text.
+
+        Args:
+            text (str): The text to scan
+
+        Returns:
+            set: The values of all phrases found at least once
+        """
+        return {value for _, _, value in self.finditer(text)}
+
+
+def expand_pattern(pattern, limit=64):
+    """
+    Expand a regex pattern that only uses `(?:a|b)` groups into the literal strings it matches.
+
+    Only literal text and non-nested non-capturing groups, optionally followed by `?`, are
+    supported. Anything else makes the pattern unexpandable.
+
+    Args:
+        pattern (str): The regex pattern
+        limit (int): Maximum number of literal strings to produce
+
+    Returns:
+        list: The literal strings in the order the regex would try them, or None if the
+            pattern uses other syntax or expands to more than `limit` strings
+    """
+    variants = [""]
+    index = 0
+
+    while index < len(pattern):
+        if pattern.startswith("(?:", index):
+            end = pattern.find(")", index)
+            if end == -1:
+                return None
+            alternatives = pattern[index + 3:end].split("|")
+            if not all(is_literal_pattern(alternative) for alternative in alternatives):
+                return None
+            index = end + 1
+            if index < len(pattern) and pattern[index] == "?":
+                alternatives.append("")
+                index += 1
+        elif is_literal_pattern(pattern[index]):
+            alternatives = [pattern[index]]
+            index += 1
+        else:
+            return None
+
+        if len(variants) * len(alternatives) > limit:
+            return None
+        variants = [variant + alternative for variant in variants for alternative in alternatives]
+
+    return variants
+
+
+class FrameMatcher:
+    """
+    Matcher for phrases made of a frame followed by a word, like `i feel (?:so )?X`.
+
+    Tables of such phrases repeat the same few frames with hundreds of different words.
+    Instead of one pattern per frame and word, the frames are expanded into their literal
+    heads and found with a single PhraseMatcher scan; each word is then looked up in a trie
+    starting where a head ends. Like the patterns it replaces, a word matches as a plain
+    substring right after the frame, so words that are prefixes of each other both match.
+    """
+
+    def __init__(self):
+        self._heads = PhraseMatcher()
+        self._frames = []
+        self._words = {}
+
+    def add_frame(self, frame, limit=64):
+        """
+        Add a frame.
+
+        Args:
+            frame (str): Regex pattern for the frame; only the syntax supported by
+                `expand_pattern` is allowed
+            limit (int): Maximum number of literal heads the frame may expand to
+
+        Returns:
+            int: Index of the frame, reported with every match
+        """
+        heads = expand_pattern(frame, limit)
+        if heads is None:
+            raise ValueError(f"Cannot expand frame: {frame}")
+
+        index = len(self._frames)
+        for head in heads:
+            self._heads.add(head, index)
+        self._frames.append(frame)
+        return index
+
+    def add_word(self, word, value):
+        """
+        Add a word that can follow any frame.
+
+        Args:
+            word (str): The literal word or phrase completing a frame
+            value: The value reported when the word is found after a frame
+        """
+        if not word:
+            raise ValueError("Cannot add an empty word")
+
+        node = self._words
+        for char in word:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(value)
+
+    def finditer(self, text):
+        """
+        Find every frame followed by a word in the text.
+
+        Args:
+            text (str): The text to scan
+
+        Yields:
+            tuple: (start, end, frame, value) for each occurrence
+        """
+        for start, head_end, frame in self._heads.finditer(text):
+            node = self._words
+            index = head_end
+            while index < len(text):
+                node = node.get(text[index])
+                if node is None:
+                    break
+                index += 1
+                for value in node.get(None, []):
+                    yield start, index, frame, value
+
+    def matches(self, text):
+        """
+        Find which frame and word combinations occur in the text.
+
+        Args:
+            text (str): The text to scan
+
+        Returns:
+            set: (frame, value) pairs found at least once
+        """
+        return {(frame, value) for _, _, frame, value in self.finditer(text)}
@@ -3,9 +3,9 @@ Positive responses module for detecting happy moods and providing
 enthusiastic, celebratory responses to reinforce positive emotions.
 """
 
-import re
 import random
 from datetime import datetime
+from detection_engine import detect, register_table
 
 # Patterns to identify positive moods
 POSITIVE_MOOD_PATTERNS = [
@@ -287,23 +287,24 @@ POSITIVE_AFFIRMATIONS = [
     "Your positive mood is not just luck - it's something you've created through your choices and perspective."
 ]
 
-def detect_positive_mood(text):
+# Register the positive mood patterns with the shared detection engine
+register_table("positive_mood", [(pattern, pattern) for pattern in POSITIVE_MOOD_PATTERNS], whole_word=True)
+
+def detect_positive_mood(text, detection=None):
     """
     Detect positive moods in the user's message.
     
     Args:
         text (str): The user's message
+        detection (Detection, optional): Result of detection_engine.detect for the message
         
     Returns:
         dict: Detection results including matched patterns
     """
-    text = text.lower()
+    detection = detection or detect(text)
     
     # Check for positive mood patterns
-    matches = []
-    for pattern in POSITIVE_MOOD_PATTERNS:
-        if re.search(r'\b' + pattern + r'\b', text):
-            matches.append(pattern)
+    matches = list(detection.hits("positive_mood"))
     
     if not matches:
         return {"has_positive_mood": False}
@@ -348,17 +349,18 @@ def format_positive_response(positive_response_data):
     
     return formatted_response
 
-def process_positive_mood(text):
+def process_positive_mood(text, detection=None):
     """
     Process text to detect positive moods and generate enthusiastic responses.
     
     Args:
         text (str): The user's message
+        detection (Detection, optional): Result of detection_engine.detect for the message
         
     Returns:
         dict: Processing results including detection and response
     """
-    mood_info = detect_positive_mood(text)
+    mood_info = detect_positive_mood(text, detection)
     
     if not mood_info.get("has_positive_mood", False):
         return {"has_positive_mood": False}
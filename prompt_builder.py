@@ -0,0 +1,188 @@
+"""
+Token-budgeted prompts from conversation histories.
+
+The LLM backends send the model the system prompt and as many of the conversation's most
+recent turns as fit within a token budget, so replies can refer back to what the user
+said before without payloads that grow until generation slows down or the model's
+context overflows. The newest message is always included.
+
+Token counts are estimates, close to what a BPE tokenizer produces for English text and
+good enough to keep a prompt within its budget without a tokenizer dependency. Each
+message is counted once: the count is kept on its MessageRecord and saved with it in the
+session store, so packing a prompt only adds up cached numbers.
+
+The same selection of messages can be formatted as a Llama 2 chat prompt
+(`[INST] ... [/INST]`) or as chat completion messages. The Llama format's markers are
+taken out of the messages, so text such as "</s>" can't end a turn early.
+
+Configured with environment variables:
+
+- PROMPT_TOKEN_BUDGET: Tokens a prompt may take, system prompt included (default 1024)
+"""
+
+import os
+import re
+
+from records import ROLE_SYSTEM, ROLE_USER
+
+DEFAULT_PROMPT_TOKEN_BUDGET = 1024
+
+# Tokens for a message's role and the markers around it; the [INST] markers of the Llama
+# format take about this many
+MESSAGE_OVERHEAD_TOKENS = 8
+
+# Words and single punctuation marks; a word takes about one token per 4 characters
+TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+# Markers of the Llama 2 chat format, which must not appear inside a message
+LLAMA_MARKERS = re.compile(r"</?s>|\[/?INST\]|<</?SYS>>")
+
+def count_tokens(text):
+    """
+    Estimate the number of tokens in a text.
+
+    Args:
+        text (str): The text
+
+    Returns:
+        int: Estimated token count
+    """
+    return sum((len(piece) + 3) // 4 for piece in TOKEN_PIECES.findall(text))
+
+def escape_llama_markers(text):
+    """
+    Take the Llama 2 chat format's markers out of a message.
+
+    Args:
+        text (str): Message content
+
+    Returns:
+        str: The content without `<s>`, `</s>`, `[INST]`, `[/INST]`, `<<SYS>>` or `<</SYS>>`
+    """
+    return LLAMA_MARKERS.sub("", text)
+
+def message_tokens(message):
+    """
+    Get a message's token count, counting it on first use.
+
+    Args:
+        message (MessageRecord): The message
+
+    Returns:
+        int: Estimated tokens the message takes in a prompt
+    """
+    if message.tokens is None:
+        message.tokens = count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+    return message.tokens
+
+class PromptBuilder:
+    """
+    Packs conversation histories into prompts of a bounded size.
+
+    Args:
+        max_tokens (int): Tokens a prompt may take, system prompt included
+    """
+
+    def __init__(self, max_tokens=DEFAULT_PROMPT_TOKEN_BUDGET):
+        self.max_tokens = max_tokens
+
+    def pack(self, history, system_message=None):
+        """
+        Pick the system prompt and the most recent turns that fit within the budget.
+
+        Args:
+            history (ConversationHistory): The conversation, newest message last
+            system_message (MessageRecord): System prompt to use instead of the history's
+
+        Returns:
+            tuple: (system message or None, list of turns oldest first). The newest turn
+                is there even if it doesn't fit on its own.
+        """
+        if system_message is None:
+            system_message = history.system_message
+        budget = self.max_tokens - (message_tokens(system_message) if system_message is not None else 0)
+
+        turns = []
+        for message in reversed(history.turns):
+            tokens = message_tokens(message)
+            if turns and tokens > budget:
+                break
+            turns.append(message)
+            budget -= tokens
+        turns.reverse()
+        return system_message, turns
+
+    def chat_messages(self, history, system_message=None):
+        """
+        Build the messages of a chat completion request.
+
+        Args:
+            history (ConversationHistory): The conversation, newest message last
+            system_message (MessageRecord): System prompt to use instead of the history's
+
+        Returns:
+            list: {"role", "content"} dicts, system message first
+        """
+        system_message, turns = self.pack(history, system_message)
+        messages = [] if system_message is None else [system_message.as_chat_message()]
+        messages.extend(message.as_chat_message() for message in turns)
+        return messages
+
+    def llama_prompt(self, history, system_message=None):
+        """
+        Build a Llama 2 chat prompt.
+
+        Args:
+            history (ConversationHistory): The conversation, newest message last
+            system_message (MessageRecord): System prompt to use instead of the history's
+
+        Returns:
+            str: The prompt, ending with the newest user message's [/INST]
+        """
+        return llama_prompt(self.chat_messages(history, system_message))
+
+def llama_prompt(messages):
+    """
+    Format chat messages as a Llama 2 chat prompt.
+
+    User messages that follow each other are joined into one [INST] block, and a reply
+    without a user message before it is left out, as the format has no place for it. The
+    format's markers are taken out of every message.
+
+    Args:
+        messages (list): {"role", "content"} dicts, a system message first if there is one
+
+    Returns:
+        str: The prompt
+    """
+    system = None
+    if messages and messages[0]["role"] == ROLE_SYSTEM:
+        system = escape_llama_markers(messages[0]["content"])
+        messages = messages[1:]
+
+    exchanges = []
+    user_parts = []
+    for message in messages:
+        if message["role"] == ROLE_USER:
+            user_parts.append(escape_llama_markers(message["content"]))
+        elif user_parts:
+            exchanges.append(("\n".join(user_parts), escape_llama_markers(message["content"])))
+            user_parts = []
+
+    blocks = []
+    for index, (user, reply) in enumerate(exchanges + [("\n".join(user_parts), None)]):
+        if reply is None and not user_parts:
+            break
+        if index == 0 and system is not None:
+            user = f"<<SYS>>\n{system}\n<</SYS>>\n\n{user}"
+        blocks.append(f"<s>[INST] {user} [/INST]" + ("" if reply is None else f" {reply} </s>"))
+    return "".join(blocks)
+
+def create_prompt_builder():
+    """
+    Create a prompt builder with the budget from PROMPT_TOKEN_BUDGET.
+
+    Returns:
+        PromptBuilder: The builder
+    """
+    return PromptBuilder(int(os.getenv("PROMPT_TOKEN_BUDGET", DEFAULT_PROMPT_TOKEN_BUDGET)))
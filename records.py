@@ -0,0 +1,148 @@
+"""
+Compact records for the per-session histories.
+
+Conversation messages and mood events are stored for every active session, so they use
+`__slots__` instead of a per-instance dict, keep their timestamp as a float epoch
+(`time.time()`), and intern the small set of role and mood names. Timestamps are only
+turned into ISO-8601 strings by `to_dict`, where a record leaves the application.
+"""
+
+import sys
+import time
+from datetime import datetime
+
+# Roles used in the conversation histories
+ROLE_SYSTEM = "system"
+ROLE_USER = "user"
+ROLE_ASSISTANT = "assistant"
+ROLE_BOT = "bot"
+
+def isoformat(timestamp):
+    """
+    Convert an epoch timestamp to the ISO-8601 string format used by the API.
+
+    Args:
+        timestamp (float): Seconds since the epoch, or None
+
+    Returns:
+        str: Local time in ISO-8601 format, or None
+    """
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+def seconds_since(timestamp):
+    """
+    Get the number of seconds elapsed since an epoch timestamp.
+
+    Args:
+        timestamp (float): Seconds since the epoch
+
+    Returns:
+        float: Elapsed seconds
+    """
+    return time.time() - timestamp
+
+class MessageRecord:
+    """
+    One message in a conversation history.
+
+    Attributes:
+        role (str): Who sent the message, e.g. ROLE_USER
+        content (str): Message text
+        timestamp (float): When the message was sent, in seconds since the epoch, or None
+        tokens (int): The message's token count once prompt_builder has counted it, or None
+    """
+
+    __slots__ = ("role", "content", "timestamp", "tokens")
+
+    def __init__(self, role, content, timestamp=None, tokens=None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = timestamp
+        self.tokens = tokens
+
+    @classmethod
+    def now(cls, role, content):
+        """
+        Create a record timestamped with the current time.
+
+        Args:
+            role (str): Who sent the message
+            content (str): Message text
+
+        Returns:
+            MessageRecord: The new record
+        """
+        return cls(role, content, time.time())
+
+    def as_chat_message(self):
+        """
+        Get the message in the {"role", "content"} format chat completion APIs expect.
+
+        Returns:
+            dict: The role and content
+        """
+        return {"role": self.role, "content": self.content}
+
+    def to_dict(self):
+        """
+        Get the message as a dict with an ISO-8601 timestamp.
+
+        Returns:
+            dict: The role, content and timestamp
+        """
+        message = {"role": self.role, "content": self.content}
+        if self.timestamp is not None:
+            message["timestamp"] = isoformat(self.timestamp)
+        return message
+
+    def __reduce__(self):
+        # Pickle as a plain constructor call, which keeps stored sessions small. The token
+        # count goes with the message, so it is only counted once.
+        if self.tokens is None:
+            return (MessageRecord, (self.role, self.content, self.timestamp))
+        return (MessageRecord, (self.role, self.content, self.timestamp, self.tokens))
+
+    def __eq__(self, other):
+        if not isinstance(other, MessageRecord):
+            return NotImplemented
+        return (self.role, self.content, self.timestamp) == (other.role, other.content, other.timestamp)
+
+    def __repr__(self):
+        return f"MessageRecord({self.role!r}, {self.content!r}, {self.timestamp!r})"
+
+class MoodEvent:
+    """
+    One detected mood in a user's mood history.
+
+    Attributes:
+        type (str): Mood type, e.g. "sadness"
+        timestamp (float): When the mood was detected, in seconds since the epoch
+    """
+
+    __slots__ = ("type", "timestamp")
+
+    def __init__(self, type, timestamp):
+        self.type = sys.intern(type)
+        self.timestamp = timestamp
+
+    def to_dict(self):
+        """
+        Get the event as a dict with an ISO-8601 timestamp.
+
+        Returns:
+            dict: The mood type and timestamp
+        """
+        return {"type": self.type, "timestamp": isoformat(self.timestamp)}
+
+    def __reduce__(self):
+        return (MoodEvent, (self.type, self.timestamp))
+
+    def __eq__(self, other):
+        if not isinstance(other, MoodEvent):
+            return NotImplemented
+        return (self.type, self.timestamp) == (other.type, other.timestamp)
+
+    def __repr__(self):
+        return f"MoodEvent({self.type!r}, {self.timestamp!r})"
@@ -0,0 +1,378 @@
+"""
+Append-only journal that lets the in-memory session store survive a restart.
+
+Every change to a MemorySessionStore (a value set, a value or a whole session deleted)
+is encoded as one binary record and handed to a background writer thread, so requests
+never wait for the disk. The writer appends the records to the current journal segment,
+flushes after every batch and fsyncs at a fixed interval.
+
+When a segment grows past `compact_bytes`, the writer starts a new segment and a
+compaction thread folds the previous snapshot and the finished segments into a new
+snapshot, dropping expired sessions and overwritten values. On startup the store is
+restored from the latest snapshot plus the segments written after it. Both are read
+through `mmap`, and the store keeps values pickled, so restoring is mostly a scan over
+the files.
+
+Files in the journal directory:
+
+- snapshot-<N>.bin: State of every session as of the start of segment N
+- journal-<N>.log: Changes made while segment N was current
+
+Records are framed as: CRC32, operation, timestamp, then the lengths and bytes of the
+session id, namespace and pickled value. A record that is cut short or fails its CRC
+marks the end of a segment, as happens when the process dies mid-write.
+
+A journal directory must only be used by one process at a time.
+"""
+
+import logging
+import mmap
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import zlib
+
+OP_SET = 1
+OP_DELETE = 2
+OP_DELETE_SESSION = 3
+
+SNAPSHOT_MAGIC = b"SESSNAP1"
+JOURNAL_MAGIC = b"SESJRNL1"
+
+# crc32, op, timestamp, session id length, namespace length, value length
+RECORD_HEADER = struct.Struct("<IBdHHI")
+
+DEFAULT_COMPACT_BYTES = 64 * 1024 * 1024
+DEFAULT_SYNC_INTERVAL = 1.0
+
+SNAPSHOT_FILE = re.compile(r"^snapshot-(\d+)\.bin$")
+JOURNAL_FILE = re.compile(r"^journal-(\d+)\.log$")
+
+_STOP = object()
+
+def encode_record(op, timestamp, session_id, namespace=b"", value=b""):
+    """
+    Encode one journal record.
+
+    Args:
+        op (int): OP_SET, OP_DELETE or OP_DELETE_SESSION
+        timestamp (float): When the change was made, in seconds since the epoch
+        session_id (bytes): Encoded session identifier
+        namespace (bytes): Encoded namespace, empty for OP_DELETE_SESSION
+        value (bytes): Pickled value, empty unless op is OP_SET
+
+    Returns:
+        bytes: The framed record
+    """
+    header = RECORD_HEADER.pack(0, op, timestamp, len(session_id), len(namespace), len(value))
+    body = header[4:] + session_id + namespace + value
+    return struct.pack("<I", zlib.crc32(body)) + body
+
+def iter_records(path, magic):
+    """
+    Read the records of a snapshot or journal segment.
+
+    Reading stops at the first incomplete or corrupt record.
+
+    Args:
+        path (str): File to read
+        magic (bytes): Expected file header
+
+    Yields:
+        tuple: (op, timestamp, session_id, namespace, value), with str ids and bytes values
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size <= len(magic):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped[:len(magic)] != magic:
+                logging.error(f"Ignoring {path}: not a session journal file")
+                return
+            view = memoryview(mapped)
+            try:
+                offset = len(magic)
+                size = len(mapped)
+                while offset + RECORD_HEADER.size <= size:
+                    crc, op, timestamp, id_length, namespace_length, value_length = RECORD_HEADER.unpack_from(mapped, offset)
+                    start = offset + RECORD_HEADER.size
+                    end = start + id_length + namespace_length + value_length
+                    if end > size or zlib.crc32(view[offset + 4:end]) != crc:
+                        logging.warning(f"Session journal {path} ends with an incomplete record at byte {offset}")
+                        return
+                    namespace_start = start + id_length
+                    value_start = namespace_start + namespace_length
+                    yield (
+                        op,
+                        timestamp,
+                        str(view[start:namespace_start], "utf-8"),
+                        str(view[namespace_start:value_start], "utf-8"),
+                        bytes(view[value_start:end]),
+                    )
+                    offset = end
+            finally:
+                view.release()
+
+def apply_record(sessions, record, ttl_seconds):
+    """
+    Apply one record to a replayed state.
+
+    Args:
+        sessions (dict): session id -> [updated_at, {namespace: pickled value}]
+        record (tuple): Record from `iter_records`
+        ttl_seconds (float): Session time to live, so a session written after it expired
+            starts over empty as it does in the store
+    """
+    op, timestamp, session_id, namespace, value = record
+    if op == OP_SET:
+        session = sessions.get(session_id)
+        if session is None or timestamp - session[0] > ttl_seconds:
+            session = sessions[session_id] = [timestamp, {}]
+        session[0] = timestamp
+        session[1][namespace] = value
+    elif op == OP_DELETE:
+        session = sessions.get(session_id)
+        if session is not None:
+            session[1].pop(namespace, None)
+            if not session[1]:
+                del sessions[session_id]
+    elif op == OP_DELETE_SESSION:
+        sessions.pop(session_id, None)
+
+class SessionJournal:
+    """
+    Journal and snapshots of a MemorySessionStore in one directory.
+
+    Args:
+        directory (str): Directory holding the snapshots and journal segments
+        ttl_seconds (float): Session time to live; expired sessions are not restored
+        compact_bytes (int): Segment size that starts a new segment and a compaction
+        sync_interval (float): Seconds between fsyncs of the current segment
+    """
+
+    def __init__(self, directory, ttl_seconds, compact_bytes=DEFAULT_COMPACT_BYTES, sync_interval=DEFAULT_SYNC_INTERVAL):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.compact_bytes = compact_bytes
+        self.sync_interval = sync_interval
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._compactor = None
+        self._file = None
+        self._segment = None
+        self._segment_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind, number):
+        return os.path.join(self.directory, f"{kind}-{number:08d}.{'bin' if kind == 'snapshot' else 'log'}")
+
+    def _files(self, pattern):
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _replay(self, before=None):
+        """
+        Rebuild the state from the latest snapshot and the segments after it.
+
+        Args:
+            before (int): Only replay segments numbered below this one
+
+        Returns:
+            tuple: (snapshot number or 0, sessions dict as in `apply_record`)
+        """
+        snapshots = [number for number in self._files(SNAPSHOT_FILE) if before is None or number <= before]
+        snapshot = snapshots[-1] if snapshots else 0
+        sessions = {}
+        if snapshot:
+            for record in iter_records(self._path("snapshot", snapshot), SNAPSHOT_MAGIC):
+                apply_record(sessions, record, self.ttl_seconds)
+        for number in self._files(JOURNAL_FILE):
+            if number >= snapshot and (before is None or number < before):
+                for record in iter_records(self._path("journal", number), JOURNAL_MAGIC):
+                    apply_record(sessions, record, self.ttl_seconds)
+        cutoff = time.time() - self.ttl_seconds
+        return snapshot, {session_id: session for session_id, session in sessions.items() if session[0] >= cutoff}
+
+    def restore(self, store):
+        """
+        Load the journaled sessions into a store, then start journaling its changes.
+
+        Args:
+            store (MemorySessionStore): Empty store to restore into
+
+        Returns:
+            int: Number of sessions restored
+        """
+        start = time.perf_counter()
+        _, sessions = self._replay()
+        # Journaling starts first, so sessions the store evicts while loading stay evicted
+        store.journal = self
+        self.start()
+        # Oldest first, so the store's last-update order is rebuilt as it was
+        for session_id, (updated_at, values) in sorted(sessions.items(), key=lambda item: item[1][0]):
+            store.restore_session(session_id, values, updated_at)
+        # Fold what the previous run journaled into a snapshot, so the next restart
+        # replays as little as possible; segments with no records are just removed
+        compact = False
+        for number in self._files(JOURNAL_FILE):
+            path = self._path("journal", number)
+            if number >= self._segment:
+                continue
+            if os.path.getsize(path) > len(JOURNAL_MAGIC):
+                compact = True
+            else:
+                os.remove(path)
+        if compact:
+            self._start_compaction()
+        if sessions:
+            logging.info(f"Restored {len(sessions)} sessions from {self.directory} in {time.perf_counter() - start:.2f}s")
+        return len(sessions)
+
+    def start(self):
+        """
+        Open a new journal segment and start the writer thread.
+        """
+        existing = self._files(JOURNAL_FILE) + self._files(SNAPSHOT_FILE)
+        self._open_segment(max(existing, default=0) + 1)
+        self._writer = threading.Thread(target=self._write_loop, name="session-journal", daemon=True)
+        self._writer.start()
+
+    def record_set(self, namespace, session_id, value):
+        """
+        Journal a stored value. Returns immediately; the record is written in the background.
+
+        Args:
+            namespace (str): Namespace of the value
+            session_id (str): Session identifier
+            value (bytes): Pickled value
+        """
+        self._queue.put(encode_record(OP_SET, time.time(), session_id.encode(), namespace.encode(), value))
+
+    def record_delete(self, namespace, session_id):
+        """
+        Journal a deleted value.
+
+        Args:
+            namespace (str): Namespace of the value
+            session_id (str): Session identifier
+        """
+        self._queue.put(encode_record(OP_DELETE, time.time(), session_id.encode(), namespace.encode()))
+
+    def record_delete_session(self, session_id):
+        """
+        Journal a deleted session.
+
+        Args:
+            session_id (str): Session identifier
+        """
+        self._queue.put(encode_record(OP_DELETE_SESSION, time.time(), session_id.encode()))
+
+    def close(self):
+        """
+        Write out the queued records, fsync the segment and stop the writer thread.
+        """
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def _open_segment(self, number):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._segment = number
+        self._file = open(self._path("journal", number), "ab")
+        if self._file.tell() == 0:
+            self._file.write(JOURNAL_MAGIC)
+        self._segment_bytes = self._file.tell()
+
+    def _start_compaction(self):
+        self._compactor = threading.Thread(
+            target=self.compact, args=(self._segment,), name="session-journal-compaction", daemon=True
+        )
+        self._compactor.start()
+
+    def _write_loop(self):
+        last_sync = time.monotonic()
+        while True:
+            try:
+                record = self._queue.get(timeout=self.sync_interval)
+            except queue.Empty:
+                record = None
+            stop = record is _STOP
+            batch = [] if record is None or stop else [record]
+            # Drain whatever else is queued so a burst of changes is one write
+            while not stop:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                else:
+                    batch.append(record)
+
+            try:
+                if batch:
+                    data = b"".join(batch)
+                    self._file.write(data)
+                    self._file.flush()
+                    self._segment_bytes += len(data)
+                if stop or (batch and time.monotonic() - last_sync >= self.sync_interval):
+                    os.fsync(self._file.fileno())
+                    last_sync = time.monotonic()
+                if self._segment_bytes >= self.compact_bytes and (self._compactor is None or not self._compactor.is_alive()):
+                    self._open_segment(self._segment + 1)
+                    self._start_compaction()
+            except Exception as e:
+                logging.error(f"Error writing session journal: {e}")
+
+            if stop:
+                self._file.close()
+                self._file = None
+                return
+
+    def compact(self, segment):
+        """
+        Fold the latest snapshot and the segments before `segment` into a new snapshot.
+
+        Args:
+            segment (int): First segment the new snapshot does not include
+
+        Returns:
+            int: Number of sessions in the new snapshot
+        """
+        try:
+            snapshot, sessions = self._replay(before=segment)
+            path = self._path("snapshot", segment)
+            with open(path + ".tmp", "wb") as file:
+                file.write(SNAPSHOT_MAGIC)
+                for session_id, (updated_at, values) in sessions.items():
+                    encoded_id = session_id.encode()
+                    for namespace, value in values.items():
+                        file.write(encode_record(OP_SET, updated_at, encoded_id, namespace.encode(), value))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(path + ".tmp", path)
+
+            # The new snapshot is in place, so the files it replaces can go
+            for number in self._files(JOURNAL_FILE):
+                if number < segment:
+                    os.remove(self._path("journal", number))
+            for number in self._files(SNAPSHOT_FILE):
+                if number < segment:
+                    os.remove(self._path("snapshot", number))
+            logging.info(f"Compacted session journal into {path} ({len(sessions)} sessions)")
+            return len(sessions)
+        except Exception as e:
+            logging.error(f"Error compacting session journal: {e}")
+            return 0
@@ -0,0 +1,666 @@
+"""
+Bounded storage for per-session state.
+
+Everything the chatbot remembers about a session (conversation history, mood history,
+mental health history) lives in one SessionStore, keyed by session id and split into
+namespaces, so all of a session's state is expired or evicted together.
+
+Two implementations are provided:
+
+- MemorySessionStore keeps sessions in process, in LRU order, and enforces a time to live
+  and a global memory budget: hard caps on the number of sessions and on their total size. With a
+  journal directory configured, its changes are journaled in the background and the
+  sessions are restored on restart (see session_journal.py).
+- SQLiteSessionStore keeps sessions in a SQLite database in WAL mode, so they survive a
+  restart and can be shared by several worker processes.
+
+Modules get a dict-like view of their namespace with `session_namespace(name)`.
+Both stores keep values pickled and return a copy on every read, so code that changes a
+value in place must assign it back to the view afterwards.
+
+Expired sessions are removed by a background thread, in batches, in the order they
+expire; requests never scan the sessions themselves.
+
+Each store operation is atomic, but a request reads a value, changes it and writes it
+back. Requests wrap that in `session_lock(session_id)`, so requests of the same session
+run one at a time and never overwrite each other's changes, while requests of different
+sessions never wait on each other. The locks are per process: with several workers, two
+requests of one session served by different workers at the same time can still race.
+
+The store is configured with environment variables:
+
+- SESSION_STORE: "memory" (default) or "sqlite"
+- SESSION_DB_PATH: SQLite database path (default "sessions.db")
+- SESSION_TTL_SECONDS: Seconds a session is kept after its last update (default 86400)
+- SESSION_EXPIRY_INTERVAL: Seconds between background sweeps of expired sessions (default 60)
+- SESSION_MAX_ENTRIES: Maximum number of sessions kept in memory (default 10000)
+- SESSION_MAX_BYTES: Memory budget for the sessions kept in memory (default 64 MiB)
+- SESSION_JOURNAL_DIR: Directory to journal the in-memory store to (unset by default, no journal)
+- SESSION_JOURNAL_COMPACT_BYTES: Journal size that triggers a compaction into a snapshot (default 64 MiB)
+"""
+
+import atexit
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from session_journal import SessionJournal
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_DB_PATH = "sessions.db"
+DEFAULT_EXPIRY_INTERVAL = 60
+DEFAULT_JOURNAL_COMPACT_BYTES = 64 * 1024 * 1024
+DEFAULT_LOCK_STRIPES = 64
+
+# Approximate memory the memory store's bookkeeping takes per session (the session id,
+# its entry in the session order, its dicts and the headers of its pickled values, as
+# measured with three namespaces), added to the pickled size of the values
+SESSION_OVERHEAD_BYTES = 600
+
+class SessionStore:
+    """
+    Interface shared by the session store implementations.
+
+    Values are stored per (namespace, session id). Deleting a session removes its values
+    in every namespace.
+    """
+
+    def get(self, namespace, session_id, default=None):
+        """
+        Get a session's value in a namespace.
+
+        Args:
+            namespace (str): Namespace of the value
+            session_id (str): Session identifier
+            default: Returned when the session has no live value in the namespace
+
+        Returns:
+            The stored value, or `default`
+        """
+        raise NotImplementedError
+
+    def set(self, namespace, session_id, value):
+        """
+        Store a session's value in a namespace.
+
+        Args:
+            namespace (str): Namespace of the value
+            session_id (str): Session identifier
+            value: Any picklable value
+        """
+        raise NotImplementedError
+
+    def delete(self, namespace, session_id):
+        """
+        Delete a session's value in a namespace.
+
+        Args:
+            namespace (str): Namespace of the value
+            session_id (str): Session identifier
+
+        Returns:
+            bool: True if a value was deleted
+        """
+        raise NotImplementedError
+
+    def delete_session(self, session_id):
+        """
+        Delete a session's values in every namespace.
+
+        Args:
+            session_id (str): Session identifier
+        """
+        raise NotImplementedError
+
+    def session_ids(self, namespace):
+        """
+        List the sessions that have a live value in a namespace.
+
+        Args:
+            namespace (str): Namespace to list
+
+        Returns:
+            list: Session identifiers
+        """
+        raise NotImplementedError
+
+    def expire(self, batch_size=1000):
+        """
+        Remove every expired session.
+
+        Args:
+            batch_size (int): Number of sessions removed at a time
+
+        Returns:
+            int: Number of sessions removed
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Report the store's size, limits, and the sessions it evicted and expired.
+
+        Returns:
+            dict: Store statistics, safe to serialize as JSON
+        """
+        raise NotImplementedError
+
+    def namespace(self, name):
+        """
+        Get a dict-like view of one namespace.
+
+        Args:
+            name (str): Namespace name
+
+        Returns:
+            SessionNamespace: Mapping of session id to value
+        """
+        return SessionNamespace(self, name)
+
+class SessionNamespace(MutableMapping):
+    """
+    Dict-like view of one namespace of a SessionStore, keyed by session id.
+
+    A view created without a store uses the process-wide store, looked up on each access,
+    so modules can create their views at import time before the environment is loaded.
+    """
+
+    _missing = object()
+
+    def __init__(self, store, name):
+        self._store = store
+        self.name = name
+
+    @property
+    def store(self):
+        return self._store if self._store is not None else get_session_store()
+
+    def __getitem__(self, session_id):
+        value = self.store.get(self.name, session_id, self._missing)
+        if value is self._missing:
+            raise KeyError(session_id)
+        return value
+
+    def __setitem__(self, session_id, value):
+        self.store.set(self.name, session_id, value)
+
+    def __delitem__(self, session_id):
+        if not self.store.delete(self.name, session_id):
+            raise KeyError(session_id)
+
+    def __contains__(self, session_id):
+        return self.store.get(self.name, session_id, self._missing) is not self._missing
+
+    def __iter__(self):
+        return iter(self.store.session_ids(self.name))
+
+    def __len__(self):
+        return len(self.store.session_ids(self.name))
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process session store with a time to live and a memory budget.
+
+    Sessions are kept in the order they were last updated, which is also the order they
+    expire in: a session expires `ttl_seconds` after its last update, so expired sessions
+    are always at the front and `expire` only touches the sessions it removes. When there
+    are more than `max_entries` sessions, or they take more than `max_bytes`, the least
+    recently updated sessions are evicted.
+
+    Values are kept pickled, as in the SQLite store, so a session takes the size of its
+    pickled values plus SESSION_OVERHEAD_BYTES for the store's own bookkeeping, and that
+    is exactly what is counted against the budget. Sizes are totalled per namespace, and
+    the sessions evicted and expired are counted; `stats` reports both.
+
+    If `journal` is set (a SessionJournal), every change is also handed to it.
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, journal=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.journal = journal
+        self.total_bytes = 0
+        self.namespace_bytes = {}
+        self.evictions = {"max_entries": 0, "max_bytes": 0}
+        self.expired = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _live_session(self, session_id, now):
+        # Return the session's record, dropping it first if it has expired
+        session = self._sessions.get(session_id)
+        if session is not None and now - session["updated_at"] > self.ttl_seconds:
+            self._remove(session_id)
+            self.expired += 1
+            return None
+        return session
+
+    def _add_session(self, session_id, now):
+        session = self._sessions[session_id] = {"values": {}, "updated_at": now}
+        self.total_bytes += SESSION_OVERHEAD_BYTES
+        return session
+
+    def _resize(self, namespace, change):
+        self.total_bytes += change
+        self.namespace_bytes[namespace] = self.namespace_bytes.get(namespace, 0) + change
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            for namespace, data in session["values"].items():
+                self._resize(namespace, -len(data))
+            self.total_bytes -= SESSION_OVERHEAD_BYTES
+            if self.journal is not None:
+                self.journal.record_delete_session(session_id)
+
+    def _evict(self, keep_session_id, now):
+        # Expired sessions are dropped from the front first, then the least recently
+        # updated ones until the caps are met again; the session just written is kept
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session_id == keep_session_id:
+                break
+            if now - session["updated_at"] > self.ttl_seconds:
+                self.expired += 1
+            elif len(self._sessions) > self.max_entries:
+                self.evictions["max_entries"] += 1
+            elif self.total_bytes > self.max_bytes:
+                self.evictions["max_bytes"] += 1
+            else:
+                break
+            self._remove(session_id)
+
+    def get(self, namespace, session_id, default=None):
+        with self._lock:
+            session = self._live_session(session_id, time.monotonic())
+            if session is None or namespace not in session["values"]:
+                return default
+            data = session["values"][namespace]
+        return pickle.loads(data)
+
+    def set(self, namespace, session_id, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            now = time.monotonic()
+            session = self._live_session(session_id, now)
+            if session is None:
+                session = self._add_session(session_id, now)
+            self._resize(namespace, len(data) - len(session["values"].get(namespace, b"")))
+            session["values"][namespace] = data
+            session["updated_at"] = now
+            self._sessions.move_to_end(session_id)
+            if self.journal is not None:
+                self.journal.record_set(namespace, session_id, data)
+            self._evict(session_id, now)
+
+    def restore_session(self, session_id, values, updated_at):
+        """
+        Add a session restored from the journal, as the most recently updated one.
+
+        Args:
+            session_id (str): Session identifier
+            values (dict): Pickled value per namespace
+            updated_at (float): When the session was last updated, in seconds since the epoch
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._remove(session_id)
+            session = self._add_session(session_id, now - (time.time() - updated_at))
+            for namespace, data in values.items():
+                session["values"][namespace] = data
+                self._resize(namespace, len(data))
+            self._evict(session_id, now)
+
+    def delete(self, namespace, session_id):
+        with self._lock:
+            session = self._live_session(session_id, time.monotonic())
+            if session is None or namespace not in session["values"]:
+                return False
+            self._resize(namespace, -len(session["values"].pop(namespace)))
+            if self.journal is not None:
+                self.journal.record_delete(namespace, session_id)
+            if not session["values"]:
+                self._remove(session_id)
+            return True
+
+    def delete_session(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    def session_ids(self, namespace):
+        with self._lock:
+            now = time.monotonic()
+            return [
+                session_id for session_id, session in self._sessions.items()
+                if namespace in session["values"] and now - session["updated_at"] <= self.ttl_seconds
+            ]
+
+    def expire(self, batch_size=1000):
+        removed = 0
+        while True:
+            # The lock is released between batches so requests are not held up by a
+            # large backlog of expired sessions
+            with self._lock:
+                cutoff = time.monotonic() - self.ttl_seconds
+                for _ in range(batch_size):
+                    if not self._sessions:
+                        return removed
+                    session_id, session = next(iter(self._sessions.items()))
+                    if session["updated_at"] >= cutoff:
+                        return removed
+                    self._remove(session_id)
+                    self.expired += 1
+                    removed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "store": "memory",
+                "sessions": len(self._sessions),
+                "max_entries": self.max_entries,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "bytes_by_namespace": {namespace: size for namespace, size in self.namespace_bytes.items() if size},
+                "overhead_bytes": len(self._sessions) * SESSION_OVERHEAD_BYTES,
+                "evictions": dict(self.evictions),
+                "expired": self.expired,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    def __len__(self):
+        return len(self._sessions)
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store backed by a SQLite database in WAL mode.
+
+    Values are pickled into one row per (session id, namespace); a separate row per
+    session records when it was last updated, indexed so expired sessions can be found
+    without a table scan. Each thread, and each process after a fork, opens its own
+    connection. A session expires `ttl_seconds` after its last update.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.expired = 0
+        self._local = threading.local()
+        self._connection()
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS session_values ("
+                "session_id TEXT NOT NULL, namespace TEXT NOT NULL, value BLOB NOT NULL, "
+                "PRIMARY KEY (session_id, namespace))"
+            )
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _cutoff(self):
+        return time.time() - self.ttl_seconds
+
+    def get(self, namespace, session_id, default=None):
+        row = self._connection().execute(
+            "SELECT v.value FROM session_values v JOIN sessions s ON s.session_id = v.session_id "
+            "WHERE v.session_id = ? AND v.namespace = ? AND s.updated_at >= ?",
+            (session_id, namespace, self._cutoff())
+        ).fetchone()
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, namespace, session_id, value):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._transaction() as connection:
+            # An expired session that has not been swept yet starts over empty
+            connection.execute(
+                "DELETE FROM session_values WHERE session_id = ? "
+                "AND EXISTS (SELECT 1 FROM sessions WHERE session_id = ? AND updated_at < ?)",
+                (session_id, session_id, self._cutoff())
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO session_values (session_id, namespace, value) VALUES (?, ?, ?)",
+                (session_id, namespace, value)
+            )
+            connection.execute(
+                "INSERT INTO sessions (session_id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (session_id, time.time())
+            )
+
+    def delete(self, namespace, session_id):
+        cursor = self._connection().execute(
+            "DELETE FROM session_values WHERE session_id = ? AND namespace = ? "
+            "AND EXISTS (SELECT 1 FROM sessions WHERE session_id = ? AND updated_at >= ?)",
+            (session_id, namespace, session_id, self._cutoff())
+        )
+        return cursor.rowcount > 0
+
+    def delete_session(self, session_id):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM session_values WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def session_ids(self, namespace):
+        rows = self._connection().execute(
+            "SELECT v.session_id FROM session_values v JOIN sessions s ON s.session_id = v.session_id "
+            "WHERE v.namespace = ? AND s.updated_at >= ?",
+            (namespace, self._cutoff())
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def expire(self, batch_size=1000):
+        removed = 0
+        while True:
+            # Short transactions, so writers from requests only wait for one batch
+            with self._transaction() as connection:
+                session_ids = [row[0] for row in connection.execute(
+                    "SELECT session_id FROM sessions WHERE updated_at < ? ORDER BY updated_at LIMIT ?",
+                    (self._cutoff(), batch_size)
+                )]
+                if session_ids:
+                    placeholders = ", ".join("?" * len(session_ids))
+                    connection.execute(f"DELETE FROM session_values WHERE session_id IN ({placeholders})", session_ids)
+                    connection.execute(f"DELETE FROM sessions WHERE session_id IN ({placeholders})", session_ids)
+            removed += len(session_ids)
+            self.expired += len(session_ids)
+            if len(session_ids) < batch_size:
+                return removed
+
+    def stats(self):
+        connection = self._connection()
+        sessions = connection.execute(
+            "SELECT COUNT(*) FROM sessions WHERE updated_at >= ?", (self._cutoff(),)
+        ).fetchone()[0]
+        bytes_by_namespace = dict(connection.execute(
+            "SELECT namespace, SUM(LENGTH(value)) FROM session_values GROUP BY namespace"
+        ).fetchall())
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "store": "sqlite",
+            "sessions": sessions,
+            "bytes": sum(bytes_by_namespace.values()),
+            "bytes_by_namespace": bytes_by_namespace,
+            "database_bytes": page_count * page_size,
+            # Sessions this process expired; other workers keep their own count
+            "expired": self.expired,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+class ExpiryThread(threading.Thread):
+    """
+    Daemon thread that removes expired sessions from a store at a fixed interval.
+    """
+
+    def __init__(self, store, interval):
+        super().__init__(name="session-expiry", daemon=True)
+        self.store = store
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                removed = self.store.expire()
+                if removed:
+                    logging.info(f"Expired {removed} idle sessions")
+            except Exception as e:
+                logging.error(f"Error expiring sessions: {e}")
+
+    def stop(self):
+        self._stopped.set()
+
+class SessionLocks:
+    """
+    Reentrant per-session locks, striped so sessions only share bookkeeping.
+
+    A session id hashes to one of `stripes` stripes. The stripe's mutex only guards its
+    table of the sessions that hold or wait for a lock, for the length of a dict update;
+    the lock a request holds while it works belongs to its session alone. A session's lock
+    is created on first use and dropped once nobody holds or waits for it.
+    """
+
+    def __init__(self, stripes=DEFAULT_LOCK_STRIPES):
+        self._stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+
+    @contextmanager
+    def lock(self, session_id):
+        """
+        Hold a session's lock for the duration of a `with` block.
+
+        Args:
+            session_id (str): Session identifier
+        """
+        mutex, locks = self._stripes[hash(session_id) % len(self._stripes)]
+        with mutex:
+            entry = locks.get(session_id)
+            if entry is None:
+                entry = locks[session_id] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with mutex:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del locks[session_id]
+
+    def __len__(self):
+        # Number of sessions whose lock is held or waited for
+        return sum(len(locks) for _, locks in self._stripes)
+
+def create_session_store():
+    """
+    Create a session store from the SESSION_* environment variables.
+
+    Returns:
+        SessionStore: The configured store
+    """
+    kind = os.getenv("SESSION_STORE", "memory").lower()
+    ttl_seconds = float(os.getenv("SESSION_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+
+    if kind == "sqlite":
+        return SQLiteSessionStore(os.getenv("SESSION_DB_PATH", DEFAULT_DB_PATH), ttl_seconds=ttl_seconds)
+    if kind == "memory":
+        store = MemorySessionStore(
+            ttl_seconds=ttl_seconds,
+            max_entries=int(os.getenv("SESSION_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            max_bytes=int(os.getenv("SESSION_MAX_BYTES", DEFAULT_MAX_BYTES))
+        )
+        journal_dir = os.getenv("SESSION_JOURNAL_DIR")
+        if journal_dir:
+            journal = SessionJournal(
+                journal_dir,
+                ttl_seconds,
+                compact_bytes=int(os.getenv("SESSION_JOURNAL_COMPACT_BYTES", DEFAULT_JOURNAL_COMPACT_BYTES))
+            )
+            journal.restore(store)
+            atexit.register(journal.close)
+        return store
+    raise ValueError(f"Unknown SESSION_STORE: {kind}")
+
+_session_store = None
+_session_store_lock = threading.Lock()
+_expiry_thread = None
+_session_locks = SessionLocks()
+
+def session_lock(session_id):
+    """
+    Serialize the requests of one session.
+
+    Use it as `with session_lock(session_id):` around everything a request reads and
+    writes back in the session store.
+
+    Args:
+        session_id (str): Session identifier
+
+    Returns:
+        A context manager holding the session's lock
+    """
+    return _session_locks.lock(session_id)
+
+def session_namespace(name):
+    """
+    Get a dict-like view of a namespace of the process-wide session store.
+
+    Args:
+        name (str): Namespace name
+
+    Returns:
+        SessionNamespace: Mapping of session id to value
+    """
+    return SessionNamespace(None, name)
+
+def get_session_store():
+    """
+    Get the process-wide session store, creating it on first use.
+
+    The store's expired sessions are removed by a background thread every
+    SESSION_EXPIRY_INTERVAL seconds (default 60; 0 disables the thread).
+
+    Returns:
+        SessionStore: The shared store
+    """
+    global _session_store, _expiry_thread
+
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                store = create_session_store()
+                interval = float(os.getenv("SESSION_EXPIRY_INTERVAL", DEFAULT_EXPIRY_INTERVAL))
+                if interval > 0:
+                    _expiry_thread = ExpiryThread(store, interval)
+                    _expiry_thread.start()
+                _session_store = store
+    return _session_store
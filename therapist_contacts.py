@@ -2,8 +2,8 @@
 Therapist contacts module for suggesting professional mental health resources.
 """
 
-import re
 import random
+from detection_engine import detect, register_table
 
 # Patterns to identify therapist contact requests
 THERAPIST_REQUEST_PATTERNS = [
@@ -367,23 +367,24 @@ ADDITIONAL_RESOURCES = {
     ]
 }
 
-def detect_therapist_request(text):
+# Register the request patterns with the shared detection engine
+register_table("therapist_request", [(pattern, pattern) for pattern in THERAPIST_REQUEST_PATTERNS])
+
+def detect_therapist_request(text, detection=None):
     """
     Detect if the text contains a request for therapist contacts.
 
     Args:
         text (str): The user's message
+        detection (Detection, optional): Result of detection_engine.detect for the message
 
     Returns:
         dict: Detection results including matched patterns
     """
-    text = text.lower()
+    detection = detection or detect(text)
 
     # Check for therapist request patterns
-    matches = []
-    for pattern in THERAPIST_REQUEST_PATTERNS:
-        if re.search(pattern, text):
-            matches.append(pattern)
+    matches = list(detection.hits("therapist_request"))
 
     if not matches:
         return {"is_therapist_request": False}
@@ -470,17 +471,18 @@ def format_therapist_recommendations(therapists, include_additional_resources=Tr
 
     return response
 
-def process_therapist_request(text):
+def process_therapist_request(text, detection=None):
     """
     Process text to detect therapist requests and generate recommendations.
 
     Args:
         text (str): The user's message
+        detection (Detection, optional): Result of detection_engine.detect for the message
 
     Returns:
         dict: Processing results including detection and response
     """
-    request_info = detect_therapist_request(text)
+    request_info = detect_therapist_request(text, detection)
 
     if not request_info.get("is_therapist_request", False):
         return {"is_therapist_request": False}
@@ -2,9 +2,9 @@
 Wellness routines module for suggesting daily routines for mental and physical wellness.
 """
 
-import re
 import random
 from datetime import datetime
+from detection_engine import detect, register_table
 
 # Patterns to identify wellness routine requests
 WELLNESS_ROUTINE_PATTERNS = [
@@ -372,23 +372,25 @@ ALL_ROUTINES = {
     "general": GENERAL_WELLNESS_ROUTINES
 }
 
-def detect_wellness_routine_request(text):
+# Register the routine tables with the shared detection engine
+register_table("wellness_routine", [(pattern, pattern) for pattern in WELLNESS_ROUTINE_PATTERNS])
+register_table("routine_type", [(keyword, type_name) for type_name, keywords in ROUTINE_TYPE_KEYWORDS.items() for keyword in keywords], literal=True)
+
+def detect_wellness_routine_request(text, detection=None):
     """
     Detect if the text contains a request for wellness routines.
     
     Args:
         text (str): The user's message
+        detection (Detection, optional): Result of detection_engine.detect for the message
         
     Returns:
         dict: Detection results including matched patterns and routine type
     """
-    text = text.lower()
+    detection = detection or detect(text)
     
     # Check for wellness routine patterns
-    matches = []
-    for pattern in WELLNESS_ROUTINE_PATTERNS:
-        if re.search(pattern, text):
-            matches.append(pattern)
+    matches = list(detection.hits("wellness_routine"))
     
     if not matches:
         return {"is_routine_request": False}
@@ -397,9 +399,9 @@ def detect_wellness_routine_request(text):
     routine_type = "general"  # Default to general wellness
     
     # Check for specific routine types
-    type_matches = {}
-    for type_name, keywords in ROUTINE_TYPE_KEYWORDS.items():
-        type_matches[type_name] = sum(1 for keyword in keywords if keyword in text)
+    type_matches = {type_name: 0 for type_name in ROUTINE_TYPE_KEYWORDS}
+    for type_name in detection.hits("routine_type"):
+        type_matches[type_name] += 1
     
     # Find the type with the most keyword matches
     if type_matches:
@@ -460,17 +462,18 @@ def format_wellness_routine(routine):
     
     return response
 
-def process_wellness_routine_request(text):
+def process_wellness_routine_request(text, detection=None):
     """
     Process text to detect wellness routine requests and generate a response.
     
     Args:
         text (str): The user's message
+        detection (Detection, optional): Result of detection_engine.detect for the message
         
     Returns:
         dict: Processing results including detection and response
     """
-    routine_info = detect_wellness_routine_request(text)
+    routine_info = detect_wellness_routine_request(text, detection)
     
     if not routine_info.get("is_routine_request", False):
         return {"is_routine_request": False}